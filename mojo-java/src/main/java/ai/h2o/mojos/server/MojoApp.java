@@ -1,14 +1,42 @@
 package ai.h2o.mojos.server;
 
+import ai.h2o.mojos.server.core.MojoStore;
+import ai.h2o.mojos.server.core.PredictionCache;
+import ai.h2o.mojos.server.handlers.AliasHandler;
 import ai.h2o.mojos.server.handlers.HealthCheckHandler;
 import ai.h2o.mojos.server.handlers.LoadMojoHandler;
 import ai.h2o.mojos.server.handlers.MojoApiHandler;
+import ai.h2o.mojos.server.handlers.ShadowHandler;
 import ai.h2o.mojos.server.handlers.ShutdownHandler;
+import ai.h2o.mojos.server.handlers.StatsHandler;
 import com.beust.jcommander.JCommander;
 import com.beust.jcommander.Parameter;
 import hex.genmodel.MojoModel;
+import jnr.unixsocket.UnixSocketAddress;
+import jnr.unixsocket.UnixSocketChannel;
+import org.eclipse.jetty.server.LocalConnector;
+import org.eclipse.jetty.server.Request;
 import org.eclipse.jetty.server.Server;
+import org.eclipse.jetty.server.ServerConnector;
+import org.eclipse.jetty.server.handler.HandlerWrapper;
 import org.eclipse.jetty.servlet.ServletContextHandler;
+import org.eclipse.jetty.unixsocket.UnixSocketConnector;
+import org.eclipse.jetty.util.ajax.JSON;
+
+import javax.servlet.ServletException;
+import javax.servlet.http.HttpServletRequest;
+import javax.servlet.http.HttpServletResponse;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.OutputStream;
+import java.lang.management.ManagementFactory;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardCopyOption;
 
 
 /**
@@ -17,11 +45,41 @@ import org.eclipse.jetty.servlet.ServletContextHandler;
  *
  */
 public class MojoApp {
-  @Parameter(names = "--port", description = "Port on which the server is going to be listening.")
+  @Parameter(names = "--port", description = "Port on which the server is going to be listening (0 to let the OS choose a free port).")
   private int port = 54320;
 
+  @Parameter(names = "--socket", description = "Path of a Unix domain socket on which to run the server (instead of a network port).")
+  private String socket = null;
+
+  @Parameter(names = "--stdio", description = "Serve requests received over stdin / stdout instead of a network port.")
+  private boolean stdio = false;
+
+  @Parameter(names = "--lockfile", description = "File in which to advertise the running server (as a daemon). Not used with --stdio.")
+  private String lockfile = null;
+
+  @Parameter(names = "--idle-timeout", description = "Shut down after this many seconds without requests. Not used with --stdio.")
+  private int idleTimeout = 0;
+
+  @Parameter(names = "--ready-fd", description = "File descriptor (inherited from the parent process) on which to report that the server has started. Not used with --stdio.")
+  private int readyFd = -1;
+
+  @Parameter(names = "--max-models", description = "Maximum number of models kept in memory: the least recently used models are evicted, and loaded again when needed (0 for no limit).")
+  private int maxModels = 0;
+
+  @Parameter(names = "--max-model-mb", description = "Maximum total size (in MB) of the files of the models kept in memory, see --max-models (0 for no limit).")
+  private int maxModelMb = 0;
+
+  @Parameter(names = "--cache-size", description = "Number of predictions to cache, so that repeated rows are not scored again (0 disables the cache).")
+  private int cacheSize = 0;
+
+  @Parameter(names = "--snapshot", description = "File in which to record the loaded models, so that they are restored (with the same ids) when the server is started again with this file.")
+  private String snapshot = null;
+
   public static transient Server server;
 
+  /** Time of the start or end of the latest request (see {@link #startIdleWatchdog()}). */
+  private static volatile long lastActivity = System.currentTimeMillis();
+
 
   /**
    * This only handles parsing of command-line args. The real action occurs
@@ -46,17 +104,108 @@ public class MojoApp {
    * starts the (Jetty) server and then waits for incoming connections.
    */
   private void run() throws Exception {
-    server = new Server(port);
+    MojoStore.setBudget(maxModels, maxModelMb * 1024L * 1024L);
+    PredictionCache.setMaxSize(cacheSize);
+    if (snapshot != null)
+      MojoStore.warmUp(MojoStore.restoreSnapshot(snapshot));
+    if (stdio) {
+      runStdio();
+      return;
+    }
+    if (socket != null) {
+      removeStaleSocket(socket);
+      server = new Server();
+      // The connector removes the socket file when the server is stopped
+      UnixSocketConnector connector = new UnixSocketConnector(server);
+      connector.setUnixSocket(socket);
+      server.addConnector(connector);
+    } else {
+      server = new Server(port);
+    }
     server.setStopAtShutdown(true);
     registerEndpoints();
     try {
       server.start();
+      // With port 0 the OS assigns a free port, which is then reported to the client
+      if (socket == null)
+        port = ((ServerConnector) server.getConnectors()[0]).getLocalPort();
+      if (idleTimeout > 0)
+        startIdleWatchdog();
+      if (lockfile != null)
+        writeLockfile();
       // This phrase is searched for in backend.py. Please synchronize modifications.
-      System.out.println("MojoServer started on port " + port);
+      reportStatus("MojoServer started on " + address());
       server.join();  // Join the current thread and wait until server is done executing
-      System.out.println("MojoServer on port " + port + " has shut down.");
+      System.out.println("MojoServer on " + address() + " has shut down.");
     } catch (Exception e) {
-      System.out.println("MojoServer failed to start on port " + port + ": " + e);
+      reportStatus("MojoServer failed to start on " + address() + ": " + e);
+    }
+    System.exit(0);
+  }
+
+  /**
+   * Where the server listens: "port N" or "socket PATH".
+   */
+  private String address() {
+    return socket != null ? "socket " + socket : "port " + port;
+  }
+
+  /**
+   * Remove the socket file at {@code path} if it was left behind by a server that
+   * is no longer running (a socket cannot be bound while its file exists). If
+   * another server is still listening there, the file is kept, and then this
+   * server fails to start.
+   */
+  private static void removeStaleSocket(String path) {
+    File file = new File(path);
+    if (!file.exists())
+      return;
+    try {
+      UnixSocketChannel.open(new UnixSocketAddress(file)).close();
+    } catch (IOException e) {
+      file.delete();
+    }
+  }
+
+  /**
+   * Print the message that the server has started (or failed to), and also send
+   * it to the client through the readiness pipe {@code readyFd}, if it was given.
+   * The pipe is closed afterwards, so only the first status is sent.
+   */
+  private void reportStatus(String message) {
+    System.out.println(message);
+    if (readyFd < 0)
+      return;
+    // An inherited descriptor can only be opened by its path (this works on Linux and macOS)
+    try (OutputStream out = new FileOutputStream("/dev/fd/" + readyFd)) {
+      out.write((message + "\n").getBytes(StandardCharsets.UTF_8));
+    } catch (IOException e) {
+      System.out.println("Unable to report the status on fd " + readyFd + ": " + e);
+    }
+    readyFd = -1;
+  }
+
+  /**
+   * Same as {@link #run()}, except that the requests are received from the
+   * parent process over stdin, and the responses are written to stdout (see
+   * {@link StdioTransport}).
+   */
+  private void runStdio() throws Exception {
+    // The stdout carries the responses, so all other output is redirected to stderr
+    OutputStream frames = new FileOutputStream(FileDescriptor.out);
+    System.setOut(System.err);
+    server = new Server();
+    LocalConnector connector = new LocalConnector(server);
+    server.addConnector(connector);
+    registerEndpoints();
+    try {
+      server.start();
+      System.out.println("MojoServer started on stdio");
+      new StdioTransport(connector, System.in, frames).serve();
+      server.stop();
+      System.out.println("MojoServer on stdio has shut down.");
+    } catch (Exception e) {
+      System.out.println("MojoServer failed on stdio: " + e);
     }
     System.exit(0);
   }
@@ -70,7 +219,93 @@ public class MojoApp {
     handler.addServlet(MojoApiHandler.class, "/mojos/*");
     handler.addServlet(ShutdownHandler.class, "/shutdown");
     handler.addServlet(HealthCheckHandler.class, "/healthcheck");
-    server.setHandler(handler);
+    handler.addServlet(StatsHandler.class, "/stats");
+    handler.addServlet(AliasHandler.class, "/aliases/*");
+    handler.addServlet(ShadowHandler.class, "/shadows/*");
+    // Record the time of each request, for the idle watchdog
+    HandlerWrapper activity = new HandlerWrapper() {
+      @Override
+      public void handle(String target, Request baseRequest, HttpServletRequest request,
+                         HttpServletResponse response) throws IOException, ServletException {
+        lastActivity = System.currentTimeMillis();
+        try {
+          super.handle(target, baseRequest, request, response);
+        } finally {
+          lastActivity = System.currentTimeMillis();
+        }
+      }
+    };
+    activity.setHandler(handler);
+    server.setHandler(activity);
+  }
+
+  /**
+   * Stop the server once no requests were received for {@code idleTimeout}
+   * seconds (so that a daemon doesn't linger forever).
+   */
+  private void startIdleWatchdog() {
+    final long timeoutMs = idleTimeout * 1000L;
+    Thread watchdog = new Thread("idle-watchdog") {
+      @Override
+      public void run() {
+        try {
+          while (true) {
+            long idle = System.currentTimeMillis() - lastActivity;
+            if (idle >= timeoutMs) {
+              System.out.println("No requests in " + idleTimeout + " seconds, shutting down");
+              server.stop();
+              return;
+            }
+            Thread.sleep(Math.min(timeoutMs - idle, 1000));
+          }
+        } catch (Exception e) {
+          System.out.println("Idle watchdog failed: " + e);
+        }
+      }
+    };
+    watchdog.setDaemon(true);
+    watchdog.start();
+  }
+
+  /**
+   * Advertise the server in the {@code lockfile}: a JSON object with the pid,
+   * version and port (or socket) of the server, so that the clients can find and reuse it.
+   * The lockfile is removed when the server exits.
+   */
+  private void writeLockfile() throws IOException {
+    // Before Java 9 the pid is only available as a part of the JVM name "pid@hostname"
+    final String pid = ManagementFactory.getRuntimeMXBean().getName().split("@")[0];
+    String info = "{\"pid\": " + pid + ", \"version\": \"" + serverVersion() + "\", \"started\": "
+                  + (System.currentTimeMillis() / 1000) + ", "
+                  + (socket != null ? "\"socket\": " + JSON.toString(socket) : "\"port\": " + port) + "}";
+    // Write the file under a temporary name first, so that the clients never see it half-written
+    final Path path = Paths.get(lockfile);
+    Path tmpPath = Paths.get(lockfile + "." + pid);
+    Files.write(tmpPath, info.getBytes(StandardCharsets.UTF_8));
+    Files.move(tmpPath, path, StandardCopyOption.REPLACE_EXISTING, StandardCopyOption.ATOMIC_MOVE);
+    Runtime.getRuntime().addShutdownHook(new Thread() {
+      @Override
+      public void run() {
+        try {
+          // Unless the lockfile has been taken over by another server in the meantime
+          String content = new String(Files.readAllBytes(path), StandardCharsets.UTF_8);
+          if (content.startsWith("{\"pid\": " + pid + ","))
+            Files.delete(path);
+        } catch (IOException ignored) {}
+      }
+    });
+  }
+
+  /**
+   * Version of the server: the modification time of its jar (in whole seconds).
+   */
+  private static String serverVersion() {
+    try {
+      File jar = new File(MojoApp.class.getProtectionDomain().getCodeSource().getLocation().toURI());
+      return Long.toString(jar.lastModified() / 1000);
+    } catch (Exception e) {
+      return "unknown";
+    }
   }
 
 }
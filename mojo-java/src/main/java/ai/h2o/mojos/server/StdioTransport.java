@@ -0,0 +1,143 @@
+package ai.h2o.mojos.server;
+
+import org.eclipse.jetty.server.LocalConnector;
+import org.eclipse.jetty.util.BufferUtil;
+
+import java.io.DataInputStream;
+import java.io.EOFException;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.charset.StandardCharsets;
+import java.util.concurrent.TimeUnit;
+
+/**
+ * Serves the requests that the parent process sends over our stdin, writing
+ * the responses to stdout. Each message is a frame: a little-endian uint32
+ * length followed by that many bytes.
+ * <p>
+ * The request frame is the request line and headers, each terminated by
+ * {@code "\n"}, an empty line, and then the body:
+ * <pre>{@code
+ *   POST /mojos/1/score0~dada\n
+ *   Content-Type: application/x-mojo-binary\n
+ *   \n
+ *   <body>
+ * }</pre>
+ * The response frame is {@code "{status} {content-type}\n"} followed by the
+ * body of the response.
+ * <p>
+ * The requests are executed by the same servlets as in the HTTP mode, through
+ * Jetty's in-memory {@link LocalConnector}.
+ */
+class StdioTransport {
+  private final LocalConnector connector;
+  private final DataInputStream in;
+  private final OutputStream out;
+
+
+  StdioTransport(LocalConnector connector, InputStream in, OutputStream out) {
+    this.connector = connector;
+    this.in = new DataInputStream(in);
+    this.out = out;
+  }
+
+  /**
+   * Handle requests one after another, until the stdin is closed or the
+   * server is stopped.
+   */
+  void serve() throws Exception {
+    while (connector.isRunning()) {
+      byte[] request = readFrame();
+      if (request == null) break;
+      byte[] response;
+      try {
+        response = handle(request);
+      } catch (Exception e) {
+        // A request that fails here must not end the loop: the client gets an error response instead
+        response = errorFrame(e);
+      }
+      writeFrame(response);
+    }
+  }
+
+
+  //--------------------------------------------------------------------------------------------------------------------
+  // Private
+  //--------------------------------------------------------------------------------------------------------------------
+
+  private byte[] handle(byte[] frame) throws Exception {
+    int headEnd = indexOf(frame, "\n\n".getBytes(StandardCharsets.US_ASCII), 0);
+    if (headEnd < 0) headEnd = frame.length;
+    int bodyStart = Math.min(headEnd + 2, frame.length);
+    String[] lines = new String(frame, 0, headEnd, StandardCharsets.UTF_8).split("\n");
+
+    // HTTP/1.0 request: the connection is closed after the response, whose body is never chunked
+    StringBuilder sb = new StringBuilder();
+    sb.append(lines[0]).append(" HTTP/1.0\r\n");
+    for (int i = 1; i < lines.length; i++)
+      sb.append(lines[i]).append("\r\n");
+    sb.append("Content-Length: ").append(frame.length - bodyStart).append("\r\n\r\n");
+    byte[] head = sb.toString().getBytes(StandardCharsets.UTF_8);
+    ByteBuffer request = ByteBuffer.allocate(head.length + frame.length - bodyStart);
+    request.put(head).put(frame, bodyStart, frame.length - bodyStart).flip();
+
+    // The response is complete when Jetty closes the (HTTP/1.0) connection. The requests may
+    // take arbitrarily long without writing anything (such as loading a big mojo), so there is no
+    // idle cutoff: it would return a truncated response.
+    byte[] response = BufferUtil.toArray(connector.getResponses(request, Long.MAX_VALUE, TimeUnit.MILLISECONDS));
+    return toResponseFrame(response);
+  }
+
+  private static byte[] toResponseFrame(byte[] response) {
+    int headEnd = indexOf(response, "\r\n\r\n".getBytes(StandardCharsets.US_ASCII), 0);
+    if (headEnd < 0) throw new IllegalStateException("Malformed response: " + new String(response, StandardCharsets.ISO_8859_1));
+    String[] lines = new String(response, 0, headEnd, StandardCharsets.ISO_8859_1).split("\r\n");
+    String status = lines[0].split(" ")[1];
+    String contentType = "";
+    for (int i = 1; i < lines.length; i++) {
+      if (lines[i].regionMatches(true, 0, "Content-Type:", 0, 13))
+        contentType = lines[i].substring(13).trim();
+    }
+    byte[] prefix = (status + " " + contentType + "\n").getBytes(StandardCharsets.US_ASCII);
+    int bodyStart = headEnd + 4;
+    byte[] res = new byte[prefix.length + response.length - bodyStart];
+    System.arraycopy(prefix, 0, res, 0, prefix.length);
+    System.arraycopy(response, bodyStart, res, prefix.length, response.length - bodyStart);
+    return res;
+  }
+
+  private static byte[] errorFrame(Exception e) {
+    return ("500 text/plain\n" + e).getBytes(StandardCharsets.UTF_8);
+  }
+
+  private byte[] readFrame() throws IOException {
+    byte[] header = new byte[4];
+    try {
+      in.readFully(header);
+    } catch (EOFException e) {
+      return null;
+    }
+    byte[] frame = new byte[ByteBuffer.wrap(header).order(ByteOrder.LITTLE_ENDIAN).getInt()];
+    in.readFully(frame);
+    return frame;
+  }
+
+  private void writeFrame(byte[] frame) throws IOException {
+    out.write(ByteBuffer.allocate(4).order(ByteOrder.LITTLE_ENDIAN).putInt(frame.length).array());
+    out.write(frame);
+    out.flush();
+  }
+
+  private static int indexOf(byte[] data, byte[] pattern, int from) {
+    outer:
+    for (int i = from; i <= data.length - pattern.length; i++) {
+      for (int j = 0; j < pattern.length; j++)
+        if (data[i + j] != pattern[j]) continue outer;
+      return i;
+    }
+    return -1;
+  }
+}
@@ -0,0 +1,79 @@
+package ai.h2o.mojos.server.core;
+
+import java.io.ByteArrayOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.nio.BufferUnderflowException;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+
+/**
+ * Binary encoding of method arguments and return values, an alternative to
+ * their textual representation provided by {@link MethodParam}.
+ * <p>
+ * The payload is a sequence of values, each of them starting with a one-byte
+ * tag followed by a little-endian 32-bit length:
+ * <ul>
+ *   <li>{@code 'd'}: array of {@code length} little-endian float64 values
+ *       ({@code double[]}); NaNs are carried natively;</li>
+ *   <li>{@code 's'}: string of {@code length} UTF-8 bytes, which is then
+ *       parsed the same way as a textual argument would be.</li>
+ * </ul>
+ */
+public final class BinaryPayload {
+  public static final String CONTENT_TYPE = "application/x-mojo-binary";
+  private static final byte TAG_DOUBLES = 'd';
+  private static final byte TAG_STRING = 's';
+
+  private BinaryPayload() {}
+
+  /**
+   * Read all values from the stream. Each value is returned either as a
+   * {@code double[]} or as a {@code String}.
+   */
+  public static Object[] readValues(InputStream in) throws IOException {
+    ByteBuffer bb = ByteBuffer.wrap(readAll(in)).order(ByteOrder.LITTLE_ENDIAN);
+    ArrayList<Object> res = new ArrayList<>();
+    try {
+      while (bb.hasRemaining()) {
+        byte tag = bb.get();
+        int n = bb.getInt();
+        if (tag == TAG_DOUBLES) {
+          double[] values = new double[n];
+          bb.asDoubleBuffer().get(values);
+          bb.position(bb.position() + 8 * n);
+          res.add(values);
+        } else if (tag == TAG_STRING) {
+          byte[] bytes = new byte[n];
+          bb.get(bytes);
+          res.add(new String(bytes, StandardCharsets.UTF_8));
+        } else {
+          throw new IllegalArgumentException("Unknown value tag '" + (char) tag + "' in the binary payload");
+        }
+      }
+    } catch (BufferUnderflowException e) {
+      throw new IllegalArgumentException("Truncated binary payload");
+    }
+    return res.toArray();
+  }
+
+  /** Encode a {@code double[]} value. */
+  public static byte[] encodeDoubles(double[] values) {
+    ByteBuffer bb = ByteBuffer.allocate(5 + 8 * values.length).order(ByteOrder.LITTLE_ENDIAN);
+    bb.put(TAG_DOUBLES);
+    bb.putInt(values.length);
+    bb.asDoubleBuffer().put(values);
+    return bb.array();
+  }
+
+  private static byte[] readAll(InputStream in) throws IOException {
+    ByteArrayOutputStream out = new ByteArrayOutputStream();
+    byte[] buf = new byte[8192];
+    int n;
+    while ((n = in.read(buf)) != -1)
+      out.write(buf, 0, n);
+    return out.toByteArray();
+  }
+}
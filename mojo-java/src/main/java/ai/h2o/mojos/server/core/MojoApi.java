@@ -56,10 +56,25 @@ public class MojoApi {
      * serialized back into a string.
      */
     public String invoke(Object target, String[] strArgs) throws Exception {
+      return stringify(invokeRaw(target, strArgs));
+    }
+
+    /**
+     * Call the method, passing the provided arguments, and return its result
+     * as-is. Each argument is either a string (which will be parsed into the
+     * type of the corresponding parameter), or a value of the parameter's
+     * type already (this is how {@code double[]}s decoded from a
+     * {@link BinaryPayload} are passed).
+     */
+    public Object invokeRaw(Object target, Object[] rawArgs) throws Exception {
       if (Modifier.isAbstract(method.getDeclaringClass().getModifiers())) {
         method.setAccessible(true);
       }
-      Object retVal = method.invoke(target, parseArgs(strArgs));
+      return method.invoke(target, parseArgs(rawArgs));
+    }
+
+    /** Serialize the value returned by {@link #invokeRaw(Object, Object[])} into a string. */
+    public String stringify(Object retVal) {
       return ret.toString(retVal);
     }
 
@@ -89,12 +104,20 @@ public class MojoApi {
       return res.toString();
     }
 
-    private Object[] parseArgs(String[] strargs) {
-      int n = strargs.length;
-      assert n == numArgs();
+    private Object[] parseArgs(Object[] rawargs) {
+      int n = rawargs.length;
+      if (n != numArgs())
+        throw new IllegalArgumentException("Method " + apiName + " expects " + numArgs() + " arguments, got " + n);
       Object[] res = new Object[n];
-      for (int i = 0; i < n; i++)
-        res[i] = args[i].fromString(strargs[i]);
+      for (int i = 0; i < n; i++) {
+        if (rawargs[i] == null || rawargs[i] instanceof String)
+          res[i] = args[i].fromString((String) rawargs[i]);
+        else if (args[i] == MethodParam.ADOUBLE && rawargs[i] instanceof double[])
+          res[i] = rawargs[i];
+        else
+          throw new IllegalArgumentException(
+              "Argument " + (i + 1) + " of method " + apiName + " cannot be " + rawargs[i].getClass().getSimpleName());
+      }
       return res;
     }
 
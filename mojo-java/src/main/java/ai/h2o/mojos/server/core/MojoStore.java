@@ -1,39 +1,368 @@
 package ai.h2o.mojos.server.core;
 
 import hex.genmodel.MojoModel;
+import org.eclipse.jetty.util.ajax.JSON;
 
+import java.io.File;
+import java.io.IOException;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardCopyOption;
+import java.util.ArrayList;
+import java.util.Collections;
 import java.util.HashMap;
+import java.util.Iterator;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
 
 
 /**
  * This class is used as a singleton, and it keeps knowledge about all the
  * models that were loaded in the system.
+ * <p>
+ * A model loaded from a file is shared by all the loads of the same file (as
+ * identified by its {@link #fileKey}), and it is counted how many times it was
+ * loaded: the model is removed only when each of those loads was undone by
+ * {@link #releaseModel}. The store is accessed from the request-handling
+ * threads of the server, so its state is guarded by the lock of the class.
+ * <p>
+ * The number of models kept in memory, and the total size of their files, can
+ * be limited (see {@link #setBudget}). When a limit is exceeded, the least
+ * recently used models are evicted: they keep their ids, and are loaded again
+ * from their files when they are used next time.
+ * <p>
+ * A model can also be addressed by a name (an alias), which can be pointed to
+ * another model at any time (see {@link #setAlias}): the requests that are
+ * already in progress finish with the model they have started with. An alias
+ * holds a reference to its model, as if it had loaded it.
+ * <p>
+ * The store can be recorded in a snapshot file (see {@link #restoreSnapshot}),
+ * which lists the ids, files and reference counts of the models (and the
+ * aliases), and is updated
+ * whenever they change. A server restarted with the same snapshot restores all
+ * those ids: the models are loaded again in the background, or when they are
+ * used first, whichever is sooner.
  */
 public class MojoStore {
   private static Integer _idCounter = 0;
-  private static HashMap<String, MojoModel> _mojoStore = new HashMap<>();
+  /** Models that are in memory, in the order from the least recently used. */
+  private static LinkedHashMap<String, MojoModel> _mojoStore = new LinkedHashMap<>(16, 0.75f, true);
   private static HashMap<Class<? extends MojoModel>, MojoApi> _mojoApi = new HashMap<>();
+  private static HashMap<String, Integer> _refCounts = new HashMap<>();
+  private static HashMap<String, String> _idsByKey = new HashMap<>();
+  private static HashMap<String, String> _keysById = new HashMap<>();
+  /** Files of the models that can be evicted, and their sizes. */
+  private static HashMap<String, String> _filesById = new HashMap<>();
+  private static HashMap<String, Long> _sizesById = new HashMap<>();
+  private static int _maxModels = 0;
+  private static long _maxBytes = 0;
+  private static long _loadedBytes = 0;
+  private static long _evictions = 0;
+  private static long _reloads = 0;
+  private static HashMap<String, String> _aliases = new HashMap<>();
+  private static String _snapshotPath = null;
 
-  public static String addModel(MojoModel model) {
+  /**
+   * Key identifying the contents of a mojo file: its canonical path, size and
+   * modification time. A file that was modified has a different key. Null if
+   * there is no such file.
+   */
+  public static String fileKey(String path) throws IOException {
+    File file = new File(path).getCanonicalFile();
+    if (!file.isFile())
+      return null;
+    return file.getPath() + "|" + file.length() + "|" + file.lastModified();
+  }
+
+  /**
+   * Limit the number of models in memory to {@code maxModels}, and the total
+   * size of their files to {@code maxBytes} (0 means no limit).
+   */
+  public static synchronized void setBudget(int maxModels, long maxBytes) {
+    _maxModels = maxModels;
+    _maxBytes = maxBytes;
+    evict(null);
+  }
+
+  /**
+   * Return the id of the model already loaded from the file with the given
+   * {@code key}, counting one more load of it; or null if there is none.
+   */
+  public static synchronized String acquireModel(String key) {
+    if (key == null)
+      return null;
+    String id = _idsByKey.get(key);
+    if (id != null) {
+      _refCounts.put(id, _refCounts.get(id) + 1);
+      saveSnapshot();
+    }
+    return id;
+  }
+
+  public static synchronized String addModel(MojoModel model) {
+    return addModel(model, null, null);
+  }
+
+  /**
+   * Add the {@code model} loaded from the {@code file} with the given {@code key}.
+   * If the same file was loaded concurrently by another request, then its model
+   * is used instead.
+   */
+  public static synchronized String addModel(MojoModel model, String file, String key) {
+    String existingId = acquireModel(key);
+    if (existingId != null)
+      return existingId;
     _idCounter++;
     String id = _idCounter.toString();
     _mojoStore.put(id, model);
+    _refCounts.put(id, 1);
+    if (key != null) {
+      long size = new File(file).length();
+      _idsByKey.put(key, id);
+      _keysById.put(id, key);
+      _filesById.put(id, file);
+      _sizesById.put(id, size);
+      _loadedBytes += size;
+    }
     Class<? extends MojoModel> clz = model.getClass();
     if (!_mojoApi.containsKey(clz))
       _mojoApi.put(clz, new MojoApi(clz));
+    evict(id);
+    saveSnapshot();
     return id;
   }
 
-  public static MojoModel getModel(String id) {
-    return _mojoStore.get(id);
+  /**
+   * Return the model with the given {@code id} (or the model of the alias
+   * {@code id}; null if there is none), loading it again from its file if it
+   * was evicted.
+   */
+  public static MojoModel getModel(String id) throws IOException {
+    String file, key;
+    synchronized (MojoStore.class) {
+      if (_aliases.containsKey(id))
+        id = _aliases.get(id);
+      MojoModel model = _mojoStore.get(id);
+      if (model != null || !_refCounts.containsKey(id))
+        return model;
+      file = _filesById.get(id);
+      key = _keysById.get(id);
+    }
+    // The model is loaded outside of the lock, so that the other models can be used meanwhile
+    if (!key.equals(fileKey(file)))
+      throw new IOException("Model " + id + " was evicted, and its file " + file + " has changed since it was loaded");
+    MojoModel model = MojoModel.load(file);
+    synchronized (MojoStore.class) {
+      if (!_refCounts.containsKey(id))
+        return null;
+      MojoModel loaded = _mojoStore.get(id);
+      if (loaded != null)
+        return loaded;
+      _mojoStore.put(id, model);
+      _loadedBytes += _sizesById.get(id);
+      _reloads++;
+      System.out.println("Reloaded model " + id + " from " + file);
+      evict(id);
+      return model;
+    }
+  }
+
+  /** Undo one load of the model, and remove the model if it is no longer used. */
+  public static synchronized void releaseModel(String id) {
+    release(id);
+    saveSnapshot();
+  }
+
+  /**
+   * Point the alias {@code name} to the model {@code id}, and return the id of
+   * its previous model (or null if there was none).
+   */
+  public static synchronized String setAlias(String name, String id) {
+    if (!_refCounts.containsKey(id))
+      throw new IllegalArgumentException("Model " + id + " was not loaded");
+    _refCounts.put(id, _refCounts.get(id) + 1);
+    String previous = _aliases.put(name, id);
+    if (previous != null)
+      release(previous);
+    saveSnapshot();
+    return previous;
+  }
+
+  /** Remove the alias {@code name}, and return whether it existed. */
+  public static synchronized boolean removeAlias(String name) {
+    String id = _aliases.remove(name);
+    if (id == null)
+      return false;
+    release(id);
+    saveSnapshot();
+    return true;
   }
 
-  public static void delModel(String id) {
-    _mojoStore.remove(id);
+  public static synchronized Map<String, String> getAliases() {
+    return new HashMap<>(_aliases);
   }
 
-  public static MojoApi getModelApi(MojoModel m) {
+  /** The id of the model of the alias {@code name}, or {@code name} itself if it is not an alias. */
+  public static synchronized String resolve(String name) {
+    String id = _aliases.get(name);
+    return id == null ? name : id;
+  }
+
+  /**
+   * Restore the models recorded in the snapshot file at {@code path} (if it
+   * exists) as evicted, and keep the snapshot there from now on. Returns the
+   * ids of the restored models, from the most recently used.
+   */
+  public static synchronized List<String> restoreSnapshot(String path) throws IOException {
+    _snapshotPath = path;
+    List<String> ids = new ArrayList<>();
+    File file = new File(path);
+    if (!file.isFile())
+      return ids;
+    Map snapshot = (Map) JSON.parse(new String(Files.readAllBytes(file.toPath()), StandardCharsets.UTF_8));
+    _idCounter = Math.max(_idCounter, ((Number) snapshot.get("next_id")).intValue() - 1);
+    for (Object o : (Object[]) snapshot.get("models")) {
+      Map model = (Map) o;
+      String id = (String) model.get("id");
+      String key = (String) model.get("key");
+      _refCounts.put(id, ((Number) model.get("refs")).intValue());
+      _idsByKey.put(key, id);
+      _keysById.put(id, key);
+      _filesById.put(id, (String) model.get("file"));
+      _sizesById.put(id, ((Number) model.get("size")).longValue());
+      ids.add(id);
+    }
+    if (snapshot.get("aliases") != null)
+      for (Object o : ((Map) snapshot.get("aliases")).entrySet()) {
+        Map.Entry alias = (Map.Entry) o;
+        _aliases.put((String) alias.getKey(), (String) alias.getValue());
+      }
+    System.out.println("Restored " + ids.size() + " models from the snapshot " + path);
+    Collections.reverse(ids);
+    return ids;
+  }
+
+  /**
+   * Load the models {@code ids} (restored from a snapshot) in a background
+   * thread, at most as many as fit into the budget.
+   */
+  public static void warmUp(List<String> ids) {
+    final List<String> toLoad = _maxModels > 0 && ids.size() > _maxModels ? ids.subList(0, _maxModels) : ids;
+    Thread thread = new Thread(new Runnable() {
+      @Override
+      public void run() {
+        for (String id : toLoad) {
+          try {
+            getModel(id);
+          } catch (Exception e) {
+            System.out.println("Unable to load model " + id + " from the snapshot: " + e);
+          }
+        }
+      }
+    }, "snapshot-warm-up");
+    thread.setDaemon(true);
+    thread.start();
+  }
+
+  public static synchronized MojoApi getModelApi(MojoModel m) {
     return m == null? null : _mojoApi.get(m.getClass());
   }
 
+  /** Statistics of the store, for the {@code GET /stats} endpoint. */
+  public static synchronized Map<String, Object> getStats() {
+    Map<String, Object> stats = new LinkedHashMap<>();
+    stats.put("models", _refCounts.size());
+    stats.put("loaded", _mojoStore.size());
+    stats.put("loaded_bytes", _loadedBytes);
+    stats.put("evictions", _evictions);
+    stats.put("reloads", _reloads);
+    stats.put("max_models", _maxModels);
+    stats.put("max_bytes", _maxBytes);
+    return stats;
+  }
+
+  /**
+   * Evict the least recently used models (except the model {@code keepId})
+   * until the store fits into its budget. Only the models loaded from a file
+   * can be evicted.
+   */
+  private static void evict(String keepId) {
+    Iterator<Map.Entry<String, MojoModel>> it = _mojoStore.entrySet().iterator();
+    while (it.hasNext() && overBudget()) {
+      String id = it.next().getKey();
+      if (id.equals(keepId) || !_filesById.containsKey(id))
+        continue;
+      it.remove();
+      _loadedBytes -= _sizesById.get(id);
+      _evictions++;
+      System.out.println("Evicted model " + id + " (" + _filesById.get(id) + ")");
+    }
+  }
+
+  private static void release(String id) {
+    Integer refs = _refCounts.get(id);
+    if (refs == null)
+      return;
+    if (refs > 1) {
+      _refCounts.put(id, refs - 1);
+      return;
+    }
+    _refCounts.remove(id);
+    PredictionCache.invalidate(id);
+    if (_mojoStore.remove(id) != null && _sizesById.containsKey(id))
+      _loadedBytes -= _sizesById.get(id);
+    _filesById.remove(id);
+    _sizesById.remove(id);
+    String key = _keysById.remove(id);
+    if (key != null)
+      _idsByKey.remove(key);
+  }
+
+  /** Record the models in the snapshot file, if there is one. */
+  private static void saveSnapshot() {
+    if (_snapshotPath == null)
+      return;
+    // From the least recently used; the evicted models first. The models without a file cannot be restored.
+    List<String> order = new ArrayList<>();
+    for (String id : _refCounts.keySet())
+      if (!_mojoStore.containsKey(id))
+        order.add(id);
+    order.addAll(_mojoStore.keySet());
+    List<Map<String, Object>> models = new ArrayList<>();
+    for (String id : order) {
+      if (!_keysById.containsKey(id))
+        continue;
+      Map<String, Object> model = new LinkedHashMap<>();
+      model.put("id", id);
+      model.put("file", _filesById.get(id));
+      model.put("size", _sizesById.get(id));
+      model.put("key", _keysById.get(id));
+      model.put("refs", _refCounts.get(id));
+      models.add(model);
+    }
+    Map<String, Object> snapshot = new LinkedHashMap<>();
+    snapshot.put("next_id", _idCounter + 1);
+    snapshot.put("models", models);
+    Map<String, String> aliases = new LinkedHashMap<>();
+    for (Map.Entry<String, String> alias : _aliases.entrySet())
+      if (_keysById.containsKey(alias.getValue()))
+        aliases.put(alias.getKey(), alias.getValue());
+    snapshot.put("aliases", aliases);
+    try {
+      Path path = Paths.get(_snapshotPath);
+      Path tmpPath = Paths.get(_snapshotPath + ".tmp");
+      Files.write(tmpPath, JSON.toString(snapshot).getBytes(StandardCharsets.UTF_8));
+      Files.move(tmpPath, path, StandardCopyOption.REPLACE_EXISTING, StandardCopyOption.ATOMIC_MOVE);
+    } catch (IOException e) {
+      System.out.println("Unable to write the snapshot " + _snapshotPath + ": " + e);
+    }
+  }
+
+  private static boolean overBudget() {
+    return (_maxModels > 0 && _mojoStore.size() > _maxModels) || (_maxBytes > 0 && _loadedBytes > _maxBytes);
+  }
+
 }
@@ -0,0 +1,131 @@
+package ai.h2o.mojos.server.core;
+
+import hex.genmodel.MojoModel;
+
+import java.util.Arrays;
+import java.util.Iterator;
+import java.util.LinkedHashMap;
+import java.util.Map;
+
+
+/**
+ * The least recently used results of the scoring methods ({@code score0...}),
+ * so that the rows that were scored already are not scored again. This class
+ * is used as a singleton, like {@link MojoStore}; the cache is disabled until
+ * its size is set with {@link #setMaxSize}.
+ * <p>
+ * The results are keyed by the id of the model (never by its alias, so an
+ * alias that is pointed to another model does not get the results of the
+ * previous one), the method, and the arguments, which are canonicalized so that
+ * the same row sent as a {@code double[]} or as a string (with any formatting)
+ * is the same key. The results of a model are removed when the model is
+ * unloaded (see {@link MojoStore#releaseModel}).
+ */
+public class PredictionCache {
+  private static volatile int _maxSize = 0;
+  private static long _hits = 0;
+  private static long _misses = 0;
+  private static LinkedHashMap<String, Object> _entries = new LinkedHashMap<String, Object>(16, 0.75f, true) {
+    @Override
+    protected boolean removeEldestEntry(Map.Entry<String, Object> eldest) {
+      return size() > _maxSize;
+    }
+  };
+
+  public static synchronized void setMaxSize(int maxSize) {
+    _maxSize = maxSize;
+  }
+
+  /**
+   * Same as {@link MojoApi.ApiMethod#invokeRaw} on the model {@code id}
+   * ({@code model}), using the cache. The exceptions thrown by the method are
+   * not cached.
+   */
+  public static Object invoke(String id, MojoModel model, MojoApi.ApiMethod method, Object[] args) throws Exception {
+    if (_maxSize == 0 || !method.uniqueName().startsWith("score0"))
+      return method.invokeRaw(model, args);
+    String key = cacheKey(id, method.uniqueName(), args);
+    if (key == null)
+      return method.invokeRaw(model, args);
+    synchronized (PredictionCache.class) {
+      Object result = _entries.get(key);
+      if (result != null) {
+        _hits++;
+        return copy(result);
+      }
+      _misses++;
+    }
+    Object result = method.invokeRaw(model, args);
+    synchronized (PredictionCache.class) {
+      _entries.put(key, copy(result));
+    }
+    return result;
+  }
+
+  /** Remove the results of the model {@code id}. */
+  public static synchronized void invalidate(String id) {
+    String prefix = id + "\n";
+    Iterator<String> it = _entries.keySet().iterator();
+    while (it.hasNext()) {
+      if (it.next().startsWith(prefix))
+        it.remove();
+    }
+  }
+
+  /** Statistics of the cache, for the {@code GET /stats} endpoint. */
+  public static synchronized Map<String, Object> getStats() {
+    Map<String, Object> stats = new LinkedHashMap<>();
+    stats.put("cache_size", _entries.size());
+    stats.put("cache_max_size", _maxSize);
+    stats.put("cache_hits", _hits);
+    stats.put("cache_misses", _misses);
+    return stats;
+  }
+
+
+  //--------------------------------------------------------------------------------------------------------------------
+  // Private
+  //--------------------------------------------------------------------------------------------------------------------
+
+  /** The key of the call, or null if an argument cannot be canonicalized. */
+  private static String cacheKey(String id, String methodName, Object[] args) {
+    StringBuilder sb = new StringBuilder(id).append('\n').append(methodName);
+    for (Object arg : args) {
+      sb.append('\n');
+      if (arg instanceof double[]) {
+        sb.append(Arrays.toString((double[]) arg));
+      } else if (arg instanceof String && ((String) arg).startsWith("[")) {
+        double[] values = parseDoubles((String) arg);
+        if (values == null)
+          return null;
+        sb.append(Arrays.toString(values));
+      } else {
+        sb.append(arg);
+      }
+    }
+    return sb.toString();
+  }
+
+  private static double[] parseDoubles(String str) {
+    String inner = str.trim();
+    if (!inner.endsWith("]"))
+      return null;
+    inner = inner.substring(1, inner.length() - 1).trim();
+    if (inner.isEmpty())
+      return new double[0];
+    String[] parts = inner.split(",");
+    double[] values = new double[parts.length];
+    try {
+      for (int i = 0; i < parts.length; i++)
+        values[i] = Double.parseDouble(parts[i].trim());
+    } catch (NumberFormatException e) {
+      return null;
+    }
+    return values;
+  }
+
+  /** The {@code double[]} results are filled in by the callers' arrays, so the cache keeps its own copies. */
+  private static Object copy(Object result) {
+    return result instanceof double[] ? ((double[]) result).clone() : result;
+  }
+}
@@ -0,0 +1,266 @@
+package ai.h2o.mojos.server.core;
+
+import hex.genmodel.MojoModel;
+
+import java.lang.reflect.InvocationTargetException;
+import java.util.ArrayDeque;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.HashMap;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.concurrent.ArrayBlockingQueue;
+import java.util.concurrent.RejectedExecutionException;
+import java.util.concurrent.ThreadFactory;
+import java.util.concurrent.ThreadPoolExecutor;
+import java.util.concurrent.TimeUnit;
+
+
+/**
+ * Shadow scoring: the scoring calls ({@code score0...}) of a (primary) model
+ * are mirrored to a shadow model, such as the next version of the same mojo,
+ * and the predictions of both models are compared. This class is used as a
+ * singleton, like {@link MojoStore}.
+ * <p>
+ * The mirrored calls are queued, and scored on the shadow models by a single
+ * background thread, so the callers do not wait for the shadows. If the queue
+ * is full (the shadows cannot keep up), the calls are dropped and counted. If
+ * the shadow model is unloaded, its calls are counted as errors.
+ */
+public class ShadowScorer {
+  private static final int QUEUE_SIZE = 1000;
+  private static final int MAX_SAMPLES = 10;
+
+  private static HashMap<String, Shadow> _shadows = new HashMap<>();
+  private static ThreadPoolExecutor _executor = new ThreadPoolExecutor(
+      1, 1, 0, TimeUnit.MILLISECONDS, new ArrayBlockingQueue<Runnable>(QUEUE_SIZE),
+      new ThreadFactory() {
+        @Override
+        public Thread newThread(Runnable r) {
+          Thread thread = new Thread(r, "shadow-scorer");
+          thread.setDaemon(true);
+          return thread;
+        }
+      });
+
+  /** Mirror the scoring calls of the model {@code id} to the model {@code shadowId}. */
+  public static synchronized void setShadow(String id, String shadowId, double tolerance, double rate) {
+    _shadows.put(id, new Shadow(shadowId, tolerance, rate));
+  }
+
+  /**
+   * Stop mirroring the calls of the model {@code id}, and return the final
+   * statistics of its shadow (or null if it had none).
+   */
+  public static synchronized Map<String, Object> removeShadow(String id) {
+    Shadow shadow = _shadows.remove(id);
+    return shadow == null ? null : shadow.stats();
+  }
+
+  /** Statistics of the shadow of the model {@code id} (or null if it has none). */
+  public static synchronized Map<String, Object> getStats(String id) {
+    Shadow shadow = _shadows.get(id);
+    return shadow == null ? null : shadow.stats();
+  }
+
+  public static synchronized Map<String, Object> getAllStats() {
+    Map<String, Object> stats = new HashMap<>();
+    for (Map.Entry<String, Shadow> entry : _shadows.entrySet())
+      stats.put(entry.getKey(), entry.getValue().stats());
+    return stats;
+  }
+
+  /**
+   * Whether the call {@code method(args)} of the model {@code id} is to be
+   * mirrored to the shadow of the model: if so, return a copy of the arguments,
+   * otherwise null. This must be called before the primary model is, because
+   * the scoring methods fill in their {@code double[]} arguments (the preds) in
+   * place, and the shadow has to be called with the same arguments as the
+   * primary was.
+   */
+  public static Object[] sample(String id, MojoApi.ApiMethod method, Object[] args) {
+    synchronized (ShadowScorer.class) {
+      if (_shadows.isEmpty() || !method.uniqueName().startsWith("score0"))
+        return null;
+      Shadow shadow = _shadows.get(MojoStore.resolve(id));
+      if (shadow == null || !shadow.sample())
+        return null;
+    }
+    Object[] argsCopy = new Object[args.length];
+    for (int i = 0; i < args.length; i++)
+      argsCopy[i] = args[i] instanceof double[] ? ((double[]) args[i]).clone() : args[i];
+    return argsCopy;
+  }
+
+  /**
+   * Queue the call of the model {@code id}, which has returned {@code result},
+   * for the shadow of the model; {@code argsCopy} are the arguments returned
+   * by {@link #sample} (if null, the call is not mirrored).
+   */
+  public static void mirror(String id, MojoApi.ApiMethod method, final Object[] argsCopy, Object result) {
+    if (argsCopy == null)
+      return;
+    final Shadow shadow;
+    synchronized (ShadowScorer.class) {
+      shadow = _shadows.get(MojoStore.resolve(id));
+      if (shadow == null)
+        return;
+      shadow.mirrored++;
+    }
+    final String methodName = method.uniqueName();
+    final Object primary = result instanceof double[] ? ((double[]) result).clone() : result;
+    try {
+      _executor.execute(new Runnable() {
+        @Override
+        public void run() {
+          shadow.score(methodName, argsCopy, primary);
+        }
+      });
+    } catch (RejectedExecutionException e) {
+      synchronized (ShadowScorer.class) {
+        shadow.dropped++;
+      }
+    }
+  }
+
+  /**
+   * Whether the two results of a method are the same, allowing for numeric
+   * differences up to {@code tolerance} (as the connoisseur compares the
+   * nibbles). Each result is either a {@code double[]} or its string form.
+   */
+  public static boolean predictionsMatch(Object a, Object b, double tolerance) {
+    List<String> aValues = predictionValues(a);
+    List<String> bValues = predictionValues(b);
+    if (aValues.size() != bValues.size())
+      return false;
+    for (int i = 0; i < aValues.size(); i++) {
+      String x = aValues.get(i);
+      String y = bValues.get(i);
+      if (x.equals(y))
+        continue;
+      double dx, dy;
+      try {
+        dx = Double.parseDouble(x);
+        dy = Double.parseDouble(y);
+      } catch (NumberFormatException e) {
+        return false;
+      }
+      if (!(Math.abs(dx - dy) <= tolerance || (Double.isNaN(dx) && Double.isNaN(dy))))
+        return false;
+    }
+    return true;
+  }
+
+
+  //--------------------------------------------------------------------------------------------------------------------
+  // Private
+  //--------------------------------------------------------------------------------------------------------------------
+
+  private static List<String> predictionValues(Object result) {
+    List<String> values = new ArrayList<>();
+    if (result instanceof double[]) {
+      for (double x : (double[]) result)
+        values.add(Double.toString(x));
+      return values;
+    }
+    String str = String.valueOf(result).trim();
+    if (str.startsWith("[") && str.endsWith("]")) {
+      for (String elem : str.substring(1, str.length() - 1).split(","))
+        values.add(elem.trim());
+    } else {
+      values.add(str);
+    }
+    return values;
+  }
+
+  private static String toText(Object value) {
+    if (value instanceof double[])
+      return Arrays.toString((double[]) value);
+    return String.valueOf(value);
+  }
+
+  /** The shadow of one primary model, and the statistics of its comparisons (guarded by the class lock). */
+  private static class Shadow {
+    private final String shadowId;
+    private final double tolerance;
+    private final double rate;
+    private long mirrored, compared, divergent, errors, dropped;
+    private ArrayDeque<Map<String, Object>> samples = new ArrayDeque<>();  // the latest divergent calls
+    private double credit;
+
+    Shadow(String shadowId, double tolerance, double rate) {
+      this.shadowId = shadowId;
+      this.tolerance = tolerance;
+      this.rate = rate;
+    }
+
+    /** Whether to mirror the next call, so that a {@code rate} fraction of the calls is mirrored. */
+    boolean sample() {
+      credit += rate;
+      if (credit < 1)
+        return false;
+      credit -= 1;
+      return true;
+    }
+
+    void score(String methodName, Object[] args, Object primary) {
+      Object result;
+      try {
+        MojoModel model = MojoStore.getModel(shadowId);
+        MojoApi api = MojoStore.getModelApi(model);
+        if (model == null || api == null)
+          throw new IllegalArgumentException("Model " + shadowId + " was not loaded");
+        if (!api.hasMethodWithUniqueName(methodName))
+          throw new IllegalArgumentException("Class " + api.name() + " doesn't have a method with name " + methodName);
+        try {
+          result = api.getMethodByUniqueName(methodName).invokeRaw(model, args);
+        } catch (InvocationTargetException e) {
+          // The exceptions of the mojos are results too, and are compared as such (without the index
+          // that some Java runtimes append, see MojoApiHandler)
+          result = e.getCause().toString();
+          if (((String) result).startsWith("java.lang.ArrayIndexOutOfBoundsException"))
+            result = "java.lang.ArrayIndexOutOfBoundsException";
+        }
+      } catch (Exception e) {
+        synchronized (ShadowScorer.class) {
+          errors++;
+        }
+        System.out.println("Shadow model " + shadowId + " failed on " + methodName + ": " + e);
+        return;
+      }
+      boolean same = predictionsMatch(primary, result, tolerance);
+      synchronized (ShadowScorer.class) {
+        compared++;
+        if (!same) {
+          divergent++;
+          List<String> argsText = new ArrayList<>();
+          for (Object arg : args)
+            argsText.add(toText(arg));
+          Map<String, Object> sample = new LinkedHashMap<>();
+          sample.put("method", methodName);
+          sample.put("args", argsText);
+          sample.put("primary", toText(primary));
+          sample.put("shadow", toText(result));
+          if (samples.size() == MAX_SAMPLES)
+            samples.removeFirst();
+          samples.addLast(sample);
+        }
+      }
+    }
+
+    Map<String, Object> stats() {
+      Map<String, Object> stats = new LinkedHashMap<>();
+      stats.put("shadow", shadowId);
+      stats.put("tolerance", tolerance);
+      stats.put("rate", rate);
+      stats.put("mirrored", mirrored);
+      stats.put("compared", compared);
+      stats.put("divergent", divergent);
+      stats.put("errors", errors);
+      stats.put("dropped", dropped);
+      stats.put("samples", new ArrayList<>(samples));
+      return stats;
+    }
+  }
+}
@@ -0,0 +1,97 @@
+package ai.h2o.mojos.server.core;
+
+import java.io.Closeable;
+import java.io.IOException;
+import java.nio.ByteOrder;
+import java.nio.DoubleBuffer;
+import java.nio.MappedByteBuffer;
+import java.nio.channels.FileChannel;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardOpenOption;
+import java.util.regex.Pattern;
+
+/**
+ * Matrix of {@code nrows x ncols} little-endian float64 values, stored row
+ * after row in a POSIX shared memory segment (a file in {@code /dev/shm}).
+ * <p>
+ * The segments are created by the client, which writes the rows to be scored
+ * into one of them and reads the predictions from another, so that the data
+ * doesn't have to be copied through the request / response bodies.
+ */
+public final class SharedMatrix implements Closeable {
+  public static final String SHM_DIR = "/dev/shm";
+  private static final Pattern NAME_PATTERN = Pattern.compile("\\w[\\w.-]*");
+
+  private final FileChannel channel;
+  private final DoubleBuffer data;
+  private final int nrows;
+  private final int ncols;
+
+
+  /**
+   * Map the shared memory segment {@code name}, which must be large enough to
+   * hold the matrix of the given shape.
+   */
+  public static SharedMatrix open(String name, int nrows, int ncols, boolean writable) throws IOException {
+    if (name == null || !NAME_PATTERN.matcher(name).matches())
+      throw new IllegalArgumentException("Invalid shared memory segment name " + name);
+    if (nrows <= 0 || ncols <= 0)
+      throw new IllegalArgumentException("Invalid shape " + nrows + " x " + ncols);
+    long size = 8L * nrows * ncols;
+    if (size > Integer.MAX_VALUE)
+      throw new IllegalArgumentException("Matrix " + nrows + " x " + ncols + " is too large to be mapped");
+    Path path = Paths.get(SHM_DIR, name);
+    FileChannel channel = writable
+        ? FileChannel.open(path, StandardOpenOption.READ, StandardOpenOption.WRITE)
+        : FileChannel.open(path, StandardOpenOption.READ);
+    try {
+      if (channel.size() < size)
+        throw new IllegalArgumentException("Shared memory segment " + name + " is smaller than " + size + " bytes");
+      MappedByteBuffer buffer = channel.map(writable ? FileChannel.MapMode.READ_WRITE : FileChannel.MapMode.READ_ONLY, 0, size);
+      return new SharedMatrix(channel, buffer.order(ByteOrder.LITTLE_ENDIAN).asDoubleBuffer(), nrows, ncols);
+    } catch (IOException | RuntimeException e) {
+      channel.close();
+      throw e;
+    }
+  }
+
+  private SharedMatrix(FileChannel channel, DoubleBuffer data, int nrows, int ncols) {
+    this.channel = channel;
+    this.data = data;
+    this.nrows = nrows;
+    this.ncols = ncols;
+  }
+
+  public int numRows() {
+    return nrows;
+  }
+
+  public int numCols() {
+    return ncols;
+  }
+
+  public double[] getRow(int i) {
+    double[] row = new double[ncols];
+    data.position(i * ncols);
+    data.get(row);
+    return row;
+  }
+
+  /**
+   * Write the {@code row} into the i-th row of the matrix. If the row is
+   * shorter than the matrix width, then it is padded with NaNs; if it is
+   * longer, then it is truncated.
+   */
+  public void setRow(int i, double[] row) {
+    data.position(i * ncols);
+    int n = Math.min(row.length, ncols);
+    data.put(row, 0, n);
+    for (int j = n; j < ncols; j++)
+      data.put(Double.NaN);
+  }
+
+  @Override public void close() throws IOException {
+    channel.close();
+  }
+}
@@ -0,0 +1,66 @@
+package ai.h2o.mojos.server.handlers;
+
+import ai.h2o.mojos.server.core.MojoStore;
+import org.eclipse.jetty.util.ajax.JSON;
+
+import javax.servlet.http.HttpServletRequest;
+import javax.servlet.http.HttpServletResponse;
+import java.io.IOException;
+import java.net.MalformedURLException;
+import java.util.regex.Pattern;
+
+/**
+ * Servlet that handles the aliases of the models:
+ * <pre>{@code
+ *   GET /aliases
+ *   POST /aliases/{name}?id=...
+ *   DELETE /aliases/{name}
+ * }</pre>
+ * The first request returns all the aliases as a JSON object, mapping each
+ * alias to the id of its model. The second one points the alias {@code name}
+ * to the model {@code id}, and returns the id of the model it pointed to before
+ * (or an empty string). The third one removes the alias.
+ * <p>
+ * An alias can be used instead of the model id in the {@code /mojos/...}
+ * requests, see {@link MojoStore#setAlias}.
+ */
+public class AliasHandler extends BaseHandler {
+  /** The aliases must not look like the (numeric) ids of the models. */
+  private static final Pattern ALIAS = Pattern.compile("[A-Za-z][\\w.-]*");
+
+  @Override
+  protected void getImpl(HttpServletRequest request, HttpServletResponse response) throws Exception {
+    if (request.getPathInfo() != null && !request.getPathInfo().equals("/"))
+      throw new MalformedURLException("Unexpected URL " + request.getRequestURI());
+    response.setStatus(HttpServletResponse.SC_OK);
+    response.setContentType("application/json");
+    response.getWriter().print(JSON.toString(MojoStore.getAliases()));
+  }
+
+  @Override
+  protected void postImpl(HttpServletRequest request, HttpServletResponse response) throws Exception {
+    String name = aliasName(request);
+    String modelId = request.getParameter("id");
+    if (!ALIAS.matcher(name).matches())
+      throw new IllegalArgumentException("Invalid alias " + name + ": it must start with a letter");
+    if (MojoStore.getModel(modelId) == null)
+      throw new IllegalArgumentException("Model " + modelId + " was not loaded");
+    String previous = MojoStore.setAlias(name, modelId);
+    makeTextResponse(response).print(previous == null ? "" : previous);
+  }
+
+  @Override
+  public void doDelete(HttpServletRequest request, HttpServletResponse response) throws IOException {
+    String name = aliasName(request);
+    if (!MojoStore.removeAlias(name))
+      response.sendError(HttpServletResponse.SC_NOT_FOUND, "Alias " + name + " not found");
+  }
+
+  private String aliasName(HttpServletRequest request) throws MalformedURLException {
+    String[] pathParts = pathParts(request);
+    if (pathParts.length != 2)
+      throw new MalformedURLException("Expected URL of the form /aliases/{name}");
+    return pathParts[1];
+  }
+
+}
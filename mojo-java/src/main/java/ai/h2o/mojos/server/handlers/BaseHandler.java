@@ -3,6 +3,7 @@ package ai.h2o.mojos.server.handlers;
 import javax.servlet.http.HttpServlet;
 import javax.servlet.http.HttpServletRequest;
 import javax.servlet.http.HttpServletResponse;
+import java.io.BufferedReader;
 import java.io.IOException;
 import java.io.PrintWriter;
 import java.lang.reflect.InvocationTargetException;
@@ -18,20 +19,31 @@ public abstract class BaseHandler extends HttpServlet {
   public final void doGet(HttpServletRequest request, HttpServletResponse response) {
     try {
       getImpl(request, response);
-    } catch (IllegalArgumentException e) {
-      makeErrorResponse(getStackTrace(e), 400, response);
-    } catch (MalformedURLException e) {
-      makeErrorResponse(e.toString(), 404, response);
-    } catch (InvocationTargetException e) {
-      makeErrorResponse(getStackTrace(e.getCause()), 400, response);
     } catch (Exception e) {
-      makeErrorResponse(getStackTrace(e), 500, response);
+      handleException(e, response);
+    }
+  }
+
+  @Override
+  public void doPost(HttpServletRequest request, HttpServletResponse response) throws IOException {
+    try {
+      postImpl(request, response);
+    } catch (Exception e) {
+      handleException(e, response);
     }
   }
 
 
   protected abstract void getImpl(HttpServletRequest request, HttpServletResponse response) throws Exception;
 
+  /**
+   * Handler for the POST requests. By default POST is not supported, and
+   * subclasses that want to accept it should override this method.
+   */
+  protected void postImpl(HttpServletRequest request, HttpServletResponse response) throws Exception {
+    response.sendError(HttpServletResponse.SC_METHOD_NOT_ALLOWED);
+  }
+
   protected String[] pathParts(HttpServletRequest request) throws MalformedURLException {
     String pathInfo = request.getPathInfo();
     String[] pathParts = pathInfo == null? null : pathInfo.split("/");
@@ -40,6 +52,16 @@ public abstract class BaseHandler extends HttpServlet {
     return pathParts;
   }
 
+  protected String readBody(HttpServletRequest request) throws IOException {
+    StringBuilder sb = new StringBuilder();
+    BufferedReader reader = request.getReader();
+    char[] buf = new char[8192];
+    int n;
+    while ((n = reader.read(buf)) != -1)
+      sb.append(buf, 0, n);
+    return sb.toString();
+  }
+
   protected PrintWriter makeTextResponse(HttpServletResponse response) throws IOException {
     response.setStatus(200);
     response.setContentType("text/plain");
@@ -47,6 +69,17 @@ public abstract class BaseHandler extends HttpServlet {
   }
 
 
+  private void handleException(Exception e, HttpServletResponse response) {
+    if (e instanceof IllegalArgumentException)
+      makeErrorResponse(getStackTrace(e), 400, response);
+    else if (e instanceof MalformedURLException)
+      makeErrorResponse(e.toString(), 404, response);
+    else if (e instanceof InvocationTargetException)
+      makeErrorResponse(getStackTrace(e.getCause()), 400, response);
+    else
+      makeErrorResponse(getStackTrace(e), 500, response);
+  }
+
   private void makeErrorResponse(String errorMessage, int errorCode, HttpServletResponse response) {
     response.setStatus(errorCode);
     response.setContentType("text/plain");
@@ -15,7 +15,8 @@ import java.io.IOException;
  * This will instantiate a {@link MojoModel} from the given {@code file},
  * storing it in the {@link MojoStore}, and returns an id of the new model
  * (in a plain text format). The file name should be given with absolute path,
- * or otherwise it probably won't be found.
+ * or otherwise it probably won't be found. If the same file was loaded already
+ * (and was not modified since), then the id of that model is returned instead.
  * <p>
  * If the model cannot instantiated for whatever reason, a 400 error will
  * be raised.
@@ -29,9 +30,11 @@ public class LoadMojoHandler extends BaseHandler {
     if (mojofile == null)
       throw new IllegalArgumentException("Parameter `file` is missing.");
 
-    // Load the model
-    MojoModel model = MojoModel.load(mojofile);
-    String id = MojoStore.addModel(model);
+    // Load the model, unless it is loaded already
+    String key = MojoStore.fileKey(mojofile);
+    String id = MojoStore.acquireModel(key);
+    if (id == null)
+      id = MojoStore.addModel(MojoModel.load(mojofile), mojofile, key);
 
     // Produce the response
     response.setContentType("text/plain");
@@ -1,8 +1,13 @@
 package ai.h2o.mojos.server.handlers;
 
+import ai.h2o.mojos.server.core.BinaryPayload;
 import ai.h2o.mojos.server.core.MojoApi;
 import ai.h2o.mojos.server.core.MojoStore;
+import ai.h2o.mojos.server.core.PredictionCache;
+import ai.h2o.mojos.server.core.ShadowScorer;
+import ai.h2o.mojos.server.core.SharedMatrix;
 import hex.genmodel.MojoModel;
+import org.eclipse.jetty.util.ajax.JSON;
 
 import javax.servlet.http.HttpServletRequest;
 import javax.servlet.http.HttpServletResponse;
@@ -11,6 +16,8 @@ import java.io.PrintWriter;
 import java.lang.reflect.InvocationTargetException;
 import java.net.MalformedURLException;
 import java.util.Arrays;
+import java.util.HashMap;
+import java.util.Map;
 
 
 /**
@@ -38,9 +45,44 @@ import java.util.Arrays;
  * return result stringified.
  * <p>
  * <p>
+ * The third endpoint is
+ * <pre>{@code    POST /mojos/{model_id}}</pre>
+ * which executes a batch of methods on the model {@code model_id}. The body
+ * of the request is a JSON list of commands, each command being a list of
+ * strings {@code [method, arg1, ..., argN]}. The response is a JSON list of
+ * strings with the results of each command, in the same order as the commands
+ * were given. Each result is exactly what the corresponding single-method
+ * endpoint would have returned.
+ * <p>
+ * <p>
+ * Methods can also be executed with
+ * <pre>{@code    POST /mojos/{model_id}/{method}}</pre>
+ * where the arguments are passed in the request body encoded as a
+ * {@link BinaryPayload} (content type {@code application/x-mojo-binary}).
+ * If the client accepts this content type and the method returns a
+ * {@code double[]}, then the result is sent back in the same binary
+ * encoding; otherwise it is returned as plain text just like with the
+ * {@code GET} endpoint.
+ * <p>
+ * <p>
+ * Bulk scoring is done with
+ * <pre>{@code    POST /mojos/{model_id}/{method}/shm?in=...&out=...&nrows=...&ncols=...&npreds=...}</pre>
+ * where the rows are exchanged through shared memory (see {@link SharedMatrix}).
+ * The {@code method} (such as {@code score0~dada}) is called as
+ * {@code method(row, preds)} for each row of the {@code nrows x ncols} input
+ * segment {@code in}, and its results are written into the {@code nrows x npreds}
+ * output segment {@code out}. The response is a JSON object
+ * {@code {"rows": nrows, "errors": {row: message}}}, listing the rows for which
+ * the method didn't return a {@code double[]} (their predictions are NaNs).
+ * <p>
+ * <p>
  * Lastly, endpoint
  * <pre>{@code    DELETE /mojos/{model_id}}</pre>
  * removes a previously loaded model.
+ * <p>
+ * The scoring calls of all these endpoints are mirrored to the shadow of the
+ * model, if it has one (see {@link ShadowScorer}), and their results are
+ * cached if the cache is enabled (see {@link PredictionCache}).
  */
 public class MojoApiHandler extends BaseHandler {
 
@@ -55,6 +97,19 @@ public class MojoApiHandler extends BaseHandler {
       throw new MalformedURLException("Unexpected URL " + request.getRequestURI());
   }
 
+  @Override
+  protected void postImpl(HttpServletRequest request, HttpServletResponse response) throws Exception {
+    String[] pathParts = pathParts(request);
+    if (pathParts.length == 2)
+      executeModelBatch(pathParts[1], request, response);
+    else if (pathParts.length == 3)
+      executeModelMethodBinary(pathParts[1], pathParts[2], request, response);
+    else if (pathParts.length == 4 && pathParts[3].equals("shm"))
+      executeModelMethodShm(pathParts[1], pathParts[2], request, response);
+    else
+      throw new MalformedURLException("Unexpected URL " + request.getRequestURI());
+  }
+
   @Override
   public void doDelete(HttpServletRequest request, HttpServletResponse response) throws IOException {
     String pathInfo = request.getPathInfo();
@@ -62,7 +117,7 @@ public class MojoApiHandler extends BaseHandler {
       throw new MalformedURLException("Expected URL of the form /mojos/{mojo_id}");
 
     String modelId = pathInfo.substring(1);
-    MojoStore.delModel(modelId);
+    MojoStore.releaseModel(modelId);
   }
 
   //--------------------------------------------------------------------------------------------------------------------
@@ -94,39 +149,197 @@ public class MojoApiHandler extends BaseHandler {
       HttpServletResponse response
   ) throws Exception {
     // Verify validity of input parameters
+    modelId = MojoStore.resolve(modelId);
     MojoModel model = MojoStore.getModel(modelId);
     MojoApi api = MojoStore.getModelApi(model);
     if (model == null || api == null)
       throw new IllegalArgumentException("Model " + modelId + " was not loaded");
+    MojoApi.ApiMethod methodApi = findMethod(api, methodName);
+
+    // Execute the request
+    int nArgs = methodApi.numArgs();
+    String[] queryArgs = new String[nArgs];
+    for (int i = 1; i <= nArgs; i++)
+      queryArgs[i - 1] = request.getParameter("arg" + i);
+    Object[] shadowArgs = ShadowScorer.sample(modelId, methodApi, queryArgs);
+    String result = invokeMethod(modelId, model, methodApi, queryArgs);
+    ShadowScorer.mirror(modelId, methodApi, shadowArgs, result);
+
+    // Write the output
+    PrintWriter out = makeTextResponse(response);
+    out.println(result);
+  }
+
+  private void executeModelBatch(
+      String modelId,
+      HttpServletRequest request,
+      HttpServletResponse response
+  ) throws Exception {
+    // Verify validity of input parameters
+    modelId = MojoStore.resolve(modelId);
+    MojoModel model = MojoStore.getModel(modelId);
+    MojoApi api = MojoStore.getModelApi(model);
+    if (model == null || api == null)
+      throw new IllegalArgumentException("Model " + modelId + " was not loaded");
+    Object parsed = JSON.parse(readBody(request));
+    if (!(parsed instanceof Object[]))
+      throw new IllegalArgumentException("Expected a JSON list of commands");
+    Object[] commands = (Object[]) parsed;
+
+    // Execute all commands in order
+    String[] results = new String[commands.length];
+    for (int i = 0; i < commands.length; i++) {
+      if (!(commands[i] instanceof Object[]) || ((Object[]) commands[i]).length == 0)
+        throw new IllegalArgumentException("Command " + i + " is not a list [method, arg1, ..., argN]");
+      Object[] command = (Object[]) commands[i];
+      MojoApi.ApiMethod methodApi = findMethod(api, String.valueOf(command[0]));
+      int nArgs = methodApi.numArgs();
+      String[] args = new String[nArgs];
+      for (int j = 1; j <= nArgs; j++)
+        args[j - 1] = j < command.length && command[j] != null ? String.valueOf(command[j]) : null;
+      Object[] shadowArgs = ShadowScorer.sample(modelId, methodApi, args);
+      results[i] = invokeMethod(modelId, model, methodApi, args);
+      ShadowScorer.mirror(modelId, methodApi, shadowArgs, results[i]);
+    }
+
+    // Write the output
+    response.setStatus(HttpServletResponse.SC_OK);
+    response.setContentType("application/json");
+    response.getWriter().print(JSON.toString(results));
+  }
+
+  private void executeModelMethodBinary(
+      String modelId,
+      String methodName,
+      HttpServletRequest request,
+      HttpServletResponse response
+  ) throws Exception {
+    // Verify validity of input parameters
+    modelId = MojoStore.resolve(modelId);
+    MojoModel model = MojoStore.getModel(modelId);
+    MojoApi api = MojoStore.getModelApi(model);
+    if (model == null || api == null)
+      throw new IllegalArgumentException("Model " + modelId + " was not loaded");
+    MojoApi.ApiMethod methodApi = findMethod(api, methodName);
+    String contentType = request.getContentType();
+    if (contentType == null || !contentType.startsWith(BinaryPayload.CONTENT_TYPE))
+      throw new IllegalArgumentException("Expected request body of type " + BinaryPayload.CONTENT_TYPE);
+
+    // Execute the request
+    Object[] args = BinaryPayload.readValues(request.getInputStream());
+    Object[] shadowArgs = ShadowScorer.sample(modelId, methodApi, args);
+    Object retVal;
+    try {
+      retVal = PredictionCache.invoke(modelId, model, methodApi, args);
+    } catch (InvocationTargetException e) {
+      retVal = exceptionResult(e);
+      ShadowScorer.mirror(modelId, methodApi, shadowArgs, retVal);
+      makeTextResponse(response).println(retVal);
+      return;
+    }
+    ShadowScorer.mirror(modelId, methodApi, shadowArgs, retVal);
+
+    // Write the output
+    String accept = request.getHeader("Accept");
+    if (retVal instanceof double[] && accept != null && accept.contains(BinaryPayload.CONTENT_TYPE)) {
+      byte[] out = BinaryPayload.encodeDoubles((double[]) retVal);
+      response.setStatus(HttpServletResponse.SC_OK);
+      response.setContentType(BinaryPayload.CONTENT_TYPE);
+      response.setContentLength(out.length);
+      response.getOutputStream().write(out);
+    } else {
+      makeTextResponse(response).println(methodApi.stringify(retVal));
+    }
+  }
+
+  private void executeModelMethodShm(
+      String modelId,
+      String methodName,
+      HttpServletRequest request,
+      HttpServletResponse response
+  ) throws Exception {
+    // Verify validity of input parameters
+    modelId = MojoStore.resolve(modelId);
+    MojoModel model = MojoStore.getModel(modelId);
+    MojoApi api = MojoStore.getModelApi(model);
+    if (model == null || api == null)
+      throw new IllegalArgumentException("Model " + modelId + " was not loaded");
+    MojoApi.ApiMethod methodApi = findMethod(api, methodName);
+    int nrows = intParameter(request, "nrows");
+    int ncols = intParameter(request, "ncols");
+    int npreds = intParameter(request, "npreds");
+
+    // Execute the method on each row
+    Map<String, String> errors = new HashMap<>();
+    if (nrows > 0) {
+      try (SharedMatrix inputs = SharedMatrix.open(request.getParameter("in"), nrows, ncols, false);
+           SharedMatrix outputs = SharedMatrix.open(request.getParameter("out"), nrows, npreds, true)) {
+        for (int i = 0; i < nrows; i++) {
+          Object[] args = new Object[]{inputs.getRow(i), new double[npreds]};
+          Object[] shadowArgs = ShadowScorer.sample(modelId, methodApi, args);
+          Object retVal;
+          try {
+            retVal = PredictionCache.invoke(modelId, model, methodApi, args);
+          } catch (InvocationTargetException e) {
+            retVal = exceptionResult(e);
+          }
+          ShadowScorer.mirror(modelId, methodApi, shadowArgs, retVal);
+          if (retVal instanceof double[]) {
+            outputs.setRow(i, (double[]) retVal);
+          } else {
+            errors.put(String.valueOf(i), retVal instanceof String ? (String) retVal : methodApi.stringify(retVal));
+            outputs.setRow(i, new double[0]);
+          }
+        }
+      }
+    }
+
+    // Write the acknowledgement
+    Map<String, Object> ack = new HashMap<>();
+    ack.put("rows", nrows);
+    ack.put("errors", errors);
+    response.setStatus(HttpServletResponse.SC_OK);
+    response.setContentType("application/json");
+    response.getWriter().print(JSON.toString(ack));
+  }
+
+  private int intParameter(HttpServletRequest request, String name) {
+    String value = request.getParameter(name);
+    if (value == null)
+      throw new IllegalArgumentException("Parameter " + name + " is missing");
+    return Integer.parseInt(value);
+  }
+
+  private MojoApi.ApiMethod findMethod(MojoApi api, String methodName) {
     if (!api.hasMethodWithUniqueName(methodName)) {
       if (api.hasMethodWithName(methodName))
         throw new IllegalArgumentException("Class " + api.name() + " has multiple methods with name " + methodName);
       else
         throw new IllegalArgumentException("Class " + api.name() + " doesn't have a method with name " + methodName);
     }
+    return api.getMethodByUniqueName(methodName);
+  }
 
-    // Execute the request
-    MojoApi.ApiMethod methodApi = api.getMethodByUniqueName(methodName);
-    int nArgs = methodApi.numArgs();
-    String[] queryArgs = new String[nArgs];
-    for (int i = 1; i <= nArgs; i++)
-      queryArgs[i - 1] = request.getParameter("arg" + i);
+  private String invokeMethod(String modelId, MojoModel model, MojoApi.ApiMethod methodApi, String[] args)
+      throws Exception {
     String result;
     try {
-      result = methodApi.invoke(model, queryArgs);
+      result = methodApi.stringify(PredictionCache.invoke(modelId, model, methodApi, args));
     } catch (IllegalAccessException | IllegalArgumentException e) {
       // Re-throw any error related to invocation of the method itself
       throw e;
     } catch (InvocationTargetException e) {
       // However catch any exceptions that occurred in the downstream mojo -- they are part of the API!
-      result = e.getCause().toString();
-      // Some Java runtimes append an index at the end, others don't. Thus we need to normalize the message.
-      if (result.startsWith("java.lang.ArrayIndexOutOfBoundsException"))
-        result = "java.lang.ArrayIndexOutOfBoundsException";
+      result = exceptionResult(e);
     }
+    return result;
+  }
 
-    // Write the output
-    PrintWriter out = makeTextResponse(response);
-    out.println(result);
+  private String exceptionResult(InvocationTargetException e) {
+    String result = e.getCause().toString();
+    // Some Java runtimes append an index at the end, others don't. Thus we need to normalize the message.
+    if (result.startsWith("java.lang.ArrayIndexOutOfBoundsException"))
+      result = "java.lang.ArrayIndexOutOfBoundsException";
+    return result;
   }
 }
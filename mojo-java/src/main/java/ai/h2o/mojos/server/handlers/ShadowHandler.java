@@ -0,0 +1,90 @@
+package ai.h2o.mojos.server.handlers;
+
+import ai.h2o.mojos.server.core.MojoStore;
+import ai.h2o.mojos.server.core.ShadowScorer;
+import org.eclipse.jetty.util.ajax.JSON;
+
+import javax.servlet.http.HttpServletRequest;
+import javax.servlet.http.HttpServletResponse;
+import java.io.IOException;
+import java.net.MalformedURLException;
+import java.util.Map;
+
+/**
+ * Servlet that handles the shadows of the models (see {@link ShadowScorer}):
+ * <pre>{@code
+ *   GET /shadows
+ *   GET /shadows/{model_id}
+ *   POST /shadows/{model_id}?shadow=...&tolerance=...&rate=...
+ *   DELETE /shadows/{model_id}
+ * }</pre>
+ * The first request returns the statistics of all the shadows as a JSON
+ * object, keyed by the ids of their primary models, and the second one those
+ * of the shadow of the model {@code model_id}. The third one mirrors the
+ * scoring calls of the model {@code model_id} to the model {@code shadow},
+ * comparing their predictions within {@code tolerance} (1e-10 by default); only
+ * a {@code rate} fraction of the calls is mirrored (all of them by default).
+ * The last one removes the shadow, and returns its final statistics.
+ */
+public class ShadowHandler extends BaseHandler {
+
+  @Override
+  protected void getImpl(HttpServletRequest request, HttpServletResponse response) throws Exception {
+    Object stats;
+    if (request.getPathInfo() == null || request.getPathInfo().equals("/")) {
+      stats = ShadowScorer.getAllStats();
+    } else {
+      String modelId = modelId(request);
+      stats = ShadowScorer.getStats(MojoStore.resolve(modelId));
+      if (stats == null) {
+        response.sendError(HttpServletResponse.SC_NOT_FOUND, "Model " + modelId + " has no shadow");
+        return;
+      }
+    }
+    response.setStatus(HttpServletResponse.SC_OK);
+    response.setContentType("application/json");
+    response.getWriter().print(JSON.toString(stats));
+  }
+
+  @Override
+  protected void postImpl(HttpServletRequest request, HttpServletResponse response) throws Exception {
+    String modelId = MojoStore.resolve(modelId(request));
+    String shadowId = request.getParameter("shadow");
+    double tolerance = doubleParameter(request, "tolerance", 1e-10);
+    double rate = doubleParameter(request, "rate", 1);
+    if (!(rate > 0 && rate <= 1))
+      throw new IllegalArgumentException("The rate must be in (0, 1], not " + rate);
+    if (MojoStore.getModel(modelId) == null)
+      throw new IllegalArgumentException("Model " + modelId + " was not loaded");
+    if (shadowId == null || MojoStore.getModel(shadowId) == null)
+      throw new IllegalArgumentException("Model " + shadowId + " was not loaded");
+    ShadowScorer.setShadow(modelId, MojoStore.resolve(shadowId), tolerance, rate);
+    response.setStatus(HttpServletResponse.SC_OK);
+  }
+
+  @Override
+  public void doDelete(HttpServletRequest request, HttpServletResponse response) throws IOException {
+    String modelId = modelId(request);
+    Map<String, Object> stats = ShadowScorer.removeShadow(MojoStore.resolve(modelId));
+    if (stats == null) {
+      response.sendError(HttpServletResponse.SC_NOT_FOUND, "Model " + modelId + " has no shadow");
+      return;
+    }
+    response.setStatus(HttpServletResponse.SC_OK);
+    response.setContentType("application/json");
+    response.getWriter().print(JSON.toString(stats));
+  }
+
+  private String modelId(HttpServletRequest request) throws MalformedURLException {
+    String[] pathParts = pathParts(request);
+    if (pathParts.length != 2)
+      throw new MalformedURLException("Expected URL of the form /shadows/{model_id}");
+    return pathParts[1];
+  }
+
+  private double doubleParameter(HttpServletRequest request, String name, double defaultValue) {
+    String value = request.getParameter(name);
+    return value == null ? defaultValue : Double.parseDouble(value);
+  }
+
+}
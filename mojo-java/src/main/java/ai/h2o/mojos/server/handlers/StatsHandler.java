@@ -0,0 +1,32 @@
+package ai.h2o.mojos.server.handlers;
+
+import ai.h2o.mojos.server.core.MojoStore;
+import ai.h2o.mojos.server.core.PredictionCache;
+import org.eclipse.jetty.util.ajax.JSON;
+
+import javax.servlet.http.HttpServletRequest;
+import javax.servlet.http.HttpServletResponse;
+import java.util.Map;
+
+/**
+ * Handler for
+ * <pre>{@code  GET /stats}</pre>
+ * request, which returns the statistics of the {@link MojoStore} as a JSON
+ * object: the number of models that are addressable ({@code models}) and
+ * in memory ({@code loaded}), the total size of their files, the budget, and
+ * how many times the models were evicted and loaded again; and the statistics
+ * of the {@link PredictionCache}: its size, and how many calls it has served
+ * ({@code cache_hits}) and not ({@code cache_misses}).
+ */
+public class StatsHandler extends BaseHandler {
+
+  @Override
+  protected void getImpl(HttpServletRequest request, HttpServletResponse response) throws Exception {
+    response.setStatus(HttpServletResponse.SC_OK);
+    response.setContentType("application/json");
+    Map<String, Object> stats = MojoStore.getStats();
+    stats.putAll(PredictionCache.getStats());
+    response.getWriter().print(JSON.toString(stats));
+  }
+
+}
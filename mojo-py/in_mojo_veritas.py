@@ -10,22 +10,60 @@ model against the saved results if they exist, and if they don't they will be
 created and saved too.
 """
 import argparse
+import copy
 import sys
 import re
 assert sys.version_info >= (3, 5), "Python 3.5+ is required"
 
 if __name__ == "__main__":
     import mojoland
+    from mojoland.backend.profiles import PROFILES
     parser = argparse.ArgumentParser(description="Taste all mojo recipes.")
     parser.add_argument("--creative", help="Enable baking new mojos / nibbles.", action="store_true")
     parser.add_argument("--recipe", help="Taste this specific recipe (if not given, all recipes will be tasted)")
     parser.add_argument("--filter", help="Taste only recipes matching given filter")
     parser.add_argument("--backend", help="Which backend to use for testing: python / java", default="java",
                         choices=["java", "python"])
+    parser.add_argument("--transport", help="How to talk to the backend: http / unix / stdio (default is http for "
+                                            "a single instance, and stdio for a pool)",
+                        choices=["http", "unix", "stdio"])
+    parser.add_argument("--instances", help="Number of backend server processes to run as a pool", type=int, default=1)
+    parser.add_argument("--daemon", help="Keep the backend server running after the tasting, so that the next run "
+                                         "can reuse it (requires the http or unix transport)", action="store_true")
+    parser.add_argument("--idle-timeout", help="Number of seconds after which an idle backend daemon exits "
+                                               "(default is 1800)", type=int)
+    parser.add_argument("--supervised", help="Restart the backend server if it crashes or hangs, and retry the "
+                                             "failed request", action="store_true")
+    parser.add_argument("--profile", help="How to run the backend server: debug (with assertions, the default), or "
+                                          "throughput / low-latency (production-like settings, for benchmarks)",
+                        choices=["debug", "throughput", "low-latency"], default="debug")
+    parser.add_argument("--max-models", help="Maximum number of models that the backend server keeps in memory: the "
+                                             "least recently used ones are evicted, and loaded again when needed",
+                        type=int)
+    parser.add_argument("--cache-size", help="Number of predictions that the backend server caches, so that the "
+                                             "repeated rows are not scored again", type=int)
+    parser.add_argument("--batch-size", help="Number of nibble commands to send to the backend in a single request "
+                                             "(1 disables batching)", type=int, default=1000)
+    parser.add_argument("--in-flight", help="Number of batches that can be sent to the backend before their results "
+                                            "are received (requires the http or unix transport)", type=int, default=1)
     args = parser.parse_args()
 
-    connoisseur = mojoland.Connoisseur(backend=args.backend.lower())
+    profile = PROFILES[args.profile]
+    if args.max_models:
+        profile = copy.copy(profile)
+        profile.name += "-max%d" % args.max_models
+        profile.max_models = args.max_models
+    if args.cache_size:
+        profile = copy.copy(profile)
+        profile.name += "-cache%d" % args.cache_size
+        profile.cache_size = args.cache_size
+    connoisseur = mojoland.Connoisseur(backend=args.backend.lower(), transport=args.transport,
+                                       instances=args.instances, daemon=args.daemon,
+                                       idle_timeout=args.idle_timeout, supervised=args.supervised,
+                                       profile=profile)
     connoisseur.can_bake = args.creative
+    connoisseur.batch_size = args.batch_size
+    connoisseur.in_flight = args.in_flight
 
     recipes = mojoland.list_recipes()
     if args.recipe:
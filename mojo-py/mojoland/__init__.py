@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
 
-from .backend import MojoBackend, get_backend
+from .backend import AsyncMojoBackend, LaunchProfile, MojoBackend, MojoBackendPool, SupervisedMojoBackend, get_backend
+from .batcher import ScoringBatcher
 from .mojo_model import MojoModel
 from .recipes.baserecipe import BaseRecipe
 from .recipes.connoisseur import Connoisseur, MojoUnstableError
 
-__all__ = ("BaseRecipe", "Connoisseur", "MojoBackend", "get_backend", "MojoModel", "MojoUnstableError")
+__all__ = ("AsyncMojoBackend", "BaseRecipe", "Connoisseur", "LaunchProfile", "MojoBackend", "MojoBackendPool",
+           "get_backend", "MojoModel", "MojoUnstableError", "ScoringBatcher", "SupervisedMojoBackend")
 
 
 def list_recipes():
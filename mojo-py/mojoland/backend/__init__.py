@@ -1,20 +1,62 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
-from typing import Dict
+import functools
+from typing import Dict, Tuple, Union
 from .mojobackend import MojoBackend
+from .asyncbackend import AsyncMojoBackend
 from .java import JavaMojoBackend
+from .pool import MojoBackendPool
+from .profiles import LaunchProfile, get_profile
 from .python import PythonMojoBackend
+from .supervisor import SupervisedMojoBackend
 
 
-_instances = {}  # type: Dict[str, MojoBackend]
+Backend = Union[MojoBackend, MojoBackendPool, SupervisedMojoBackend]
 
-def get_backend(name: str) -> MojoBackend:
-    if name not in _instances:
+_instances = {}  # type: Dict[Tuple[str, str, int, bool, bool, str], Backend]
+
+def get_backend(name: str, transport: str = None, instances: int = 1, daemon: bool = False,
+                idle_timeout: int = None, supervised: bool = False,
+                profile: Union[str, LaunchProfile] = None) -> Backend:
+    """
+    Return the backend ``name`` ("java" or "python"), starting it if necessary.
+
+    The ``transport`` is one of "http", "unix" or "stdio" (see :class:`MojoBackend`).
+    If ``instances`` is more than 1, then the backend is a :class:`MojoBackendPool`
+    of that many server processes, using the "stdio" transport by default. A single
+    backend uses the "http" transport by default.
+
+    With ``daemon=True`` the server keeps running after this process exits, until it
+    has been idle for ``idle_timeout`` seconds (see :class:`MojoBackend`). This is
+    not supported for a pool.
+
+    With ``supervised=True`` each server is restarted if it crashes or hangs (see
+    :class:`SupervisedMojoBackend`). This is not supported for a daemon.
+
+    The ``profile`` selects how the servers are run (see :mod:`.profiles`); it is
+    "debug" by default.
+    """
+    if transport is None:
+        transport = "http" if instances == 1 else "stdio"
+    if daemon and instances != 1:
+        raise ValueError("A pool of backends cannot run as a daemon")
+    if daemon and supervised:
+        raise ValueError("A backend running as a daemon cannot be supervised")
+    profile = get_profile(profile)
+    key = (name, transport, instances, daemon, supervised, profile.name)
+    if key not in _instances:
         if name == "java":
-            server = JavaMojoBackend()
+            backend_class = JavaMojoBackend
         elif name == "python":
-            server = PythonMojoBackend()
+            backend_class = PythonMojoBackend
         else:
             raise RuntimeError("Unknown backendL %s" % name)
-        _instances[name] = server
-    return _instances[name]
+        if supervised:
+            backend_class = functools.partial(SupervisedMojoBackend, backend_class)
+        backend_class = functools.partial(backend_class, profile=profile)
+        if instances == 1:
+            server = backend_class(transport, daemon=daemon, idle_timeout=idle_timeout)
+        else:
+            server = MojoBackendPool(backend_class, instances, transport)
+        _instances[key] = server
+    return _instances[key]
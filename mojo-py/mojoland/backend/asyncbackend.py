@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import asyncio
+import itertools
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from .mojobackend import ENDPOINT_RE, MojoBackend
+from .transport import Response
+
+
+class AsyncMojoBackend:
+    """
+    Asynchronous client for the server of a :class:`MojoBackend`.
+
+    The synchronous backend takes care of starting the server (over the "http"
+    or "unix" transport); this class then talks to the same server with
+    awaitable methods. Up to ``max_in_flight`` requests may be in progress at
+    the same time, each on its own (kept-alive) connection, so that the server
+    always has the next request to work on while the client is busy with the
+    previous responses.
+    """
+
+    def __init__(self, backend: MojoBackend, max_in_flight: int = 4):
+        kind, address = backend.address
+        if kind not in ("http", "unix"):
+            raise ValueError("AsyncMojoBackend requires the http or unix transport, not %s" % kind)
+        assert max_in_flight >= 1, "Invalid max_in_flight = %r" % max_in_flight
+        self._kind = kind
+        self._address = address
+        self._max_in_flight = max_in_flight
+        self._semaphore = None  # type: Optional[asyncio.Semaphore]
+        self._idle = []         # type: List[_HttpConnection]
+
+
+    @property
+    def max_in_flight(self) -> int:
+        return self._max_in_flight
+
+
+    async def load_model(self, mojofile: str) -> str:
+        """Load the specified mojofile, and return its model id."""
+        return await self._request("GET /loadmojo", params={"file": mojofile})
+
+
+    async def get_model_api(self, model_id: str) -> List[str]:
+        return (await self._request("GET /mojos/%s" % model_id)).split("\n")
+
+
+    async def invoke_method(self, model_id: str, method: str, params: Dict) -> str:
+        return await self._request("GET /mojos/%s/%s" % (model_id, method), params=params)
+
+
+    async def invoke_batch(self, model_id: str, commands: Iterable[Tuple], chunk_size: int = None) -> List[str]:
+        """
+        Invoke several methods ``(method, arg1, ..., argN)`` on the model.
+
+        The commands are split into chunks of ``chunk_size`` (by default all of
+        them are sent in a single request), and the chunks are sent concurrently.
+        The results are returned in the same order as the commands.
+        """
+        commands = iter(commands)
+        chunks = []
+        while True:
+            chunk = list(itertools.islice(commands, chunk_size))
+            if not chunk:
+                break
+            chunks.append(self._invoke_chunk(model_id, chunk))
+        results = await asyncio.gather(*chunks)
+        return [res for chunk_results in results for res in chunk_results]
+
+
+    async def unload_model(self, model_id: str) -> None:
+        await self._request("DELETE /mojos/%s" % model_id)
+
+
+    def close(self) -> None:
+        """Close all idle connections to the server."""
+        for conn in self._idle:
+            conn.close()
+        self._idle = []
+
+
+    #-------------------------------------------------------------------------------------------------------------------
+    # Private
+    #-------------------------------------------------------------------------------------------------------------------
+
+    async def _invoke_chunk(self, model_id: str, commands: List[Tuple]) -> List[str]:
+        payload = [[str(part) for part in command] for command in commands]
+        results = json.loads(await self._request("POST /mojos/%s" % model_id, body=payload))
+        return [res.strip() for res in results]
+
+
+    async def _request(self, endpoint: str, params: Dict = None, body: object = None) -> str:
+        mm = ENDPOINT_RE.match(endpoint)
+        if not mm:
+            raise Exception("Invalid endpoint %s" % endpoint)
+        url = mm.group(2) + ("?" + urlencode(params) if params else "")
+        data = b""
+        headers = {}
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_in_flight)
+        async with self._semaphore:
+            conn = self._idle.pop() if self._idle else None
+            try:
+                try:
+                    if conn is None:
+                        conn = await self._connect()
+                    resp = await conn.request(mm.group(1), url, data, headers)
+                except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError):
+                    # A reused connection may have been dropped by the server while it was idle
+                    if conn is None or not conn.reused:
+                        raise
+                    conn.close()
+                    conn = await self._connect()
+                    resp = await conn.request(mm.group(1), url, data, headers)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                if conn is not None:
+                    conn.close()
+                raise ConnectionError("Request %s failed: %s" % (endpoint, e)) from e
+            except BaseException:
+                # A cancelled request leaves the connection in an unknown state, so it cannot be reused
+                if conn is not None:
+                    conn.close()
+                raise
+            if conn.will_close:
+                conn.close()
+            else:
+                conn.reused = True
+                self._idle.append(conn)
+        MojoBackend._check_response(resp, endpoint, params)
+        return resp.text.strip()
+
+
+    async def _connect(self) -> "_HttpConnection":
+        if self._kind == "unix":
+            reader, writer = await asyncio.open_unix_connection(self._address)
+        else:
+            reader, writer = await asyncio.open_connection("127.0.0.1", self._address)
+        return _HttpConnection(reader, writer)
+
+
+
+class _HttpConnection:
+    """Minimal HTTP/1.1 client connection over asyncio streams."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self.reused = False
+        self.will_close = False
+
+
+    async def request(self, method: str, url: str, data: bytes, headers: Dict[str, str]) -> Response:
+        lines = ["%s %s HTTP/1.1" % (method, url), "Host: localhost", "Content-Length: %d" % len(data)]
+        lines += ["%s: %s" % header for header in headers.items()]
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError("The server has closed the connection")
+        version, status = status_line.decode("latin-1").split()[:2]
+        resp_headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            resp_headers[name.strip().lower()] = value.strip()
+
+        if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+            content = await self._read_chunked()
+        elif "content-length" in resp_headers:
+            content = await self._reader.readexactly(int(resp_headers["content-length"]))
+        else:
+            content = await self._reader.read()
+            self.will_close = True
+        if version == "HTTP/1.0" or resp_headers.get("connection", "").lower() == "close":
+            self.will_close = True
+        return Response(int(status), resp_headers.get("content-type", ""), content)
+
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+    async def _read_chunked(self) -> bytes:
+        chunks = []
+        while True:
+            size = int((await self._reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # Skip the trailers
+                while (await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await self._reader.readexactly(size))
+            await self._reader.readexactly(2)
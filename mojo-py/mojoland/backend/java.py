@@ -1,20 +1,94 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
+import itertools
 import os
+import re
 import subprocess
+from typing import List, Optional
 
 from .mojobackend import MojoBackend
 
 
 class JavaMojoBackend(MojoBackend):
+    # Dynamic class-data sharing archives (-XX:ArchiveClassesAtExit) appeared in Java 13
+    _CDS_JAVA_VERSION = 13
+    _CDS_SHUTDOWN_TIMEOUT = 10    # time to wait until the server has written the archive (in seconds)
+    _java_version = None  # type: Optional[int]
+    _archive_counter = itertools.count()
 
-    def _launch_server_process(self, port) -> None:
-        jar = os.path.join(self._pkg_root_dir(), "mojo-java", "build", "libs", "mojo-server.jar")
+    def __init__(self, *args, **kwargs):
+        self._new_archive = None  # type: Optional[str]
+        super().__init__(*args, **kwargs)
+
+    def shutdown(self):
+        super().shutdown()
+        if self._new_archive:
+            # The JVM writes the archive when it exits; it is complete only if the server has exited normally
+            # (otherwise it has been killed while still writing the archive, and then the archive is thrown away)
+            if self._process.returncode == 0 and os.path.isfile(self._new_archive):
+                os.replace(self._new_archive, self._archive_path())
+            elif os.path.isfile(self._new_archive):
+                os.remove(self._new_archive)
+            self._new_archive = None
+
+    def kill(self) -> None:
+        super().kill()
+        if self._new_archive and os.path.isfile(self._new_archive):
+            os.remove(self._new_archive)
+        self._new_archive = None
+
+    def _server_command(self) -> List[str]:
+        jar = self._jar_path()
         if not os.path.isfile(jar):
             raise Exception("Could not locate JAR %s" % jar)
 
-        cmd = ["java", "-ea", "-jar", jar, "--port", str(port)]
-        self._stdout = self._make_output_file_name("out")
-        self._stderr = self._make_output_file_name("err")
-        self._process = subprocess.Popen(args=cmd, stdout=open(self._stdout, "w"), stderr=open(self._stderr, "w"))
+        return ["java"] + self._profile.java_flags() + self._cds_flags() + ["-jar", jar]
+
+    def _shutdown_timeout(self) -> float:
+        # The server must have time to write the class-data sharing archive when it exits
+        return self._CDS_SHUTDOWN_TIMEOUT if self._new_archive else super()._shutdown_timeout()
+
+    def _server_version(self) -> str:
+        return str(int(os.path.getmtime(self._jar_path())))
+
+    def _jar_path(self) -> str:
+        return os.path.join(self._pkg_root_dir(), "mojo-java", "build", "libs", "mojo-server.jar")
+
+    def _cds_flags(self) -> List[str]:
+        """
+        Flags that make the JVM use the class-data sharing archive of the server, or
+        generate it (when the server exits) if there is none yet.
+        """
+        self._new_archive = None
+        if not self._profile.cds:
+            return []
+        if self._get_java_version() < self._CDS_JAVA_VERSION:
+            print("Class-data sharing requires Java %d+, starting the server without it" % self._CDS_JAVA_VERSION)
+            return []
+        archive = self._archive_path()
+        if os.path.isfile(archive):
+            return ["-XX:SharedArchiveFile=" + archive]
+        if self._daemon:
+            # A daemon exits on its own, so nobody would install the archive that it writes
+            return []
+        os.makedirs(os.path.dirname(archive), exist_ok=True)
+        # Several servers may be generating the archive at once, so each one writes its own copy
+        self._new_archive = "%s.%d-%d.tmp" % (archive, os.getpid(), next(self._archive_counter))
+        return ["-XX:ArchiveClassesAtExit=" + self._new_archive]
+
+    def _archive_path(self) -> str:
+        # The archive is valid only for the same jar and the same JVM flags
+        return os.path.join(self._pkg_root_dir(), "temp", "cds",
+                            "mojo-server-%s-%s.jsa" % (self._server_version(), self._profile.name))
 
+    @classmethod
+    def _get_java_version(cls) -> int:
+        """Major version of the ``java`` on the PATH (0 if it cannot be determined)."""
+        if cls._java_version is None:
+            try:
+                out = subprocess.check_output(["java", "-version"], stderr=subprocess.STDOUT).decode()
+                match = re.search(r'version "(?:1\.)?(\d+)', out)
+                cls._java_version = int(match.group(1)) if match else 0
+            except (OSError, subprocess.CalledProcessError):
+                cls._java_version = 0
+        return cls._java_version
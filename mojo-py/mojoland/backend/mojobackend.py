@@ -1,28 +1,105 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
 import atexit
+import itertools
+import json
+import math
 import os
 import re
+import select
+import shutil
+import subprocess
+import tempfile
 import time
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Sequence, Tuple, Union
 
-import requests
+from mojoland.utils import parse_double_list
+from . import payload
+from .profiles import LaunchProfile, get_profile
+from .shm import SharedMatrix
+from .transport import HttpTransport, Response, StdioTransport, Transport, UnixSocketTransport
 
-
-class MojoBackend:
-    """"""
-    _TIME_TO_START = 3  # maximum time to wait until server starts (in seconds)
+# Endpoints such as "GET /mojos/1/score0~dada" (the model may also be an alias such as "gbm-titanic")
+ENDPOINT_RE = re.compile(r"(GET|POST|DELETE) ((?:/[\w~.-]+)+)$")
 
 
-    def __init__(self):
+class MojoBackend:
+    """
+    Client for a mojo server.
+
+    Each client launches its own (private) server as a child process. The
+    ``transport`` selects how to talk to the server:
+
+    - "http" -- over HTTP on a localhost port, chosen by the OS;
+    - "unix" -- over HTTP on a Unix domain socket in the temp directory;
+    - "stdio" -- over the stdin / stdout pipes of the child process.
+
+    See :mod:`.transport` for details.
+
+    A server can also be shared explicitly: if the ``port`` (for "http") or the
+    ``socket_path`` (for "unix") is given, then the server already running
+    there is reused, and a new one is launched there only if there is none.
+
+    With ``daemon=True`` the server is launched as a daemon: it is not stopped
+    when this process exits, but keeps running (so that the next process can
+    reuse it) until it has been idle for ``idle_timeout`` seconds. The daemon
+    advertises its address, pid and version in a lockfile in the ``temp``
+    directory, and the clients created with ``daemon=True`` reuse it, unless it
+    was launched from an older build of the server.
+
+    The ``profile`` (a :class:`LaunchProfile` or the name of one, see
+    :mod:`.profiles`) selects how the server process is run: with assertions and
+    the default settings ("debug"), or tuned for "throughput" or "low-latency".
+    Each profile has its own daemon.
+
+    If a ``snapshot`` file is given, then the server records its loaded models in
+    it, and a server launched later with the same file restores them, under the
+    same ids (loading them in the background). A daemon always keeps a snapshot
+    next to its lockfile, so that its clients can keep using their models after
+    it was replaced by a newer build.
+
+    Each request waits for the response at most ``request_timeout`` seconds (by
+    default without a limit), after which a :class:`ConnectionError` is raised.
+    """
+    _TIME_TO_START = 10           # base time to wait until server starts (in seconds), see _start_timeout()
+    _DAEMON_IDLE_TIMEOUT = 1800   # default time after which an idle daemon exits (in seconds)
+    _SHUTDOWN_TIMEOUT = 0.3       # time to wait until the server exits after the shutdown request (in seconds)
+    TRANSPORTS = ("http", "unix", "stdio")
+    _socket_counter = itertools.count()
+    request_timeout = None  # type: Optional[float]
+
+
+    def __init__(self, transport: str = "http", socket_path: str = None, daemon: bool = False,
+                 idle_timeout: int = None, start_timeout: float = None, port: int = None,
+                 profile: Union[str, LaunchProfile] = None, snapshot: str = None):
+        if transport not in self.TRANSPORTS:
+            raise ValueError("%s does not support transport %s, expected one of %s" %
+                             (self.__class__.__name__, transport, ", ".join(self.TRANSPORTS)))
+        if daemon and transport == "stdio":
+            raise ValueError("The server cannot run as a daemon with the stdio transport")
         self._port = -1          # type: int
+        self._shared_port = port
+        self._shared_socket_path = socket_path
+        self._socket_path = socket_path or os.path.join(
+            tempfile.gettempdir(), "mojoland-%s-%d-%d.sock" % (self.__class__.__name__.lower(), os.getpid(),
+                                                               next(MojoBackend._socket_counter)))
         self._output_dir = None  # type: Optional[str]
         self._stdout = None      # type: Optional[str]
         self._stderr = None      # type: Optional[str]
         self._process = None     # type: Optional[subprocess.Popen]
-        self._session = None
+        self._transport_name = transport
+        self._transport = None   # type: Optional[Transport]
+        self._binary_supported = True
+        self._shm_supported = True
+        self._daemon = daemon
+        self._idle_timeout = idle_timeout or self._DAEMON_IDLE_TIMEOUT
+        self._daemon_pid = None  # type: Optional[int]
+        self._start_timeout_override = start_timeout
+        self._ready_fd = None    # type: Optional[int]
+        self._profile = get_profile(profile)
+        self._snapshot = snapshot
         self._start()
-        if self._process:
+        if self._process and not daemon:
             atexit.register(self.shutdown)
 
 
@@ -39,6 +116,91 @@ class MojoBackend:
         return self._request("GET /mojos/%s/%s" % (model_id, method), params=params)
 
 
+    def invoke_batch(self, model_id: str, commands: List[Tuple]) -> List[str]:
+        """
+        Invoke several methods on the model within a single request.
+
+        Each command is a tuple ``(method, arg1, ..., argN)``. The returned list
+        contains results of all commands, in the same order as the commands,
+        and each result is the same as would have been returned by
+        :meth:`invoke_method`.
+        """
+        payload = [[str(part) for part in command] for command in commands]
+        results = json.loads(self._request("POST /mojos/%s" % model_id, body=payload))
+        return [res.strip() for res in results]
+
+
+    def invoke_binary(self, model_id: str, method: str, args: Sequence[payload.Value]) -> Union[str, List[float]]:
+        """
+        Invoke method on the model, passing ``double[]`` arguments in binary form.
+
+        The arguments are sent as a binary payload (see :mod:`.payload`), where
+        each argument is either a sequence of floats or a scalar / string that
+        will be parsed on the server side. If the method returns a ``double[]``
+        then it will be returned as a list of floats; any other result (for
+        example an exception raised in the mojo) is returned as a string.
+
+        If the server does not support binary payloads, the request falls back
+        to the textual :meth:`invoke_method`.
+        """
+        if self._binary_supported:
+            endpoint = "POST /mojos/%s/%s" % (model_id, method)
+            headers = {"Content-Type": payload.CONTENT_TYPE, "Accept": payload.CONTENT_TYPE + ", text/plain"}
+            resp = self._send(endpoint, data=payload.encode_values(args), headers=headers)
+            if self._endpoint_unknown(resp, model_id):
+                # This server doesn't know the endpoint: switch to the text protocol
+                self._binary_supported = False
+            else:
+                self._check_response(resp, endpoint, None)
+                if resp.content_type.startswith(payload.CONTENT_TYPE):
+                    return payload.decode_doubles(resp.content)
+                return resp.text.strip()
+        params = {"arg%d" % i: payload.format_value(arg) for i, arg in enumerate(args, 1)}
+        res = self.invoke_method(model_id, method, params)
+        doubles = parse_double_list(res)
+        return res if doubles is None else doubles
+
+
+    def invoke_shm(self, model_id: str, method: str, inputs: SharedMatrix, outputs: SharedMatrix) -> Dict[int, str]:
+        """
+        Invoke ``method(row, preds)`` on each row of the shared-memory matrix ``inputs``.
+
+        This is meant for scoring large blocks of rows with methods such as
+        ``score0~dada``: the server reads the rows directly from the ``inputs``
+        and writes the predictions into ``outputs`` (which must have the same
+        number of rows, and as many columns as there are predictions). Only the
+        names and shapes of the matrices are sent in the request.
+
+        Returns the dictionary of rows for which the method has failed, mapped
+        to the error messages; predictions for these rows are NaNs.
+
+        If the server does not support this endpoint, the rows are scored one
+        by one with :meth:`invoke_binary`.
+        """
+        assert inputs.nrows == outputs.nrows, "Matrices have different number of rows"
+        if self._shm_supported:
+            endpoint = "POST /mojos/%s/%s/shm" % (model_id, method)
+            params = {"in": inputs.name, "out": outputs.name, "nrows": inputs.nrows, "ncols": inputs.ncols,
+                      "npreds": outputs.ncols}
+            resp = self._send(endpoint, params=params)
+            if self._endpoint_unknown(resp, model_id):
+                # This server doesn't know the endpoint: score the rows one by one
+                self._shm_supported = False
+            else:
+                self._check_response(resp, endpoint, params)
+                return {int(row): msg.strip() for row, msg in json.loads(resp.text)["errors"].items()}
+        errors = {}
+        preds = [0.0] * outputs.ncols
+        nans = [math.nan] * outputs.ncols
+        for i in range(inputs.nrows):
+            res = self.invoke_binary(model_id, method, [inputs.read_row(i), preds])
+            if isinstance(res, str):
+                errors[i] = res
+                res = nans
+            outputs.write_row(i, (res + nans)[:outputs.ncols])
+        return errors
+
+
     def shutdown(self):
         """
         Shutdown / kill the server.
@@ -49,19 +211,125 @@ class MojoBackend:
         """
         try:
             self._request("POST /shutdown")
-            time.sleep(0.300)
-        except requests.exceptions.ConnectionError:
+            # Closing the transport also ends the input of a server in the stdio mode
+            self._transport.close()
+            if self._process:
+                self._process.wait(timeout=self._shutdown_timeout())
+        except subprocess.TimeoutExpired:
             pass
+        except ConnectionError:
+            self._transport.close()
         if self._process and self._process.poll() is None:
             self._process.kill()
-        if self._session:
-            self._session.close()
+
+
+    def kill(self) -> None:
+        """Kill the server right away, without asking it to shut down (for example when it hangs)."""
+        if self._process and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        self._transport.close()
 
 
     def unload_model(self, model_id: str) -> None:
         self._request("DELETE /mojos/%s" % model_id)
 
 
+    def set_alias(self, name: str, model_id: str) -> Optional[str]:
+        """
+        Point the alias ``name`` to the model ``model_id``, and return the id of the model
+        it pointed to before (if any).
+
+        The alias can be used instead of a model id in all the methods (except
+        :meth:`unload_model`). It is repointed atomically: the requests in progress
+        finish with the previous model. The alias keeps its model loaded, so a model
+        can be swapped without downtime by loading the new version, warming it up,
+        pointing the alias to it, and then unloading the previous version.
+        """
+        previous = self._request("POST /aliases/%s" % name, params={"id": model_id})
+        return previous or None
+
+
+    def remove_alias(self, name: str) -> None:
+        self._request("DELETE /aliases/%s" % name)
+
+
+    def aliases(self) -> Dict[str, str]:
+        """All the aliases, and the ids of their models."""
+        return json.loads(self._request("GET /aliases"))
+
+
+    def set_shadow(self, model_id: str, shadow_id: str, tolerance: float = 1e-10, rate: float = 1.0) -> None:
+        """
+        Mirror the scoring calls (``score0...``) of the model ``model_id`` to the model ``shadow_id``.
+
+        The server scores the mirrored calls on the shadow model in the background, so
+        the callers do not wait for it, and compares the predictions of both models
+        (within ``tolerance``, as the recipes do). Only a ``rate`` fraction of the calls
+        is mirrored. This way a new version of a mojo can be checked against the live
+        traffic of the current one, before an alias is pointed to it.
+        """
+        self._request("POST /shadows/%s" % model_id, params={"shadow": shadow_id, "tolerance": tolerance,
+                                                              "rate": rate})
+
+
+    def remove_shadow(self, model_id: str) -> Dict:
+        """Stop mirroring the calls of the model ``model_id``, and return the final :meth:`shadow_stats`."""
+        return json.loads(self._request("DELETE /shadows/%s" % model_id))
+
+
+    def shadow_stats(self, model_id: str) -> Dict:
+        """
+        Statistics of the shadow of the model ``model_id``::
+
+            {"shadow": id of the shadow model, "tolerance": ..., "rate": ...,
+             "mirrored": number of calls mirrored, "compared": number of them scored by the shadow,
+             "divergent": number of them with different predictions, "errors": number of them
+             that failed on the shadow, "dropped": number of them dropped because the shadow
+             could not keep up, "samples": the latest divergent calls, as
+             [{"method": ..., "args": [...], "primary": ..., "shadow": ...}]}
+        """
+        return json.loads(self._request("GET /shadows/%s" % model_id))
+
+
+    def stats(self) -> Dict:
+        """
+        Statistics of the server's model store and prediction cache::
+
+            {"models": number of loaded models, "loaded": number of them kept in memory,
+             "loaded_bytes": total size of their files, "evictions": number of models evicted
+             from memory so far, "reloads": number of evicted models loaded again so far,
+             "max_models": ..., "max_bytes": ... (the budget, see :class:`LaunchProfile`),
+             "cache_size": number of cached predictions, "cache_max_size": ...,
+             "cache_hits": ..., "cache_misses": ... (number of scoring calls that were
+             served from the cache / scored)}
+        """
+        return json.loads(self._request("GET /stats"))
+
+
+    def healthcheck(self, timeout: float = 2) -> bool:
+        """Return True if the server is running, and responds within ``timeout`` seconds."""
+        if self._process and self._process.poll() is not None:
+            return False
+        return self._check_if_mojoserver_is_running(timeout)
+
+
+    @property
+    def address(self) -> Tuple[str, Union[int, str, None]]:
+        """Where the server can be reached: ("http", port), ("unix", socket_path) or ("stdio", None)."""
+        if self._transport_name == "http":
+            return "http", self._port
+        if self._transport_name == "unix":
+            return "unix", self._socket_path
+        return "stdio", None
+
+
+    @property
+    def daemon_pid(self) -> Optional[int]:
+        """Pid of the daemon server this backend is connected to (None if the server is not a daemon)."""
+        return self._daemon_pid
+
+
     @property
     def working_dir(self) -> str:
         if not self._output_dir:
@@ -75,31 +343,137 @@ class MojoBackend:
     #-------------------------------------------------------------------------------------------------------------------
 
     def _start(self) -> None:
-        self._session = requests.Session()
-        for port in range(54320, 54310, -2):
-            if self._check_if_mojoserver_is_running(port):
+        if self._transport_name == "stdio":
+            self._start_stdio()
+        elif self._daemon and self._attach_daemon():
+            return
+        elif self._transport_name == "unix":
+            self._start_unix()
+        else:
+            self._start_http()
+        if self._daemon and self._process:
+            self._daemon_pid = self._process.pid
+
+
+    def _start_http(self) -> None:
+        port = self._shared_port
+        if port:
+            self._transport = HttpTransport(port)
+            if self._check_if_mojoserver_is_running():
                 print("Connected to %s on port %d" % (self.__class__.__name__, port))
                 self._port = port
                 return
-            else:
-                self._launch_server_process(port)
-                print("Starting server on port %d.." % port, end="")
-                if self._check_if_server_has_started(port):
-                    print("ok.")
-                    self._port = port
-                    return
-                else:
-                    self._process.kill()
-                    self._process = None
+            self._transport.close()
+            self._transport = None
+        # Unless the port was given, the server binds to port 0: the OS picks a free port and
+        # the server reports it back, so that any number of private servers can run on one host
+        self._launch_server_process(["--port", str(port or 0)])
+        print("Starting server%s.." % (" on port %d" % port if port else ""), end="")
+        address = self._wait_until_started("port %d" % port if port else None)
+        if address is not None:
+            self._port = int(address.split()[1])
+            self._transport = HttpTransport(self._port)
+            print("ok, port %d." % self._port)
+            return
+        self._process.kill()
+        self._process = None
         raise RuntimeError("Failed to start %s. Check logs at\n  %s\n  %s" %
                            (self.__class__.__name__, self._stdout, self._stderr))
 
 
-    def _check_if_mojoserver_is_running(self, port: int):
+    def _start_unix(self) -> None:
+        path = self._socket_path
+        self._transport = UnixSocketTransport(path)
+        if self._shared_socket_path and os.path.exists(path) and self._check_if_mojoserver_is_running():
+            print("Connected to %s on socket %s" % (self.__class__.__name__, path))
+            return
+        self._launch_server_process(["--socket", path])
+        print("Starting server on socket %s.." % path, end="")
+        if self._wait_until_started("socket %s" % path) is not None:
+            print("ok.")
+            return
+        self._process.kill()
+        self._process = None
+        self._transport = None
+        raise RuntimeError("Failed to start %s. Check logs at\n  %s\n  %s" %
+                           (self.__class__.__name__, self._stdout, self._stderr))
+
+
+    def _start_stdio(self) -> None:
+        self._launch_server_process(["--stdio"], stdio=True)
+        self._transport = StdioTransport(self._process)
+        print("Starting server over stdio..", end="")
+        try:
+            resp = self._transport.request("GET", "/healthcheck", timeout=self._start_timeout())
+            if resp.status_code == 418:
+                print("ok.")
+                return
+        except ConnectionError as e:
+            print(e)
+        self._process.kill()
+        self._process = None
+        self._transport.close()
+        self._transport = None
+        raise RuntimeError("Failed to start %s. Check logs at\n  %s" % (self.__class__.__name__, self._stderr))
+
+
+    def _attach_daemon(self) -> bool:
+        """
+        Connect to the daemon advertised in the lockfile, if there is one. Return
+        False if there is no such daemon, or if it is no longer usable.
+        """
         try:
-            resp = self._session.get("http://127.0.0.1:%d/healthcheck" % port, timeout=2)
+            with open(self._lockfile_path(), "r") as f:
+                info = json.load(f)
+            pid = int(info["pid"])
+            if self._transport_name == "unix":
+                address = info["socket"]
+                self._transport = UnixSocketTransport(address)
+            else:
+                address = int(info["port"])
+                self._transport = HttpTransport(address)
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        if not self._check_if_mojoserver_is_running():
+            # A stale lockfile: the new daemon will overwrite it
+            self._transport.close()
+            self._transport = None
+            return False
+        if info.get("version") != self._server_version():
+            print("Stopping %s daemon (pid %d) of an outdated version" % (self.__class__.__name__, pid))
+            try:
+                self._request("POST /shutdown")
+                # Wait for the daemon to exit, so that its port / socket can be reused
+                giveup_time = time.time() + self._start_timeout()
+                while self._check_if_mojoserver_is_running() and time.time() < giveup_time:
+                    time.sleep(0.05)
+            except ConnectionError:
+                pass
+            self._transport.close()
+            self._transport = None
+            return False
+        if self._transport_name == "unix":
+            self._socket_path = address
+        else:
+            self._port = address
+        self._daemon_pid = pid
+        print("Connected to %s daemon (pid %d) on %s %s" % (self.__class__.__name__, pid,
+                                                              "socket" if self._transport_name == "unix" else "port",
+                                                              address))
+        return True
+
+
+    def _lockfile_path(self) -> str:
+        """File where the daemon advertises itself (separately for each kind of server, transport and profile)."""
+        return os.path.join(self._pkg_root_dir(), "temp", "%s-%s-%s.lock" % (
+            self.__class__.__name__.lower(), self._transport_name, self._profile.name))
+
+
+    def _check_if_mojoserver_is_running(self, timeout: float = 2) -> bool:
+        try:
+            resp = self._transport.request("GET", "/healthcheck", timeout=timeout)
             return resp.status_code == 418
-        except requests.RequestException:
+        except ConnectionError:
             return False
 
 
@@ -112,52 +486,164 @@ class MojoBackend:
     def _make_output_file_name(self, suffix: str) -> str:
         if not self._output_dir:
             mojoland_dir = self._pkg_root_dir()
-            self._output_dir = os.path.join(mojoland_dir, "temp", str(int(time.time() * 1000)))
-            if not os.path.exists(self._output_dir):
-                os.makedirs(self._output_dir)
+            # Several backends may be started at the same time (see MojoBackendPool), each needs its own directory
+            stamp = int(time.time() * 1000)
+            while True:
+                self._output_dir = os.path.join(mojoland_dir, "temp", str(stamp))
+                try:
+                    os.makedirs(self._output_dir)
+                    break
+                except FileExistsError:
+                    stamp += 1
         return os.path.join(self._output_dir, "mojo-server-%s.log" % suffix)
 
 
-    def _launch_server_process(self, port) -> None:
-        raise NotImplemented()
-
-
-    def _check_if_server_has_started(self, port: int) -> bool:
-        giveup_time = time.time() + self._TIME_TO_START
-        regex1 = re.compile(r"(?:MojoBackend|MojoServer) started on port (\d+)")
-        regex2 = re.compile(r"(?:MojoBackend|MojoServer) failed to start on port (\d+)")
-        while time.time() < giveup_time:
-            if self._process.poll() is not None:
-                print("Process terminated with return code %d" % self._process.returncode)
-                return False
-            with open(self._stdout, "r") as f:
-                for line in f:
-                    mm = re.match(regex1, line)
-                    if mm is not None:
-                        assert port == int(mm.group(1)), "Ports mismatch: expected %d found %s" % (port, mm.group(1))
-                        return True
-                    mm = re.match(regex2, line)
-                    if mm is not None:
-                        print("port already in use")
-                        return False
-            print(".", end="", flush=True)
-            time.sleep(0.2)
-        print("Server wasn't able to start in %.2f seconds" % (time.time() - giveup_time + self._TIME_TO_START))
-        return False
-
-
-    def _request(self, endpoint: str, params: Dict = None):
-        mm = re.match(r"(GET|POST|DELETE) ((?:/[\w~.]+)+)", endpoint)
+    def _server_command(self) -> List[str]:
+        """Command that runs the server, without the arguments that select the port / transport."""
+        raise NotImplementedError()
+
+
+    def _server_version(self) -> str:
+        """
+        Version of the server's build, as advertised by a daemon: the modification
+        time of the server's script / jar (in whole seconds).
+        """
+        raise NotImplementedError()
+
+
+    def _shutdown_timeout(self) -> float:
+        """Time to wait until the server exits after the shutdown request (in seconds)."""
+        return self._SHUTDOWN_TIMEOUT
+
+
+    def _launch_server_process(self, args: List[str], stdio: bool = False) -> None:
+        cmd = self._server_command() + self._profile.server_flags() + args
+        if self._profile.cpus:
+            if shutil.which("taskset"):
+                cmd = ["taskset", "-c", ",".join(str(cpu) for cpu in self._profile.cpus)] + cmd
+            else:
+                print("Cannot pin the server to CPUs %s: taskset is not available" % self._profile.cpus)
+        if self._daemon:
+            cmd += ["--lockfile", self._lockfile_path(), "--idle-timeout", str(self._idle_timeout)]
+        snapshot = self._snapshot or (self._lockfile_path()[:-len(".lock")] + ".snapshot" if self._daemon else None)
+        if snapshot:
+            cmd += ["--snapshot", snapshot]
+        self._stderr = self._make_output_file_name("err")
+        if stdio:
+            # The stdout of the server carries the responses, so it has to stay unbuffered
+            self._process = subprocess.Popen(args=cmd, bufsize=0, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                             stderr=open(self._stderr, "wb", 0))
+        else:
+            # The server reports that it has started (or failed to) on the write end of this
+            # pipe, see _wait_until_started()
+            self._ready_fd, ready_w = os.pipe()
+            self._stdout = self._make_output_file_name("out")
+            try:
+                # The daemon gets its own session, so that it is not interrupted together with this process
+                self._process = subprocess.Popen(args=cmd + ["--ready-fd", str(ready_w)], bufsize=0,
+                                                 stdout=open(self._stdout, "wb", 0),
+                                                 stderr=open(self._stderr, "wb", 0),
+                                                 pass_fds=(ready_w,), start_new_session=self._daemon)
+            except OSError:
+                os.close(self._ready_fd)
+                self._ready_fd = None
+                raise
+            finally:
+                # Only the server holds the write end now, so the pipe reaches EOF when the server exits
+                os.close(ready_w)
+
+
+    def _start_timeout(self) -> float:
+        """
+        Maximum time to wait until the server starts: either as given in the
+        constructor, or the base time scaled up by the load of the machine (a
+        cold JVM starts much slower on a busy CI host).
+        """
+        if self._start_timeout_override:
+            return self._start_timeout_override
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        return self._TIME_TO_START * max(1.0, load)
+
+
+    def _wait_until_started(self, address: str = None) -> Optional[str]:
+        """
+        Wait until the server reports that it has started, and return the address
+        where it did ("port N" or "socket PATH"), or None if it has failed to start.
+        If the ``address`` is given, then the server must have started there.
+
+        The server writes a single line "... started on ADDRESS" (or "... failed to
+        start on ADDRESS") into the readiness pipe, and then closes it. This wakes
+        up as soon as the line arrives, or the server exits.
+        """
+        timeout = self._start_timeout()
+        giveup_time = time.time() + timeout
+        message = b""
+        try:
+            while not message.endswith(b"\n"):
+                remaining = giveup_time - time.time()
+                if remaining <= 0 or not select.select([self._ready_fd], [], [], remaining)[0]:
+                    print("Server wasn't able to start in %.2f seconds" % timeout)
+                    return None
+                chunk = os.read(self._ready_fd, 1024)
+                if not chunk:
+                    break
+                message += chunk
+        finally:
+            os.close(self._ready_fd)
+            self._ready_fd = None
+        line = message.decode("utf-8", "replace")
+        mm = re.match(r"(?:MojoBackend|MojoServer) started on (port \d+|socket \S+)", line)
+        if mm is not None:
+            assert address in (None, mm.group(1)), "Address mismatch: expected %s found %s" % (address, mm.group(1))
+            return mm.group(1)
+        mm = re.match(r"(?:MojoBackend|MojoServer) failed to start on (port \d+|socket \S+)", line)
+        if mm is not None:
+            print("%s already in use" % mm.group(1))
+            return None
+        # The server has closed the pipe without reporting (usually because it has crashed)
+        try:
+            print("Process terminated with return code %d" % self._process.wait(timeout=1))
+        except subprocess.TimeoutExpired:
+            print("Server has closed the readiness pipe without starting")
+        return None
+
+
+    def _request(self, endpoint: str, params: Dict = None, body: object = None):
+        resp = self._send(endpoint, params=params, body=body)
+        self._check_response(resp, endpoint, params)
+        return resp.text.strip()
+
+
+    def _send(self, endpoint: str, params: Dict = None, body: object = None, data: bytes = None,
+              headers: Dict[str, str] = None) -> Response:
+        mm = ENDPOINT_RE.match(endpoint)
         if mm:
             method = mm.group(1)
             path = mm.group(2)
-            url = "http://127.0.0.1:%d%s" % (self._port, path)
         else:
             raise Exception("Invalid endpoint %s" % endpoint)
         # Make the request
-        resp = self._session.request(method, url, params=params)
-        if resp.status_code == 200 or resp.status_code == 202:
-            return resp.text.strip()
-        else:
+        return self._transport.request(method, path, params=params, body=body, data=data, headers=headers,
+                                       timeout=self.request_timeout)
+
+
+    def _endpoint_unknown(self, resp: Response, model_id: str) -> bool:
+        """
+        Whether the response ``resp`` to a request for the model ``model_id`` means that the server
+        does not know the endpoint at all. A 404 / 405 may also be about the model itself (such as an
+        unknown id), which must not turn the endpoint off for good, so then the model is checked too.
+        """
+        if resp.status_code not in (404, 405):
+            return False
+        try:
+            self.get_model_api(model_id)
+        except Exception:
+            return False
+        return True
+
+
+    @staticmethod
+    def _check_response(resp: Response, endpoint: str, params: Optional[Dict]) -> None:
+        if resp.status_code != 200 and resp.status_code != 202:
             raise Exception("Error %d: %s\n>> Request: %s\n>> Params:  %r" %
                             (resp.status_code, resp.text, endpoint, params))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""
+Binary encoding of the method arguments / return values.
+
+The payload is a sequence of values, each of them starting with a one-byte tag
+and a little-endian uint32 length, followed by either `length` little-endian
+float64 numbers (tag ``d``, used for ``double[]`` values), or by `length` bytes
+of a UTF-8 string (tag ``s``, used for all other values, which the server then
+parses from their textual form).
+"""
+import math
+import struct
+from typing import List, Sequence, Union
+
+CONTENT_TYPE = "application/x-mojo-binary"
+
+Value = Union[str, int, float, Sequence[float]]
+
+
+def encode_values(values: Sequence[Value]) -> bytes:
+    parts = []  # type: List[bytes]
+    for value in values:
+        if isinstance(value, (str, int, float)):
+            data = str(value).encode("utf-8")
+            parts.append(struct.pack("<cI", b"s", len(data)))
+            parts.append(data)
+        else:
+            parts.append(struct.pack("<cI%dd" % len(value), b"d", len(value), *value))
+    return b"".join(parts)
+
+
+def decode_doubles(data: bytes) -> List[float]:
+    tag, n = struct.unpack_from("<cI", data)
+    if tag != b"d" or len(data) != 5 + 8 * n:
+        raise ValueError("Invalid binary double[] payload")
+    return list(struct.unpack_from("<%dd" % n, data, 5))
+
+
+def format_value(value: Value) -> str:
+    """Textual form of a value, as it is passed in the query string of a request."""
+    if isinstance(value, (str, int, float)):
+        return str(value)
+    return "[%s]" % ",".join(_format_double(x) for x in value)
+
+
+def _format_double(x: float) -> str:
+    if math.isnan(x):
+        return "NaN"
+    if math.isinf(x):
+        return "Infinity" if x > 0 else "-Infinity"
+    return repr(float(x))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import collections
+import itertools
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+from . import payload
+from .mojobackend import MojoBackend
+from .shm import SharedMatrix
+
+
+class MojoBackendPool:
+    """
+    Several server processes of the same kind, used as a single backend.
+
+    Each loaded model is placed on the least loaded instance (the one owning the
+    fewest models), and all calls for that model are routed to its instance.
+    The ids of the models are of the form ``"{instance}:{id}"``.
+
+    A model can also be loaded on several instances (``replicas``), in which case
+    its id lists all of them: ``"{instance1}:{id1},{instance2}:{id2}"``. Calls to
+    such models are hedged: the request is sent to one of the replicas, and if
+    the response doesn't arrive within the ``hedge_percentile``-th percentile of
+    the recent response times, the same request is also sent to another replica.
+    Whichever answer arrives first is used, and the other one is discarded. This
+    cuts the tail latency caused by GC pauses, or by a busy single-threaded server.
+    If a replica fails (for example, its server has crashed), the request is sent
+    to another replica as well, even before the hedge delay or without hedging.
+
+    The pool supports the same methods as a :class:`MojoBackend`. Each instance
+    runs its own (private) server process, on its own port / socket / pipes
+    depending on the transport.
+    """
+    _DEFAULT_HEDGE_DELAY = 0.050  # delay before hedging, until enough response times were observed (in seconds)
+    _MIN_HEDGE_DELAY = 0.001      # never hedge sooner than this (in seconds)
+    _MIN_SAMPLES = 20             # number of response times needed to estimate the percentile
+    _LATENCY_WINDOW = 1000        # number of recent response times used for the estimate
+
+
+    def __init__(self, backend_class: Type[MojoBackend], size: int, transport: str = "stdio", replicas: int = 1,
+                 hedge_percentile: Optional[float] = 95.0):
+        """
+        :param backend_class: class of the server instances, such as :class:`JavaMojoBackend`.
+        :param size: number of server instances.
+        :param transport: "http", "unix" or "stdio".
+        :param replicas: default number of instances on which each model is loaded.
+        :param hedge_percentile: percentile of the response times after which a request
+            to a replicated model is hedged; None disables hedging.
+        """
+        assert size >= 1, "Invalid pool size %r" % size
+        assert 1 <= replicas <= size, "Invalid number of replicas %r for a pool of %d" % (replicas, size)
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            futures = [executor.submit(backend_class, transport) for _ in range(size)]
+            self._instances = [future.result() for future in futures]  # type: List[MojoBackend]
+        self._models = [set() for _ in range(size)]  # ids of the models owned by each instance
+        self._outstanding = [0] * size               # requests to replicated models in progress on each instance
+        self._lock = threading.Lock()
+        self._replicas = replicas
+        self._hedge_percentile = hedge_percentile
+        self._hedge_delay = self._DEFAULT_HEDGE_DELAY
+        self._latencies = collections.deque(maxlen=self._LATENCY_WINDOW)  # type: collections.deque
+        self._nsamples = 0
+        self._hedged = 0       # number of requests that were hedged
+        self._hedge_wins = 0   # number of hedged requests where the second replica answered first
+        self._round_robin = itertools.count()
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+
+
+    @property
+    def size(self) -> int:
+        return len(self._instances)
+
+
+    @property
+    def address(self) -> Tuple[str, None]:
+        return "pool", None
+
+
+    @property
+    def hedge_delay(self) -> float:
+        """Current delay (in seconds) after which a request to a replicated model is hedged."""
+        return self._hedge_delay
+
+
+    def load_model(self, mojofile: str, replicas: int = None) -> str:
+        """
+        Load the mojofile on the ``replicas`` least loaded live instances (by default
+        as many as configured for the pool), and return the pool-wide model id.
+        """
+        replicas = replicas or self._replicas
+        with self._lock:
+            candidates = sorted(range(self.size), key=lambda i: len(self._models[i]))
+        indices = [i for i in candidates if self._instances[i].healthcheck()][:replicas]
+        if len(indices) < replicas:
+            raise RuntimeError("Only %d of the %d instances in the pool are alive, %d needed" %
+                               (len(indices), self.size, replicas))
+        with self._lock:
+            # Reserve the slots while the model is being loaded
+            placeholder = object()
+            for i in indices:
+                self._models[i].add(placeholder)
+        placements = []  # type: List[Tuple[int, str]]
+        try:
+            for i in indices:
+                placements.append((i, self._instances[i].load_model(mojofile)))
+        except Exception:
+            for i, local_id in placements:
+                self._instances[i].unload_model(local_id)
+            placements = []
+            raise
+        finally:
+            with self._lock:
+                for i in indices:
+                    self._models[i].discard(placeholder)
+                for i, local_id in placements:
+                    self._models[i].add(local_id)
+        return ",".join("%d:%s" % placement for placement in placements)
+
+
+    def get_model_api(self, model_id: str) -> List[str]:
+        return self._call(model_id, lambda backend, local_id: backend.get_model_api(local_id))
+
+
+    def invoke_method(self, model_id: str, method: str, params: Dict) -> str:
+        return self._call(model_id, lambda backend, local_id: backend.invoke_method(local_id, method, params))
+
+
+    def invoke_batch(self, model_id: str, commands: List[Tuple]) -> List[str]:
+        return self._call(model_id, lambda backend, local_id: backend.invoke_batch(local_id, commands))
+
+
+    def invoke_binary(self, model_id: str, method: str, args: Sequence[payload.Value]) -> Union[str, List[float]]:
+        return self._call(model_id, lambda backend, local_id: backend.invoke_binary(local_id, method, args))
+
+
+    def invoke_shm(self, model_id: str, method: str, inputs: SharedMatrix, outputs: SharedMatrix) -> Dict[int, str]:
+        # Not hedged: both replicas would be writing into the same output matrix
+        i, local_id = self._placements(model_id)[0]
+        return self._instances[i].invoke_shm(local_id, method, inputs, outputs)
+
+
+    def unload_model(self, model_id: str) -> None:
+        for i, local_id in self._placements(model_id):
+            self._instances[i].unload_model(local_id)
+            with self._lock:
+                self._models[i].discard(local_id)
+
+
+    def health(self) -> Dict:
+        """
+        Aggregate health of the pool::
+
+            {"healthy": bool, "alive": number of responsive instances, "size": pool size,
+             "models": total number of loaded models (counting each replica),
+             "instances": [{"alive": bool, "models": number of models, "address": ...}, ...],
+             "hedging": {"delay": current hedge delay, "hedged": number of hedged requests,
+                         "wins": number of hedged requests answered first by the second replica}}
+        """
+        instances = []
+        for backend, models in zip(self._instances, self._models):
+            instances.append({"alive": backend.healthcheck(), "models": len(models), "address": backend.address})
+        alive = sum(inst["alive"] for inst in instances)
+        with self._lock:
+            hedging = {"delay": self._hedge_delay, "hedged": self._hedged, "wins": self._hedge_wins}
+        return {"healthy": alive == self.size, "alive": alive, "size": self.size,
+                "models": sum(inst["models"] for inst in instances), "instances": instances, "hedging": hedging}
+
+
+    def shutdown(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False)
+        for backend in self._instances:
+            backend.shutdown()
+
+
+    #-------------------------------------------------------------------------------------------------------------------
+    # Private
+    #-------------------------------------------------------------------------------------------------------------------
+
+    def _placements(self, model_id: str) -> List[Tuple[int, str]]:
+        """Parse the pool-wide model id into the list of (instance index, local model id)."""
+        placements = []
+        for part in model_id.split(","):
+            index, sep, local_id = part.partition(":")
+            if not sep or not index.isdigit() or int(index) >= self.size:
+                raise ValueError("Invalid model id %r for a pool of %d instances" % (model_id, self.size))
+            placements.append((int(index), local_id))
+        return placements
+
+
+    def _call(self, model_id: str, fn: Callable[[MojoBackend, str], object]):
+        placements = self._placements(model_id)
+        if len(placements) == 1:
+            i, local_id = placements[0]
+            return fn(self._instances[i], local_id)
+        if self._hedge_percentile is None:
+            # Without hedging, the second replica is only used if the first one fails
+            (i, local_id), (j, other_id) = placements[:2]
+            try:
+                return fn(self._instances[i], local_id)
+            except Exception:
+                return fn(self._instances[j], other_id)
+
+        # Prefer the replica with the fewest requests in progress (so that a stalled one is avoided),
+        # and alternate between the replicas that are equally busy
+        k = next(self._round_robin) % len(placements)
+        order = placements[k:] + placements[:k]
+        with self._lock:
+            order.sort(key=lambda placement: self._outstanding[placement[0]])
+        primary, secondary = order[0], order[1]
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=4 * self.size)
+        start = time.perf_counter()
+        futures = [self._submit(fn, *primary)]
+        done, _ = wait(futures, timeout=self._hedge_delay)
+        hedged = not done
+        if hedged or futures[0].exception() is not None:
+            # Hedge the slow primary replica, or fail over from the primary that has failed already
+            if hedged:
+                with self._lock:
+                    self._hedged += 1
+            futures.append(self._submit(fn, *secondary))
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and len(futures) == 2:
+            # The faster replica has failed: the answer of the other one decides
+            other = futures[1] if winner is futures[0] else futures[0]
+            if other.exception() is None:
+                winner = other
+        for fut in futures:
+            if fut is not winner:
+                fut.cancel()  # only has effect if the request hasn't been sent yet
+        if hedged and winner is futures[1]:
+            with self._lock:
+                self._hedge_wins += 1
+        # The response time as seen by the caller: the stalls that hedging has hidden should not raise the delay
+        self._record_latency(time.perf_counter() - start)
+        return winner.result()
+
+
+    def _submit(self, fn: Callable[[MojoBackend, str], object], index: int, local_id: str) -> Future:
+        with self._lock:
+            self._outstanding[index] += 1
+        future = self._executor.submit(fn, self._instances[index], local_id)
+
+        def done(_):
+            with self._lock:
+                self._outstanding[index] -= 1
+        future.add_done_callback(done)
+        return future
+
+
+    def _record_latency(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self._nsamples += 1
+            # Re-estimating the percentile requires sorting, so do it only once in a while
+            if self._nsamples >= self._MIN_SAMPLES and self._nsamples % self._MIN_SAMPLES == 0:
+                latencies = sorted(self._latencies)
+                k = min(len(latencies) - 1, int(len(latencies) * self._hedge_percentile / 100))
+                self._hedge_delay = max(latencies[k], self._MIN_HEDGE_DELAY)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""
+Launch profiles: how the server processes are run.
+
+The default "debug" profile runs the servers with assertions enabled and with
+the default settings of the runtime, as befits a stability test harness. The
+"throughput" and "low-latency" profiles are closer to how the mojos run in
+production, and should be used for benchmarks.
+"""
+from typing import Dict, List, Optional, Sequence, Union
+
+
+class LaunchProfile:
+    """
+    Settings of the server processes.
+
+    :param name: name of the profile.
+    :param assertions: enable assertions (``-ea`` for Java; without it the Python
+        server runs with ``-O``).
+    :param heap: fixed heap size of the JVM, such as "2g" (both ``-Xms`` and ``-Xmx``).
+    :param gc: garbage collector of the JVM: "serial", "parallel" or "g1".
+    :param cds: use a class-data sharing archive of the server's classes, which
+        makes the JVM start faster. The archive is generated when the server
+        runs for the first time (requires Java 13+).
+    :param cpus: pin the server process to these CPUs (requires ``taskset``).
+    :param jvm_flags: any additional flags for the JVM.
+    :param python: the interpreter for the Python server.
+    :param python_flags: any additional flags for the interpreter.
+    :param max_models: maximum number of models that the server keeps in memory; the
+        least recently used models are evicted, and loaded again when they are used.
+    :param max_model_mb: maximum total size of the files of the models that the server
+        keeps in memory (in MB).
+    :param cache_size: number of predictions that the server caches, so that the rows
+        that were scored already are not scored again (0 disables the cache).
+    """
+    GC_FLAGS = {"serial": "-XX:+UseSerialGC", "parallel": "-XX:+UseParallelGC", "g1": "-XX:+UseG1GC"}
+
+    def __init__(self, name: str, assertions: bool = True, heap: str = None, gc: str = None, cds: bool = False,
+                 cpus: Sequence[int] = None, jvm_flags: Sequence[str] = (), python: str = "python2",
+                 python_flags: Sequence[str] = (), max_models: int = 0, max_model_mb: int = 0,
+                 cache_size: int = 0):
+        if gc is not None and gc not in self.GC_FLAGS:
+            raise ValueError("Unknown garbage collector %s, expected one of %s" % (gc, ", ".join(self.GC_FLAGS)))
+        self.name = name
+        self.assertions = assertions
+        self.heap = heap
+        self.gc = gc
+        self.cds = cds
+        self.cpus = list(cpus) if cpus else None  # type: Optional[List[int]]
+        self.jvm_flags = list(jvm_flags)
+        self.python = python
+        self.python_flags = list(python_flags)
+        self.max_models = max_models
+        self.max_model_mb = max_model_mb
+        self.cache_size = cache_size
+
+
+    def java_flags(self) -> List[str]:
+        """Flags for the JVM, except those for the class-data sharing."""
+        flags = []
+        if self.assertions:
+            flags.append("-ea")
+        if self.heap:
+            flags += ["-Xms" + self.heap, "-Xmx" + self.heap]
+        if self.gc:
+            flags.append(self.GC_FLAGS[self.gc])
+        return flags + self.jvm_flags
+
+
+    def python_command(self) -> List[str]:
+        """The interpreter with its flags."""
+        return [self.python] + ([] if self.assertions else ["-O"]) + self.python_flags
+
+
+    def server_flags(self) -> List[str]:
+        """Flags for the server (either Java or Python)."""
+        flags = []
+        if self.max_models:
+            flags += ["--max-models", str(self.max_models)]
+        if self.max_model_mb:
+            flags += ["--max-model-mb", str(self.max_model_mb)]
+        if self.cache_size:
+            flags += ["--cache-size", str(self.cache_size)]
+        return flags
+
+
+    def __repr__(self):
+        return "LaunchProfile(%s)" % self.name
+
+
+PROFILES = {
+    "debug": LaunchProfile("debug"),
+    # Bigger fixed heap and the parallel collector: the most work done per second
+    "throughput": LaunchProfile("throughput", assertions=False, heap="2g", gc="parallel", cds=True),
+    # G1 with a short pause target, and the heap touched upfront: fewer and shorter stalls
+    "low-latency": LaunchProfile("low-latency", assertions=False, heap="2g", gc="g1", cds=True,
+                                 jvm_flags=["-XX:MaxGCPauseMillis=10", "-XX:+AlwaysPreTouch"]),
+}  # type: Dict[str, LaunchProfile]
+
+
+def get_profile(profile: Union[str, LaunchProfile, None]) -> LaunchProfile:
+    """Return the launch profile with the given name (or the profile itself); None is the "debug" profile."""
+    if profile is None:
+        return PROFILES["debug"]
+    if isinstance(profile, LaunchProfile):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError("Unknown launch profile %s, expected one of %s" % (profile, ", ".join(PROFILES)))
+    return PROFILES[profile]
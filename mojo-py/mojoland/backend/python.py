@@ -1,22 +1,44 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
 import os
-import subprocess
+from typing import List, Sequence
 
 from .mojobackend import MojoBackend
 
 
 class PythonMojoBackend(MojoBackend):
+    """
+    Client for the Python mojo server.
 
-    def _launch_server_process(self, port) -> None:
-        pyserver = os.path.join(self._pkg_root_dir(), "mojo-py", "rest-server", "server.py")
+    With ``prefork`` the server scores in that many worker processes, which share
+    the models loaded at startup (the ``preload`` mojofiles) copy-on-write; only
+    those models can be used then (see ``rest-server/server.py``). This requires
+    the "http" or "unix" transport.
+    """
+
+    def __init__(self, *args, prefork: int = 0, preload: Sequence[str] = (), **kwargs):
+        self._prefork = prefork
+        self._preload = list(preload)
+        super().__init__(*args, **kwargs)
+
+    def _server_command(self) -> List[str]:
+        pyserver = self._server_path()
         if not os.path.isfile(pyserver):
             raise Exception("Could not locate %s" % pyserver)
 
-        cmd = ["python2", pyserver, "--port", str(port)]
+        # Threaded mode, so that a connection kept alive by one client cannot block the others
+        cmd = self._profile.python_command() + [pyserver, "--threaded"]
+        if self._prefork:
+            if self._transport_name == "stdio":
+                raise ValueError("The pre-fork mode requires the http or unix transport")
+            cmd += ["--prefork", str(self._prefork)]
+        for mojofile in self._preload:
+            cmd += ["--preload", mojofile]
         print("Lauching python server: %s" % " ".join(cmd))
-        self._stdout = self._make_output_file_name("out")
-        self._stderr = self._make_output_file_name("err")
-        self._process = subprocess.Popen(args=cmd, bufsize=0,
-                                         stdout=open(self._stdout, "wb", 0),
-                                         stderr=open(self._stderr, "wb", 0))
+        return cmd
+
+    def _server_version(self) -> str:
+        return str(int(os.path.getmtime(self._server_path())))
+
+    def _server_path(self) -> str:
+        return os.path.join(self._pkg_root_dir(), "mojo-py", "rest-server", "server.py")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""
+Matrices of float64 values in POSIX shared memory.
+
+These are used to exchange large blocks of rows with a server running on the
+same host, without copying them through the request / response bodies. The
+segment is a file in ``/dev/shm`` holding ``nrows x ncols`` little-endian
+float64 values, row after row; the server maps the same file by its name.
+"""
+import itertools
+import mmap
+import os
+import struct
+from typing import List, Sequence
+
+SHM_DIR = "/dev/shm"
+
+
+def is_available() -> bool:
+    """Return True if POSIX shared memory can be used on this host."""
+    return os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK)
+
+
+class SharedMatrix:
+    """
+    Matrix of ``nrows x ncols`` float64 values in a new shared memory segment.
+
+    The segment is removed when the matrix is closed (it can also be used as a
+    context manager).
+    """
+    _counter = itertools.count()
+
+
+    def __init__(self, nrows: int, ncols: int):
+        assert nrows > 0 and ncols > 0, "Invalid shape %d x %d" % (nrows, ncols)
+        self.name = "mojoland-%d-%d" % (os.getpid(), next(SharedMatrix._counter))
+        self.nrows = nrows
+        self.ncols = ncols
+        self._path = os.path.join(SHM_DIR, self.name)
+        self._row = struct.Struct("<%dd" % ncols)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            os.ftruncate(fd, nrows * self._row.size)
+            self._mm = mmap.mmap(fd, nrows * self._row.size)
+        except OSError:
+            os.unlink(self._path)
+            raise
+        finally:
+            os.close(fd)
+
+
+    def write_row(self, i: int, values: Sequence[float]) -> None:
+        """Write ``ncols`` values into the i-th row."""
+        assert len(values) == self.ncols, "Expected %d values, got %d" % (self.ncols, len(values))
+        self._row.pack_into(self._mm, i * self._row.size, *values)
+
+
+    def read_row(self, i: int) -> List[float]:
+        return list(self._row.unpack_from(self._mm, i * self._row.size))
+
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+            os.unlink(self._path)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import itertools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+from . import payload
+from .mojobackend import MojoBackend
+from .shm import SharedMatrix
+
+
+class SupervisedMojoBackend:
+    """
+    A :class:`MojoBackend` that survives crashes and hangs of its server.
+
+    The server is watched by a background thread: whenever no requests are in
+    progress, it checks every ``check_interval`` seconds that the server
+    answers the healthcheck within ``hang_timeout`` seconds. Requests must be
+    answered within ``request_timeout`` seconds.
+
+    When the server is found dead or hung, it is killed and a new one is
+    launched, and all the models that were loaded are loaded again from their
+    files (their ids stay the same); their aliases and shadows are set again
+    too, although the statistics of the shadows start anew. A request that has
+    failed because of that is retried once on the new server (all the requests
+    are idempotent); if it fails again, for example because it crashes the
+    server every time, the error is raised. The server is restarted at most
+    ``max_restarts`` times; a restart that has failed (for example because a
+    model could not be loaded again) counts too.
+
+    The supervisor supports the same methods as a :class:`MojoBackend`; the
+    positional and other keyword arguments are passed to the ``backend_class``.
+    The address of the server changes when it is restarted.
+    """
+
+    def __init__(self, backend_class: Type[MojoBackend], *args, check_interval: float = 5.0,
+                 hang_timeout: float = 10.0, request_timeout: float = 300.0, max_restarts: int = 5, **kwargs):
+        self._launch = lambda: backend_class(*args, **kwargs)
+        self._name = backend_class.__name__
+        self._check_interval = check_interval
+        self._hang_timeout = hang_timeout
+        self._request_timeout = request_timeout
+        self._max_restarts = max_restarts
+        self._backend = self._start_backend()
+        self._generation = 0                      # incremented on each restart
+        self._restarts = 0
+        self._mojofiles = {}                      # type: Dict[str, str]
+        self._local_ids = {}                      # type: Dict[str, str]
+        self._aliases = {}                        # type: Dict[str, str]
+        self._shadows = {}                        # type: Dict[str, Tuple[str, float, float]]
+        self._unloaded = set()                    # models unloaded, but still held by their aliases
+        self._ids = itertools.count(1)
+        self._calls = 0                           # number of requests in progress
+        self._healthcheck_latency = None          # type: Optional[float]
+        self._lock = threading.Lock()             # guards the state above
+        self._restart_lock = threading.Lock()     # held for the whole restart
+        self._stopped = threading.Event()
+        self._monitor = threading.Thread(target=self._watch, name="mojo-supervisor", daemon=True)
+        self._monitor.start()
+
+
+    @property
+    def address(self) -> Tuple[str, Union[int, str, None]]:
+        return self._backend.address
+
+
+    def load_model(self, mojofile: str) -> str:
+        """Load the specified mojofile, and return its model id (which survives restarts of the server)."""
+        model_id = str(next(self._ids))
+
+        def load(backend: MojoBackend, _) -> str:
+            local_id = backend.load_model(mojofile)
+            with self._lock:
+                if backend is self._backend:
+                    self._mojofiles[model_id] = mojofile
+                    self._local_ids[model_id] = local_id
+                    return model_id
+            # The server was replaced in the meantime (without this model), so load it again
+            raise ConnectionError("%s was restarted while loading %s" % (self._name, mojofile))
+
+        return self._call(None, load)
+
+
+    def get_model_api(self, model_id: str) -> List[str]:
+        return self._call(model_id, lambda backend, local_id: backend.get_model_api(local_id))
+
+
+    def invoke_method(self, model_id: str, method: str, params: Dict) -> str:
+        return self._call(model_id, lambda backend, local_id: backend.invoke_method(local_id, method, params))
+
+
+    def invoke_batch(self, model_id: str, commands: List[Tuple]) -> List[str]:
+        return self._call(model_id, lambda backend, local_id: backend.invoke_batch(local_id, commands))
+
+
+    def invoke_binary(self, model_id: str, method: str, args: Sequence[payload.Value]) -> Union[str, List[float]]:
+        return self._call(model_id, lambda backend, local_id: backend.invoke_binary(local_id, method, args))
+
+
+    def invoke_shm(self, model_id: str, method: str, inputs: SharedMatrix, outputs: SharedMatrix) -> Dict[int, str]:
+        return self._call(model_id, lambda backend, local_id: backend.invoke_shm(local_id, method, inputs, outputs))
+
+
+    def unload_model(self, model_id: str) -> None:
+        self._call(model_id, lambda backend, local_id: backend.unload_model(local_id))
+        with self._lock:
+            self._unloaded.add(model_id)
+            self._forget_unloaded()
+
+
+    def set_alias(self, name: str, model_id: str) -> Optional[str]:
+        """Same as :meth:`MojoBackend.set_alias`."""
+        with self._lock:
+            model_id = self._aliases.get(model_id, model_id)
+
+        def set_alias(backend: MojoBackend, local_id: str) -> Optional[str]:
+            backend.set_alias(name, local_id)
+            with self._lock:
+                self._check_current(backend)
+                previous = self._aliases.get(name)
+                self._aliases[name] = model_id
+                self._forget_unloaded()
+                return previous
+
+        return self._call(model_id, set_alias)
+
+
+    def remove_alias(self, name: str) -> None:
+        self._call(None, lambda backend, _: backend.remove_alias(name))
+        with self._lock:
+            self._aliases.pop(name, None)
+            self._forget_unloaded()
+
+
+    def aliases(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._aliases)
+
+
+    def set_shadow(self, model_id: str, shadow_id: str, tolerance: float = 1e-10, rate: float = 1.0) -> None:
+        """Same as :meth:`MojoBackend.set_shadow`."""
+        with self._lock:
+            model_id = self._aliases.get(model_id, model_id)
+            shadow_id = self._aliases.get(shadow_id, shadow_id)
+
+        def set_shadow(backend: MojoBackend, local_id: str) -> None:
+            with self._lock:
+                self._check_current(backend)
+                local_shadow_id = self._local_ids.get(shadow_id, shadow_id)
+            backend.set_shadow(local_id, local_shadow_id, tolerance, rate)
+            with self._lock:
+                self._check_current(backend)
+                self._shadows[model_id] = (shadow_id, tolerance, rate)
+
+        self._call(model_id, set_shadow)
+
+
+    def remove_shadow(self, model_id: str) -> Dict:
+        with self._lock:
+            model_id = self._aliases.get(model_id, model_id)
+        stats = self._call(model_id, lambda backend, local_id: backend.remove_shadow(local_id))
+        with self._lock:
+            shadow = self._shadows.pop(model_id, None)
+        if shadow:
+            stats["shadow"] = shadow[0]
+        return stats
+
+
+    def shadow_stats(self, model_id: str) -> Dict:
+        with self._lock:
+            model_id = self._aliases.get(model_id, model_id)
+        stats = self._call(model_id, lambda backend, local_id: backend.shadow_stats(local_id))
+        with self._lock:
+            shadow = self._shadows.get(model_id)
+        if shadow:
+            stats["shadow"] = shadow[0]
+        return stats
+
+
+    def healthcheck(self, timeout: float = 2) -> bool:
+        return self._backend.healthcheck(timeout)
+
+
+    def health(self) -> Dict:
+        """
+        Health of the supervised server::
+
+            {"alive": bool, "restarts": number of restarts so far, "models": number of loaded models,
+             "healthcheck_latency": latency of the latest healthcheck by the monitor (in seconds),
+             "address": address of the current server}
+        """
+        return {"alive": self.healthcheck(), "restarts": self._restarts,
+                "models": len(self._mojofiles) - len(self._unloaded),
+                "healthcheck_latency": self._healthcheck_latency, "address": self.address}
+
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        self._backend.shutdown()
+
+
+    #-------------------------------------------------------------------------------------------------------------------
+    # Private
+    #-------------------------------------------------------------------------------------------------------------------
+
+    def _start_backend(self) -> MojoBackend:
+        backend = self._launch()
+        backend.request_timeout = self._request_timeout
+        return backend
+
+
+    def _call(self, model_id: Optional[str], fn: Callable[[MojoBackend, Optional[str]], object]):
+        retried = False
+        while True:
+            with self._lock:
+                backend = self._backend
+                generation = self._generation
+                local_id = self._local_ids.get(model_id, model_id)
+                self._calls += 1
+            try:
+                return fn(backend, local_id)
+            except ConnectionError as e:
+                if retried:
+                    raise
+                error = e
+            finally:
+                with self._lock:
+                    self._calls -= 1
+            self._restart(generation, "request failed: %s" % error)
+            retried = True
+
+
+    def _restart(self, generation: int, reason: str) -> None:
+        """Replace the server of the given ``generation`` with a new one, unless that was done already."""
+        with self._restart_lock:
+            if generation != self._generation:
+                return
+            if self._restarts >= self._max_restarts:
+                raise RuntimeError("%s has failed (%s), and it was restarted %d times already" %
+                                   (self._name, reason, self._restarts))
+            print("Restarting %s: %s" % (self._name, reason))
+            self._backend.kill()
+            with self._lock:
+                self._restarts += 1
+                mojofiles = dict(self._mojofiles)
+                aliases = dict(self._aliases)
+                shadows = dict(self._shadows)
+                unloaded = set(self._unloaded)
+            backend = None
+            try:
+                backend = self._start_backend()
+                local_ids = {model_id: backend.load_model(mojofile) for model_id, mojofile in mojofiles.items()}
+                for name, model_id in aliases.items():
+                    backend.set_alias(name, local_ids[model_id])
+                for model_id, (shadow_id, tolerance, rate) in shadows.items():
+                    if model_id in local_ids and shadow_id in local_ids:
+                        backend.set_shadow(local_ids[model_id], local_ids[shadow_id], tolerance, rate)
+                for model_id in unloaded:
+                    backend.unload_model(local_ids[model_id])
+            except BaseException:
+                # The new server lacks some of the models, so it is not used; the next request makes another attempt
+                if backend is not None:
+                    backend.kill()
+                raise
+            with self._lock:
+                self._backend = backend
+                self._local_ids = local_ids
+                self._generation += 1
+
+
+    def _check_current(self, backend: MojoBackend) -> None:
+        """Check (under the lock) that the request was made to the current server, which has all the models."""
+        if backend is not self._backend:
+            # The server was replaced in the meantime, so make the request again
+            raise ConnectionError("%s was restarted during the request" % self._name)
+
+
+    def _forget_unloaded(self) -> None:
+        """Forget the unloaded models (under the lock) that are no longer held by any alias."""
+        for model_id in self._unloaded - set(self._aliases.values()):
+            self._unloaded.discard(model_id)
+            self._mojofiles.pop(model_id, None)
+            self._local_ids.pop(model_id, None)
+            self._shadows.pop(model_id, None)
+
+
+    def _watch(self) -> None:
+        """Body of the monitoring thread."""
+        while not self._stopped.wait(self._check_interval):
+            with self._lock:
+                if self._calls:
+                    # A busy server may be slow to answer; the requests themselves detect the failures
+                    continue
+                backend = self._backend
+                generation = self._generation
+            start = time.perf_counter()
+            if backend.healthcheck(self._hang_timeout):
+                self._healthcheck_latency = time.perf_counter() - start
+                continue
+            if self._stopped.is_set():
+                break
+            try:
+                self._restart(generation, "no response to the healthcheck in %.1f seconds" % self._hang_timeout)
+            except Exception as e:
+                print("Failed to restart %s: %s" % (self._name, e))
+                break
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+"""
+Transports used by :class:`MojoBackend` to talk to the mojo server.
+
+There are three kinds of transport:
+
+- :class:`HttpTransport` sends the requests over HTTP to a server listening
+  on a localhost port;
+- :class:`UnixSocketTransport` sends the requests over HTTP to a server
+  listening on a Unix domain socket;
+- :class:`StdioTransport` exchanges length-prefixed frames with a server
+  child process over its stdin / stdout pipes.
+
+All of them accept a request in the same form (method, path, query params, body)
+and return a :class:`Response`.
+"""
+import http.client
+import json
+import re
+import select
+import socket
+import struct
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlencode
+
+import requests
+
+
+class Response:
+    """Response received from the mojo server."""
+    __slots__ = ("status_code", "content_type", "content")
+
+
+    def __init__(self, status_code: int, content_type: str, content: bytes):
+        self.status_code = status_code
+        self.content_type = content_type
+        self.content = content
+
+
+    @property
+    def text(self) -> str:
+        """Body of the response decoded as text (in the same way as ``requests`` would)."""
+        mm = re.search(r"charset=([\w-]+)", self.content_type)
+        if mm:
+            encoding = mm.group(1)
+        else:
+            encoding = "ISO-8859-1" if self.content_type.startswith("text/") else "utf-8"
+        return self.content.decode(encoding, errors="replace")
+
+
+class Transport:
+    """Base class for all transports."""
+
+    def request(self, method: str, path: str, params: Dict = None, body: object = None, data: bytes = None,
+                headers: Dict[str, str] = None, timeout: float = None) -> Response:
+        """
+        Send the request to the server and return the server's response.
+
+        :param method: HTTP method ("GET", "POST" or "DELETE").
+        :param path: the endpoint, such as "/mojos/1".
+        :param params: query parameters of the request.
+        :param body: object to be sent as a JSON body of the request.
+        :param data: raw body of the request (if ``body`` is not given).
+        :param headers: additional headers, such as "Content-Type".
+        :param timeout: how long to wait for the response (in seconds), by default
+            wait indefinitely.
+        :raises ConnectionError: if the server cannot be reached.
+        """
+        raise NotImplementedError()
+
+
+    def close(self) -> None:
+        """Release the resources held by the transport."""
+
+
+
+class HttpTransport(Transport):
+    """Transport to a server listening on the localhost ``port``."""
+
+    def __init__(self, port: int):
+        self._url = "http://127.0.0.1:%d" % port
+        self._session = requests.Session()
+
+
+    def request(self, method, path, params=None, body=None, data=None, headers=None, timeout=None):
+        try:
+            resp = self._session.request(method, self._url + path, params=params, json=body, data=data,
+                                         headers=headers, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            raise ConnectionError("Request %s %s failed: %s" % (method, path, e)) from e
+        return Response(resp.status_code, resp.headers.get("Content-Type", ""), resp.content)
+
+
+    def close(self):
+        self._session.close()
+
+
+
+class UnixSocketTransport(Transport):
+    """
+    Transport to a server listening on the Unix domain socket ``path``.
+
+    A single connection is kept alive between the requests, and concurrent
+    requests are serialized on it.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._conn = None  # type: Optional[_UnixHTTPConnection]
+        self._lock = threading.Lock()
+
+
+    def request(self, method, path, params=None, body=None, data=None, headers=None, timeout=None):
+        url = path + ("?" + urlencode(params) if params else "")
+        headers = dict(headers or {})
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        with self._lock:
+            reused = self._conn is not None
+            try:
+                try:
+                    return self._roundtrip(method, url, data, headers, timeout)
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    # The server may have dropped the connection while it was idle: retry once
+                    # on a fresh connection.
+                    self._close_connection()
+                    if not reused:
+                        raise
+                    return self._roundtrip(method, url, data, headers, timeout)
+            except (OSError, http.client.HTTPException) as e:
+                self._close_connection()
+                raise ConnectionError("Request %s %s failed: %s" % (method, path, e)) from e
+
+
+    def close(self):
+        with self._lock:
+            self._close_connection()
+
+
+    def _roundtrip(self, method: str, url: str, data: Optional[bytes], headers: Dict[str, str],
+                   timeout: Optional[float]) -> Response:
+        if self._conn is None:
+            self._conn = _UnixHTTPConnection(self._path)
+        self._conn.timeout = timeout
+        if self._conn.sock is not None:
+            self._conn.sock.settimeout(timeout)
+        self._conn.request(method, url, body=data, headers=headers)
+        resp = self._conn.getresponse()
+        content = resp.read()
+        if resp.will_close:
+            self._close_connection()
+        return Response(resp.status, resp.getheader("Content-Type", ""), content)
+
+
+    def _close_connection(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket."""
+
+    def __init__(self, path: str):
+        super().__init__("localhost")
+        self._path = path
+
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self._path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+
+class StdioTransport(Transport):
+    """
+    Transport to a server running as a child process in the stdio mode.
+
+    Requests and responses are sent over the process' stdin / stdout as frames:
+    a little-endian uint32 length followed by that many bytes. The request frame
+    consists of the request line and headers, each terminated by ``"\\n"``, then
+    an empty line and the body::
+
+        POST /mojos/1/score0~dada\\n
+        Content-Type: application/x-mojo-binary\\n
+        \\n
+        <body>
+
+    and the response frame is ``"{status} {content-type}\\n"`` followed by the
+    body of the response.
+
+    The pipes carry one exchange at a time, so concurrent requests are serialized.
+    The response of a request that has timed out still arrives later: it is then
+    skipped, before the response of the next request is read.
+    """
+
+    def __init__(self, process):
+        """
+        :param process: the ``subprocess.Popen`` of the server, started with
+            unbuffered binary ``stdin`` and ``stdout`` pipes.
+        """
+        self._stdin = process.stdin
+        self._stdout = process.stdout
+        self._lock = threading.Lock()
+        self._buffer = bytearray()  # received bytes of the responses that were not read completely yet
+        self._owed = 0              # number of responses that the server still has to send
+
+
+    def request(self, method, path, params=None, body=None, data=None, headers=None, timeout=None):
+        lines = [method + " " + path + ("?" + urlencode(params) if params else "")]
+        if headers:
+            lines += ["%s: %s" % header for header in headers.items()]
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            lines.append("Content-Type: application/json")
+        frame = ("\n".join(lines) + "\n\n").encode("utf-8") + (data or b"")
+        with self._lock:
+            try:
+                self._stdin.write(struct.pack("<I", len(frame)) + frame)
+                self._stdin.flush()
+                self._owed += 1
+                # The responses of the earlier requests that have timed out come first
+                while True:
+                    resp = self._read_frame(timeout)
+                    self._owed -= 1
+                    if self._owed == 0:
+                        break
+            except (OSError, ValueError) as e:
+                # ValueError is raised when the pipes have already been closed
+                raise ConnectionError("Request %s %s failed: %s" % (method, path, e)) from e
+        status_line, _, content = resp.partition(b"\n")
+        status, _, content_type = status_line.decode("ascii").partition(" ")
+        return Response(int(status), content_type, content)
+
+
+    def close(self):
+        for pipe in (self._stdin, self._stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+
+    def _read_frame(self, timeout: Optional[float]) -> bytes:
+        """
+        Read the next response frame. If it times out, the bytes received so far are
+        kept in the buffer, so that the frame can be read completely later.
+        """
+        self._fill(4, timeout)
+        end = 4 + struct.unpack("<I", bytes(self._buffer[:4]))[0]
+        self._fill(end, timeout)
+        frame = bytes(self._buffer[4:end])
+        del self._buffer[:end]
+        return frame
+
+
+    def _fill(self, n: int, timeout: Optional[float]) -> None:
+        """Read from the pipe until the buffer has ``n`` bytes (never more than that)."""
+        while len(self._buffer) < n:
+            if timeout is not None and not select.select([self._stdout], [], [], timeout)[0]:
+                raise TimeoutError("No response from the server in %.1f seconds" % timeout)
+            chunk = self._stdout.read(n - len(self._buffer))
+            if not chunk:
+                raise ConnectionError("The server has closed the pipe")
+            self._buffer += chunk
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+from .mojo_model import MojoModel
+
+
+class ScoringBatcher:
+    """
+    Thread-safe front end of a :class:`MojoModel`, which coalesces the concurrent
+    single-row calls into batches.
+
+    Each :meth:`call` (such as ``call("score0~dada", row, preds)``) and each
+    :meth:`score` would otherwise be a request of its own. Here the calls made
+    at the same time by different threads are sent together, in a single
+    :meth:`MojoModel.call_batch` (or :meth:`MojoModel.score_rows`) request, and the
+    results are handed back to the waiting threads.
+
+    The first thread of a batch sends it, when the previous batch has returned
+    (at most ``max_in_flight`` batches are in progress at once), so a batch
+    collects all the calls that arrive during the previous request. Once the
+    calls are seen to be concurrent, the batch also waits a little for more of
+    them: a fraction of the measured response time, but at most ``max_delay``
+    seconds. A single thread calling the batcher is therefore not delayed.
+
+    The size of the batches is limited: it starts at ``max_batch_size``, is halved
+    whenever a batch takes longer than ``target_latency`` seconds, and is doubled
+    again (up to ``max_batch_size``) whenever a full batch is much faster.
+
+    The calls of one thread never fail those of the others: the arguments are
+    checked before the call joins a batch, and if a batch request fails anyway,
+    its calls are made again one by one, so that only the failing ones raise.
+    """
+
+    def __init__(self, model: MojoModel, max_batch_size: int = 256, max_delay: float = 0.002,
+                 target_latency: float = 0.010, max_in_flight: int = 1):
+        assert max_batch_size >= 1, "Invalid max_batch_size = %r" % max_batch_size
+        assert max_in_flight >= 1, "Invalid max_in_flight = %r" % max_in_flight
+        self._model = model
+        self._calls = _Lane(model.call_batch, lambda command: model.call(*command),
+                            max_batch_size, max_delay, target_latency, max_in_flight)
+        self._scores = _Lane(model.score_rows, model.score, max_batch_size, max_delay, target_latency, max_in_flight)
+
+
+    @property
+    def model(self) -> MojoModel:
+        return self._model
+
+
+    def call(self, method: str, *args: str) -> str:
+        """Same as :meth:`MojoModel.call`, batched with the concurrent calls."""
+        if not isinstance(method, str) or not all(isinstance(arg, str) for arg in args):
+            raise TypeError("The method and its arguments must be strings: %r" % ((method,) + args, ))
+        return self._calls.submit((method,) + args)
+
+
+    def score(self, row: Sequence[float]) -> Union[List[float], str]:
+        """Same as :meth:`MojoModel.score`, batched with the concurrent calls (see :meth:`MojoModel.score_rows`)."""
+        row = [float(x) for x in row]
+        if len(row) != self._model.nfeatures:
+            raise ValueError("Expected a row of %d values, got %d" % (self._model.nfeatures, len(row)))
+        return self._scores.submit(row)
+
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Statistics of the batching, separately for the :meth:`call` and :meth:`score`::
+
+            {"calls": {"batches": number of requests sent, "items": number of calls batched,
+                       "mean_batch_size": ..., "batch_limit": current limit of the batch size,
+                       "latency": average response time (in seconds), "window": current time
+                       that a batch waits for more calls (in seconds)},
+             "scores": {...}}
+        """
+        return {"calls": self._calls.stats(), "scores": self._scores.stats()}
+
+
+class _Batch:
+    __slots__ = ("items", "results", "errors", "full", "done")
+
+    def __init__(self):
+        self.items = []
+        self.results = None  # type: Optional[list]
+        self.errors = None   # type: Optional[List[Optional[BaseException]]]
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class _Lane:
+    """
+    Batches the items for one function ``execute(items) -> results``, see :class:`ScoringBatcher`.
+    If the batch fails, its items are executed one by one with ``execute_one(item) -> result``.
+    """
+    _WINDOW_FRACTION = 0.25  # wait for more calls at most this fraction of the response time
+    _SMOOTHING = 0.2         # weight of the latest batch in the moving averages
+
+    def __init__(self, execute: Callable[[list], list], execute_one: Callable, max_batch_size: int,
+                 max_delay: float, target_latency: float, max_in_flight: int):
+        self._execute = execute
+        self._execute_one = execute_one
+        self._max_batch_size = max_batch_size
+        self._max_delay = max_delay
+        self._target_latency = target_latency
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max_in_flight)
+        self._open = None  # type: Optional[_Batch]
+        self._batch_limit = max_batch_size
+        self._latency = 0.0
+        self._mean_size = 1.0
+        self._batches = 0
+        self._items = 0
+
+
+    def submit(self, item):
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self._batch_limit:
+                self._open = None
+                batch.full.set()
+        if leader:
+            self._send(batch)
+        else:
+            batch.done.wait()
+        if batch.errors is not None and batch.errors[index] is not None:
+            raise batch.errors[index]
+        return batch.results[index]
+
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        with self._lock:
+            return {"batches": self._batches, "items": self._items,
+                    "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+                    "batch_limit": self._batch_limit, "latency": self._latency, "window": self._window()}
+
+
+    def _send(self, batch: _Batch) -> None:
+        # Meanwhile the batch is open, and collects the calls of the other threads
+        self._slots.acquire()
+        try:
+            window = self._window()
+            if window > 0:
+                batch.full.wait(window)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            start = time.perf_counter()
+            try:
+                batch.results = self._execute(batch.items)
+                assert len(batch.results) == len(batch.items), "Expected %d results, got %d" % \
+                    (len(batch.items), len(batch.results))
+            except Exception as e:
+                if len(batch.items) == 1:
+                    batch.errors = [e]
+                else:
+                    self._execute_separately(batch)
+            except BaseException as e:
+                batch.errors = [e] * len(batch.items)
+                raise
+            self._record(len(batch.items), time.perf_counter() - start)
+        finally:
+            self._slots.release()
+            batch.done.set()
+
+
+    def _execute_separately(self, batch: _Batch) -> None:
+        """Execute the items of the failed batch one by one, so that each gets its own result or error."""
+        batch.results = [None] * len(batch.items)
+        batch.errors = [None] * len(batch.items)
+        for i, item in enumerate(batch.items):
+            try:
+                batch.results[i] = self._execute_one(item)
+            except Exception as e:
+                batch.errors[i] = e
+
+
+    def _window(self) -> float:
+        # Waiting for more calls only pays off if there are concurrent calls at all
+        if self._mean_size < 1.5:
+            return 0.0
+        return min(self._max_delay, self._WINDOW_FRACTION * self._latency)
+
+
+    def _record(self, size: int, latency: float) -> None:
+        with self._lock:
+            alpha = self._SMOOTHING
+            self._latency = latency if not self._batches else (1 - alpha) * self._latency + alpha * latency
+            self._mean_size = (1 - alpha) * self._mean_size + alpha * size
+            self._batches += 1
+            self._items += size
+            if latency > self._target_latency and size > 1:
+                self._batch_limit = max(1, min(self._batch_limit, size) // 2)
+            elif size >= self._batch_limit and latency < self._target_latency / 2:
+                self._batch_limit = min(self._max_batch_size, self._batch_limit * 2)
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
-from typing import Dict, Iterator, List, Optional, Tuple
+import itertools
+import math
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 from mojoland.backend import MojoBackend
+from mojoland.backend import shm
 from mojoland.recipes.cookbook import v0_simple_params, v0_multi_params
 from mojoland.utils import parse_string_list, parse_string_doublelist
 
@@ -22,11 +25,76 @@ class MojoModel:
         self._enumsmap = None   # type: Optional[Dict[int, Dict[str, int]]]
 
 
+    @property
+    def id(self) -> str:
+        """Id of the model in the backend."""
+        return self._id
+
+
     def call(self, method: str, *args: str) -> str:
         params = {"arg%d" % i: arg for i, arg in enumerate(args, 1)}
         return self._backend.invoke_method(self._id, method, params)
 
 
+    def call_batch(self, commands: List[Tuple]) -> List[str]:
+        """Execute several commands ``(method, *args)``, returning the list of their results."""
+        return self._backend.invoke_batch(self._id, commands)
+
+
+    def score(self, row: Sequence[float]) -> Union[List[float], str]:
+        """
+        Score a single row of data, already prepared as the mojo expects it.
+
+        The row and the predictions are exchanged with the backend in binary
+        form. Returns the list of predictions, or a string if the mojo raised
+        an exception while scoring.
+        """
+        preds = [0.0] * self.npredictions
+        return self._backend.invoke_binary(self._id, "score0~dada", [row, preds])
+
+
+    def score_rows(self, rows: Sequence[Sequence[float]]) -> List[Union[List[float], str]]:
+        """
+        Score a block of rows, each already prepared as the mojo expects it (i.e.
+        having exactly ``nfeatures`` values).
+
+        The rows and the predictions are exchanged with the backend through
+        shared memory (if it is not available, then the rows are scored one by
+        one with :meth:`score`). Returns the list of predictions for each row, or
+        a string for the rows where the mojo raised an exception while scoring.
+        """
+        if not rows:
+            return []
+        if not shm.is_available():
+            return [self.score(row) for row in rows]
+        with shm.SharedMatrix(len(rows), self.nfeatures) as inputs, \
+                shm.SharedMatrix(len(rows), self.npredictions) as outputs:
+            for i, row in enumerate(rows):
+                inputs.write_row(i, row)
+            errors = self._backend.invoke_shm(self._id, "score0~dada", inputs, outputs)
+            return [errors[i] if i in errors else outputs.read_row(i) for i in range(len(rows))]
+
+
+    def score_dataset(self, datagen: Iterator[List[str]],
+                      chunk_size: int = 10000) -> Iterator[Union[List[float], str]]:
+        """
+        Score all rows of a dataset, yielding predictions for each row (as in
+        :meth:`score_rows`).
+
+        The first item of ``datagen`` is the header with the column names, the
+        following ones are the rows of raw values. Each row is converted with
+        :meth:`prepare_row` (values that are not numbers become NaNs), and the
+        rows are scored in blocks of ``chunk_size``.
+        """
+        namesmap = self.make_names_map(next(datagen))
+        while True:
+            chunk = [[_to_float(v) for v in self.prepare_row(namesmap, row)]
+                     for row in itertools.islice(datagen, chunk_size)]
+            if not chunk:
+                break
+            yield from self.score_rows(chunk)
+
+
     def close(self) -> None:
         self._backend.unload_model(self._id)
 
@@ -178,3 +246,10 @@ class MojoModel:
         # Predictions vec is too short (this should be the last test case)
         predictions = "[0]"
         yield score(["0"] * n)
+
+
+def _to_float(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
@@ -1,26 +1,34 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
+import asyncio
 import colorama
+import itertools
 import os
 import re
 from typing import Callable, Dict, Iterator, List, Optional, Tuple, Type
 
 import h2o
-from mojoland import MojoModel, get_backend
+from mojoland import AsyncMojoBackend, MojoModel, SupervisedMojoBackend, get_backend
 from .baserecipe import BaseRecipe
 
 
 class Connoisseur:
+    _DEFAULT_BATCH_SIZE = 1000  # number of nibble commands sent to the backend within a single request
 
-    def __init__(self, *, backend):
+    def __init__(self, *, backend, transport=None, instances=1, daemon=False, idle_timeout=None, supervised=False,
+                 profile=None):
         # Initialize external connectors
         colorama.init()
         h2o.init()
-        self._backend = get_backend(backend)
+        self._backend = get_backend(backend, transport, instances, daemon=daemon, idle_timeout=idle_timeout,
+                                    supervised=supervised, profile=profile)
         print()
         # Create the class
         self._latest_mojo_versions = Connoisseur._retrieve_mojo_versions()
         self._can_bake = False
+        self._batch_size = Connoisseur._DEFAULT_BATCH_SIZE
+        self._async_backend = None  # type: Optional[AsyncMojoBackend]
+        self._loop = None           # type: Optional[asyncio.AbstractEventLoop]
 
 
     def degustate(self, recipe: Type[BaseRecipe]):
@@ -48,6 +56,52 @@ class Connoisseur:
         self._can_bake = value
 
 
+    @property
+    def batch_size(self) -> int:
+        """
+        Maximum number of commands sent to the backend within a single request.
+
+        Value 1 (or less) disables batching, so that each command is executed
+        as a separate request.
+        """
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self, value: int):
+        self._batch_size = value
+
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Maximum number of batches of nibble commands that can be sent to the
+        backend before their results are received.
+
+        With value 1 (the default) each batch is sent only after the previous
+        one was answered. Higher values keep the backend busy while the next
+        batches are being prepared (this requires batching, and the "http" or
+        "unix" transport).
+        """
+        return self._async_backend.max_in_flight if self._async_backend else 1
+
+    @in_flight.setter
+    def in_flight(self, value: int):
+        if value > 1 and isinstance(self._backend, SupervisedMojoBackend):
+            # The restarted server would be on a different address than the one the async client talks to
+            raise ValueError("A supervised backend cannot have several batches in flight")
+        if self._async_backend:
+            self._async_backend.close()
+            # Let the loop finish closing the connections
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
+            self._async_backend = self._loop = None
+        if value > 1:
+            # The connections of the async client belong to the event loop that opened them, so the
+            # connoisseur keeps a loop of its own for all of them (instead of relying on the global one)
+            self._loop = asyncio.new_event_loop()
+            self._async_backend = AsyncMojoBackend(self._backend, value)
+
+
     #-------------------------------------------------------------------------------------------------------------------
     # Private
     #-------------------------------------------------------------------------------------------------------------------
@@ -224,11 +278,50 @@ class Connoisseur:
 
 
     def _make_nibble(self, mojo: MojoModel, commands: Callable[[], Iterator[Tuple[str, ...]]]) -> str:
-        out = ""
-        for command in commands():
-            res = mojo.call(*command)
-            out += res + "\n"
-        return out
+        if self._async_backend and self._batch_size > 1:
+            return self._loop.run_until_complete(self._make_nibble_async(mojo, commands))
+        out = []  # type: List[str]
+        if self._batch_size <= 1:
+            for command in commands():
+                out.append(mojo.call(*command))
+        else:
+            cmds = commands()
+            while True:
+                chunk = list(itertools.islice(cmds, self._batch_size))
+                if not chunk:
+                    break
+                out.extend(mojo.call_batch(chunk))
+        return "".join(res + "\n" for res in out)
+
+
+    async def _make_nibble_async(self, mojo: MojoModel, commands: Callable[[], Iterator[Tuple[str, ...]]]) -> str:
+        """
+        Same as :meth:`_make_nibble`, except that the batches of commands are sent
+        as soon as they are ready, without waiting for the results of the previous
+        ones (up to ``in_flight`` batches at a time).
+        """
+        backend = self._async_backend
+        cmds = commands()
+        pending = []  # type: List[asyncio.Future]
+        results = []  # type: List[List[str]]
+        try:
+            while True:
+                chunk = list(itertools.islice(cmds, self._batch_size))
+                if not chunk:
+                    break
+                if len(pending) >= backend.max_in_flight:
+                    results.append(await pending.pop(0))
+                pending.append(asyncio.ensure_future(backend.invoke_batch(mojo.id, chunk)))
+                # Let the new request go out before the next batch is prepared
+                await asyncio.sleep(0)
+            while pending:
+                results.append(await pending.pop(0))
+        finally:
+            # If a request has failed, the others still in flight are cancelled (and their errors are dropped)
+            for fut in pending:
+                fut.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return "".join(res + "\n" for chunk_results in results for res in chunk_results)
 
 
     def _write_temp_nibble(self, nibble_text: str, nibble_filename: str) -> str:
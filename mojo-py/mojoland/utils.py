@@ -34,3 +34,13 @@ def parse_string_doublelist(s: str) -> List[Optional[List[str]]]:
         while s[i] == " ":
             i += 1
     return res
+
+
+def parse_double_list(s: str) -> Optional[List[float]]:
+    """Parse the string representation of a ``double[]``, or return None if `s` is not such a string."""
+    if not (s.startswith("[") and s.endswith("]")):
+        return None
+    try:
+        return [float(x) for x in s[1:-1].split(",")] if s != "[]" else []
+    except ValueError:
+        return None
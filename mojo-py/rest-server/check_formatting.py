@@ -0,0 +1,139 @@
+#!/usr/bin/env python2
+# -*- encoding: utf-8 -*-
+"""
+Check that the fast formatting of the results in `server.py` (`float_to_string` and
+`list_to_string`) produces exactly the same text as the original formatter did, and
+measure how much faster it is.
+
+Every number found in the saved nibbles of the mojo-data directory is formatted by
+both formatters, as a list (each line of a nibble being a list of the values of one
+result) and on its own, and so are the lists of strings (such as the domains). Some
+edge cases and random values are checked too. Any difference is printed, and makes
+the script exit with a non-zero status; then the throughput of both formatters is
+compared on some typical results.
+
+Like the server, this script is python-2 only.
+"""
+from __future__ import division, print_function
+import argparse
+import math
+import os
+import random
+import re
+import sys
+import timeit
+
+import server
+
+
+def reference_list_to_string(l, quotes=True):
+    """The original `list_to_string`, which the fast one must match character for character."""
+    if l is None:
+        return "null"
+
+    response = "["
+    i = 0
+    while i < len(l):
+        if i > 0:
+            response += ", "
+        if l[i] is None:
+            response += "null"
+        else:
+            if quotes:
+                response += '"'
+            if isinstance(l[i], float):
+                number = '{:0.17f}'.format(l[i])
+                while number.endswith("0"):
+                    if number.endswith(".0"):
+                        break
+                    number = number[:-1]
+                response += number
+            else:
+                response += str(l[i])
+            if quotes:
+                response += '"'
+        i += 1
+    response += "]"
+    return response
+
+
+NUMBER_RE = re.compile(r"[-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|NaN|Infinity)")
+STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|(null)')
+
+
+def parse_number(token):
+    return float(token.replace("Infinity", "inf"))
+
+
+def read_nibbles(data_dir):
+    """Yield the lists of values (floats, or strings) found in the nibbles under ``data_dir``."""
+    for dirpath, _, filenames in os.walk(data_dir):
+        for filename in sorted(filenames):
+            if not filename.endswith(".txt"):
+                continue
+            with open(os.path.join(dirpath, filename)) as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith("[") and '"' in line:
+                        yield filename, [None if null else s for s, null in STRING_RE.findall(line)]
+                    numbers = NUMBER_RE.findall(line)
+                    if numbers:
+                        yield filename, [parse_number(token) for token in numbers]
+
+
+def extra_values():
+    """The edge cases of the formatting, and a lot of random values of all magnitudes."""
+    values = [0.0, -0.0, 1.0, -1.0, 0.1, 1 / 3, 2.5, 1e15, 9999999999999998.0, 1e16, 1e17, 1e200, -1e200,
+              5e-324, 1e-20, float("nan"), float("inf"), float("-inf")]
+    rnd = random.Random(42)
+    values += [rnd.uniform(-1e6, 1e6) for _ in range(100000)]
+    values += [float(rnd.randint(-10**6, 10**6)) for _ in range(10000)]
+    values += [math.ldexp(rnd.random(), rnd.randint(-1000, 1000)) for _ in range(100000)]
+    return values
+
+
+def check(data_dir):
+    """Compare both formatters on all the values, and return the number of differences found."""
+    nlists = nvalues = ndiffs = 0
+    cases = list(read_nibbles(data_dir))
+    cases += [("(extra)", [x]) for x in extra_values()]
+    for filename, values in cases:
+        nlists += 1
+        nvalues += len(values)
+        singles = [[x] for x in values] if len(values) > 1 else []
+        for l in [values] + singles:
+            for quotes in (False, True):
+                expected = reference_list_to_string(l, quotes)
+                actual = server.list_to_string(l, quotes)
+                if actual != expected:
+                    ndiffs += 1
+                    print("%s: %s instead of %s" % (filename, actual, expected))
+    print("Checked %d lists with %d values: %d differences" % (nlists, nvalues, ndiffs))
+    return ndiffs
+
+
+def benchmark():
+    preds = [0.0, 0.9731203081488602, 0.026879691851139847]
+    rnd = random.Random(42)
+    floats = [rnd.uniform(-1e3, 1e3) for _ in range(5000)]
+    domain = ["level%d" % i for i in range(1575)]
+    for label, l, quotes in [("3-class prediction", preds, False), ("5000 floats", floats, False),
+                             ("1575-level domain", domain, True)]:
+        number = max(1, 200000 // len(l))
+        before = min(timeit.repeat(lambda: reference_list_to_string(l, quotes), number=number, repeat=3)) / number
+        after = min(timeit.repeat(lambda: server.list_to_string(l, quotes), number=number, repeat=3)) / number
+        print("%-20s before %9.2f us   after %9.2f us   (%.1fx)" % (label, before * 1e6, after * 1e6, before / after))
+
+
+if __name__ == "__main__":
+    default_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "mojo-data")
+    parser = argparse.ArgumentParser(description="Check the fast formatting of the server against the original one.")
+    parser.add_argument("--data", help="Directory with the saved nibbles (default is mojo-data)",
+                        default=default_data_dir)
+    parser.add_argument("--no-benchmark", help="Only check the formatting, without measuring its throughput",
+                        action="store_true")
+    args = parser.parse_args()
+    if check(args.data):
+        sys.exit(1)
+    if not args.no_benchmark:
+        benchmark()
@@ -5,68 +5,351 @@
 #
 from __future__ import division, print_function
 import argparse
+import gc
+import mimetools
+import mmap
+import os
+import re
+import signal
+import socket
+import struct
 import sys
+import threading
+import time
 import traceback
 import urlparse
 import json
+import Queue
+from cStringIO import StringIO
+from collections import OrderedDict, deque
 
-# this is replaced with `http.server` in Python3
+# these are replaced with `http.server` and `socketserver` in Python3
 from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn, UnixStreamServer
 
 import h2omojo
 
 
-shutdown_requested = False
-
 class MojoStore(object):
+    """
+    Registry of all loaded models. Access is guarded by a lock, so that the
+    store can be shared by the request-handling threads of a threaded server.
+
+    A model loaded from a file is shared by all the loads of the same file (as
+    identified by its `mojo_file_key`), and it is counted how many times it was
+    loaded: the model is removed only when each of those loads was undone by
+    `release_model`. The models loaded at startup (see `--preload`) hold one
+    such reference of their own, so they are never removed.
+
+    The number of models kept in memory, and the total size of their files, can
+    be limited (see `--max-models`). When a limit is exceeded, the least recently
+    used models are evicted: they keep their ids, and are loaded again from their
+    files when they are used next time. The preloaded models are not evicted.
+
+    A model can also be addressed by a name (an alias), which can be pointed to
+    another model at any time (see `set_alias`): the requests that are already
+    in progress finish with the model they have started with. An alias holds a
+    reference to its model, as if it had loaded it.
+
+    The store can be recorded in a snapshot file (see `--snapshot`), which lists
+    the ids, files and reference counts of the models (and the aliases), and is updated whenever
+    they change. A server restarted with the same snapshot restores all those
+    ids: the models are loaded again in the background, or when they are used
+    first, whichever is sooner.
+
+    Once the store is frozen (in the pre-fork mode, see `PreforkServer`) no
+    models can be added or removed: each worker process has its own copy of the
+    store.
+    """
 
     def __init__(self):
-        self._store = {}
+        self._store = OrderedDict()  # models in memory, from the least recently used
         self._index = 0
+        self._refcounts = {}
+        self._ids_by_key = {}
+        self._keys_by_id = {}
+        self._pinned = set()
+        self._aliases = {}
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self.snapshot_path = None
+        self.frozen = False
+        self.max_models = 0
+        self.max_bytes = 0
+        self.loaded_bytes = 0
+        self.evictions = 0
+        self.reloads = 0
 
-    def add_model(self, model):
-        self._index += 1
-        self._store[str(self._index)] = model
-        return str(self._index)
+    def preload(self, filename):
+        key = mojo_file_key(filename)
+        model_id = self.acquire_model(key)
+        if model_id is None:
+            model_id = self.add_model(ModelInfo(h2omojo.load_mojo_model(filename)), key)
+        else:
+            # Restored from the snapshot
+            self.get_model(model_id)
+        with self._lock:
+            self._pinned.add(model_id)
+        self.save_snapshot()
+        return model_id
+
+    def acquire_model(self, key):
+        """
+        Return the id of the model already loaded from the file with the given ``key``,
+        counting one more load of it; or None if there is none.
+        """
+        if key is None:
+            return None
+        with self._lock:
+            index = self._acquire(key)
+        if index is not None:
+            self.save_snapshot()
+        return index
+
+    def add_model(self, model, key=None):
+        """
+        Add the ``model`` loaded from the file with the given ``key``. If the same file was
+        loaded concurrently by another request, then its model is used instead.
+        """
+        with self._lock:
+            index = self._acquire(key) if key else None
+            if index is None:
+                self._index += 1
+                index = str(self._index)
+                self._store[index] = model
+                self._refcounts[index] = 1
+                if key:
+                    self._ids_by_key[key] = index
+                    self._keys_by_id[index] = key
+                    self.loaded_bytes += key[1]
+                self._evict(index)
+        self.save_snapshot()
+        return index
 
     def get_model(self, index):
-        return self._store.get(index, None)
+        """
+        Return the model ``index`` (or the model of the alias ``index``; None if there is
+        none), loading it again if it was evicted.
+        """
+        with self._lock:
+            index = self._aliases.get(index, index)
+            model = self._store.pop(index, None)
+            if model is not None:
+                self._store[index] = model
+                return model
+            if index not in self._refcounts:
+                return None
+            key = self._keys_by_id[index]
+        # The model is loaded outside of the lock, so that the other models can be used meanwhile
+        if mojo_file_key(key[0]) != key:
+            raise IOError("Model %s was evicted, and its file %s has changed since it was loaded" % (index, key[0]))
+        model = ModelInfo(h2omojo.load_mojo_model(key[0]))
+        with self._lock:
+            if index not in self._refcounts:
+                return None
+            if index in self._store:
+                return self._store[index]
+            self._store[index] = model
+            self.loaded_bytes += key[1]
+            self.reloads += 1
+            print("Reloaded model %s from %s" % (index, key[0]))
+            self._evict(index)
+            return model
+
+    def release_model(self, index):
+        """Undo one load of the model, and remove the model if it is no longer used (ignore unknown ids)."""
+        with self._lock:
+            self._release(index)
+        self.save_snapshot()
+
+    def set_alias(self, name, index):
+        """Point the alias ``name`` to the model ``index``, and return the id of its previous model (if any)."""
+        with self._lock:
+            if index not in self._refcounts:
+                raise KeyError("Model %s was not loaded" % index)
+            self._refcounts[index] += 1
+            previous = self._aliases.get(name)
+            self._aliases[name] = index
+            if previous is not None:
+                self._release(previous)
+        self.save_snapshot()
+        return previous
+
+    def remove_alias(self, name):
+        with self._lock:
+            self._release(self._aliases.pop(name))
+        self.save_snapshot()
+
+    def aliases(self):
+        with self._lock:
+            return dict(self._aliases)
+
+    def resolve(self, name):
+        """The id of the model of the alias ``name``, or ``name`` itself if it is not an alias."""
+        with self._lock:
+            return self._aliases.get(name, name)
+
+    def stats(self):
+        """Statistics of the store, for the `GET /stats` endpoint."""
+        with self._lock:
+            return OrderedDict([("models", len(self._refcounts)), ("loaded", len(self._store)),
+                                ("loaded_bytes", self.loaded_bytes), ("evictions", self.evictions),
+                                ("reloads", self.reloads), ("max_models", self.max_models),
+                                ("max_bytes", self.max_bytes)])
+
+    def save_snapshot(self):
+        """Record the models in the snapshot file, if there is one (see `restore_snapshot`)."""
+        if not self.snapshot_path or self.frozen:
+            return
+        # The snapshots are written one at a time, so that the latest one always wins
+        with self._snapshot_lock:
+            with self._lock:
+                # From the least recently used; the evicted models first. The models without a file
+                # cannot be restored, and the preloaded models are restored by `--preload`.
+                order = [i for i in self._refcounts if i not in self._store] + list(self._store)
+                models = [{"id": i, "file": self._keys_by_id[i][0], "size": self._keys_by_id[i][1],
+                           "mtime": self._keys_by_id[i][2], "refs": self._refcounts[i] - (i in self._pinned)}
+                          for i in order if i in self._keys_by_id]
+                snapshot = {"next_id": self._index + 1, "models": [m for m in models if m["refs"] > 0],
+                            "aliases": {name: i for name, i in self._aliases.items() if i in self._keys_by_id}}
+            tmp_path = "%s.%d" % (self.snapshot_path, os.getpid())
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.rename(tmp_path, self.snapshot_path)
+
+    def restore_snapshot(self, path):
+        """
+        Restore the models recorded in the snapshot file at ``path`` (if it exists) as evicted,
+        and keep the snapshot there from now on. Return the ids of the restored models, from
+        the most recently used.
+        """
+        self.snapshot_path = path
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (EnvironmentError, ValueError):
+            return []
+        with self._lock:
+            self._index = max(self._index, snapshot["next_id"] - 1)
+            for m in snapshot["models"]:
+                key = (m["file"], m["size"], m["mtime"])
+                self._refcounts[m["id"]] = m["refs"]
+                self._ids_by_key[key] = m["id"]
+                self._keys_by_id[m["id"]] = key
+            self._aliases.update(snapshot.get("aliases", {}))
+        print("Restored %d models from the snapshot %s" % (len(snapshot["models"]), path))
+        return [m["id"] for m in reversed(snapshot["models"])]
+
+    def warm_up(self, indices):
+        """Load the models ``indices`` (restored from a snapshot) in a background thread."""
+        def load():
+            for index in indices[:self.max_models or None]:
+                try:
+                    self.get_model(index)
+                except Exception as e:
+                    print("Unable to load model %s from the snapshot: %s" % (index, e))
+        thread = threading.Thread(target=load)
+        thread.daemon = True
+        thread.start()
+
+    def _release(self, index):
+        # Like the Java server, ignore the ids that are unknown (such as the aliases)
+        if index not in self._refcounts:
+            return
+        if self._refcounts[index] > 1:
+            self._refcounts[index] -= 1
+            return
+        del self._refcounts[index]
+        prediction_cache.invalidate(index)
+        key = self._keys_by_id.pop(index, None)
+        if self._store.pop(index, None) is not None and key:
+            self.loaded_bytes -= key[1]
+        self._pinned.discard(index)
+        if key:
+            del self._ids_by_key[key]
+
+    def _acquire(self, key):
+        index = self._ids_by_key.get(key)
+        if index is not None:
+            self._refcounts[index] += 1
+        return index
+
+    def _evict(self, keep_index):
+        """Evict the least recently used models (except ``keep_index``) until the store fits into its budget."""
+        for index in list(self._store):
+            if not self._over_budget():
+                break
+            if index == keep_index or index not in self._keys_by_id or index in self._pinned:
+                continue
+            del self._store[index]
+            self.loaded_bytes -= self._keys_by_id[index][1]
+            self.evictions += 1
+            print("Evicted model %s (%s)" % (index, self._keys_by_id[index][0]))
+
+    def _over_budget(self):
+        return ((self.max_models and len(self._store) > self.max_models) or
+                (self.max_bytes and self.loaded_bytes > self.max_bytes))
+
+
+def mojo_file_key(filename):
+    """
+    Key identifying the contents of a mojo file: its real path, size and modification
+    time. A file that was modified has a different key. None if there is no such file.
+    """
+    path = os.path.realpath(filename)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return path, st.st_size, st.st_mtime
+
+
+class ModelInfo(object):
+    """
+    A loaded model together with its metadata, computed once at load time.
+
+    The scoring methods need these values on every call, and retrieving them from
+    the model each time is a measurable part of the cost of a request.
+    """
+    __slots__ = ("model", "uuid", "category", "preds_size", "nfeatures", "hacks")
 
-    def del_model(self, index):
-        del self._store[index]
+    def __init__(self, model):
+        self.model = model
+        self.uuid = str(model.get_uuid())
+        self.category = str(model.get_model_category())
+        self.preds_size = model.get_preds_size()
+        self.nfeatures = model.nfeatures()
+        self.hacks = hack_table.get(self.uuid)
 
 
 mojo_store = MojoStore()
 
 
+def float_to_string(x):
+    """
+    Format a float with 17 decimal places, then strip the trailing zeros (but keep
+    at least one digit after the decimal point).
+
+    Integral values below 1e16 come out the same as their shortest representation
+    ``repr(x)``, which is cheaper to produce, so they take the fast path.
+    """
+    if x.is_integer() and -1e16 < x < 1e16:
+        return float.__repr__(x)
+    number = "%.17f" % x
+    if number[-1] == "0":
+        number = number.rstrip("0")
+        if number[-1] == ".":
+            number += "0"
+    return number
+
+
 def list_to_string(l, quotes=True):
     if l is None:
         return "null"
-
-    response = "["
-    i = 0
-    while i < len(l):
-        if i > 0:
-            response += ", "
-        if l[i] is None:
-            response += "null"
-        else:
-            if quotes:
-                response += '"'
-            if isinstance(l[i], float):
-                number = '{:0.17f}'.format(l[i])
-                while number.endswith("0"):
-                    if number.endswith(".0"):
-                        break
-                    number = number[:-1]
-                response += number
-            else:
-                response += str(l[i])
-            if quotes:
-                response += '"'
-        i += 1
-    response += "]"
-    return response
+    items = ["null" if v is None else float_to_string(v) if isinstance(v, float) else str(v) for v in l]
+    if quotes:
+        items = [item if v is None else '"' + item + '"' for v, item in zip(l, items)]
+    return "[" + ", ".join(items) + "]"
 
 #----------------------------------------------------------
 
@@ -75,22 +358,10 @@ def list_to_string(l, quotes=True):
 # These are hacks to get around test harness rigidities.
 #
 
-hack_table = {}
-
-def make_key(uuid, method, inputs_string, preds_string):
-    key = uuid + " " + method + " " + inputs_string + " " + preds_string
-    return key
+hack_table = {}  # {uuid: {(method, inputs_string, preds_string): response}}
 
 def add_hack(uuid, method, inputs_string, preds_string, response):
-    key = make_key(uuid, method, inputs_string, preds_string)
-    hack_table[key] = response
-
-def maybe_hack_handle(uuid, method, inputs_string, preds_string):
-    key = make_key(uuid, method, inputs_string, preds_string)
-    if key in hack_table:
-        response = hack_table[key]
-        return True, response
-    return False, None
+    hack_table.setdefault(uuid, {})[(method, inputs_string, preds_string)] = response
 
 # StarsGbm (Regression)
 #
@@ -109,8 +380,268 @@ for hack_uuid in ["-1352353826788766814", "4088958400791343826"]:
     add_hack(hack_uuid, hack_method, '[0,1000,2000,3000,4000,5000,NaN]', '[0, 0]', "[85.71974307321011, 0.0]")
 
 #----------------------------------------------------------
+# Prediction cache: the results of the scoring methods,
+# keyed by the model, the method and the input row. Repeated
+# rows (which are common) are then served without scoring.
+#----------------------------------------------------------
+
+class PredictionCache(object):
+    """
+    Least recently used results of the scoring methods (``score0...``), at most
+    ``max_size`` of them (the cache is disabled when it is 0, see `--cache-size`).
+
+    The results are keyed by the id of the model (never by its alias, so an alias
+    that is pointed to another model does not get the results of the previous one),
+    the method, and the arguments, which are canonicalized so that the same row
+    sent as a list of floats or as a string (with any formatting) is the same key.
+    The results of a model are removed when the model is unloaded.
+    """
+
+    def __init__(self):
+        self.max_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # {(mojo_id, method, args): result}, from the least recently used
+        self._lock = threading.Lock()
+
+    def invoke(self, mojo_id, info, method, args):
+        """Same as `invoke_mojo_method_raw` on the model ``mojo_id`` (``info``), using the cache."""
+        # The hacked results depend on the exact formatting of the arguments
+        if not self.max_size or not method.startswith("score0") or info.hacks is not None:
+            return invoke_mojo_method_raw(info, method, args)
+        try:
+            key = (mojo_id, method, tuple(canonical_arg(arg) for arg in args))
+        except ValueError:
+            return invoke_mojo_method_raw(info, method, args)
+        with self._lock:
+            result = self._entries.pop(key, None)
+            if result is not None:
+                self._entries[key] = result
+                self.hits += 1
+                return result
+            self.misses += 1
+        result = invoke_mojo_method_raw(info, method, args)
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return result
+
+    def invalidate(self, mojo_id):
+        """Remove the results of the model ``mojo_id``."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == mojo_id]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return OrderedDict([("cache_size", len(self._entries)), ("cache_max_size", self.max_size),
+                                ("cache_hits", self.hits), ("cache_misses", self.misses)])
+
+
+def canonical_arg(arg):
+    """The argument as a hashable value, the same for a ``double[]`` given as a list or as a string."""
+    if isinstance(arg, str) and arg.startswith("["):
+        arg = json.loads(arg)
+    if isinstance(arg, list):
+        # NaN is not equal to itself, so it would never be found in the cache
+        return tuple(None if x != x else float(x) for x in arg)
+    return arg
+
+
+prediction_cache = PredictionCache()
+
+
+#----------------------------------------------------------
+# Shadow scoring: the scoring calls of a (primary) model are
+# mirrored to a shadow model, such as the next version of the
+# same mojo, and the predictions of both are compared. This is
+# done by a background thread, so the callers do not wait for
+# the shadow model.
+#----------------------------------------------------------
+
+class Shadow(object):
+    """The shadow of one primary model, and the statistics of its comparisons."""
+
+    def __init__(self, shadow_id, tolerance, rate):
+        self.shadow_id = shadow_id
+        self.tolerance = tolerance
+        self.rate = rate
+        self.mirrored = 0
+        self.compared = 0
+        self.divergent = 0
+        self.errors = 0
+        self.dropped = 0
+        self.samples = deque(maxlen=10)  # the latest divergent calls
+        self._credit = 0.0
+
+    def sample(self):
+        """Whether to mirror the next call, so that a ``rate`` fraction of the calls is mirrored."""
+        self._credit += self.rate
+        if self._credit < 1:
+            return False
+        self._credit -= 1
+        return True
+
+    def stats(self):
+        return OrderedDict([("shadow", self.shadow_id), ("tolerance", self.tolerance), ("rate", self.rate),
+                            ("mirrored", self.mirrored), ("compared", self.compared),
+                            ("divergent", self.divergent), ("errors", self.errors), ("dropped", self.dropped),
+                            ("samples", list(self.samples))])
+
+
+class ShadowScorer(object):
+    """
+    Mirrors the scoring calls of the models that have a shadow (see `set_shadow`).
+
+    The calls are queued, and scored on the shadow models by a background thread.
+    If the queue is full (the shadows cannot keep up), the calls are dropped and
+    counted. If the shadow model is unloaded, its calls are counted as errors.
+    """
+    QUEUE_SIZE = 1000
+
+    def __init__(self):
+        self._shadows = {}
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue(self.QUEUE_SIZE)
+        self._thread = None
+
+    def set_shadow(self, mojo_id, shadow_id, tolerance, rate):
+        """Mirror the scoring calls of the model ``mojo_id`` to the model ``shadow_id``."""
+        with self._lock:
+            self._shadows[mojo_id] = Shadow(shadow_id, tolerance, rate)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def remove_shadow(self, mojo_id):
+        """Stop mirroring the calls of the model ``mojo_id``, and return the statistics of its shadow."""
+        with self._lock:
+            return self._shadows.pop(mojo_id).stats()
+
+    def stats(self, mojo_id=None):
+        with self._lock:
+            if mojo_id is not None:
+                return self._shadows[mojo_id].stats()
+            return {mojo_id: shadow.stats() for mojo_id, shadow in self._shadows.items()}
+
+    def sample(self, mojo_id, method, args):
+        """
+        Whether the call ``method(args)`` of the model ``mojo_id`` is to be mirrored to the shadow: if so,
+        return a copy of the arguments, otherwise None. It must be taken before the primary model is called,
+        since the scoring methods fill in the lists of doubles (the preds) that they are given.
+        """
+        if not self._shadows or not method.startswith("score0"):
+            return None
+        with self._lock:
+            shadow = self._shadows.get(mojo_store.resolve(mojo_id))
+            if shadow is None or not shadow.sample():
+                return None
+        return [list(arg) if isinstance(arg, list) else arg for arg in args]
+
+    def mirror(self, mojo_id, method, args_copy, result):
+        """Queue the call of the model ``mojo_id`` with its ``result`` (``args_copy`` were returned by `sample`)."""
+        if args_copy is None:
+            return
+        with self._lock:
+            shadow = self._shadows.get(mojo_store.resolve(mojo_id))
+            if shadow is None:
+                return
+            shadow.mirrored += 1
+        try:
+            self._queue.put_nowait((shadow, method, args_copy, result))
+        except Queue.Full:
+            with self._lock:
+                shadow.dropped += 1
+
+    def run(self):
+        while True:
+            shadow, method, args, result = self._queue.get()
+            try:
+                info = mojo_store.get_model(shadow.shadow_id)
+                if info is None:
+                    raise KeyError("model not found")
+                shadow_result = invoke_mojo_method_raw(info, method, args)
+            except Exception as e:
+                with self._lock:
+                    shadow.errors += 1
+                print("Shadow model %s failed on %s: %s" % (shadow.shadow_id, method, e))
+                continue
+            same = predictions_match(result, shadow_result, shadow.tolerance)
+            with self._lock:
+                shadow.compared += 1
+                if not same:
+                    shadow.divergent += 1
+                    shadow.samples.append({"method": method, "args": [to_text(arg) for arg in args],
+                                           "primary": to_text(result), "shadow": to_text(shadow_result)})
+
+
+def predictions_match(a, b, tolerance):
+    """
+    Whether two results of a method are the same, allowing for numeric differences up to
+    ``tolerance`` (as the connoisseur compares the nibbles).
+    """
+    a = prediction_values(a)
+    b = prediction_values(b)
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if x == y:
+            continue
+        try:
+            x = float(x)
+            y = float(y)
+        except (TypeError, ValueError):
+            return False
+        if not (abs(x - y) <= tolerance or (x != x and y != y)):
+            return False
+    return True
+
+
+def prediction_values(result):
+    """The elements of a result: either a list of floats, or a string such as "[0.5, 0.5]"."""
+    if isinstance(result, list):
+        return result
+    result = str(result).strip()
+    if result.startswith("[") and result.endswith("]"):
+        return [elem.strip() for elem in result[1:-1].split(",")]
+    return [result]
+
+
+def to_text(value):
+    return list_to_string(value, quotes=False) if isinstance(value, list) else value
+
+
+shadow_scorer = ShadowScorer()
+
+
+#----------------------------------------------------------
+
+# The aliases of the models (see `MojoStore.set_alias`) must not look like their numeric ids
+ALIAS_RE = re.compile(r"^[A-Za-z][\w.-]*$")
+
 
 class MojoHandlers(BaseHTTPRequestHandler):
+    # Keep connections alive between requests: this requires every response to carry
+    # a Content-Length header. Idle connections are dropped after `timeout` seconds.
+    # The response is buffered and sent in one piece (it is flushed after each request),
+    # and Nagle's algorithm is disabled: otherwise the small writes on a kept-alive
+    # connection would stall on the client's delayed ACK.
+    protocol_version = "HTTP/1.1"
+    timeout = 10
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def parse_request(self):
+        touch_idle_watchdog(self.server)
+        return BaseHTTPRequestHandler.parse_request(self)
+
+
+    def handle_one_request(self):
+        BaseHTTPRequestHandler.handle_one_request(self)
+        touch_idle_watchdog(self.server)
+
 
     def do_GET(self):
         req = urlparse.urlparse(self.path)
@@ -120,6 +651,15 @@ class MojoHandlers(BaseHTTPRequestHandler):
         try:
             if req.path == "/healthcheck":
                 return self.handle_healthcheck()
+            if req.path == "/stats":
+                return self.handle_stats()
+            if req.path == "/aliases":
+                return self.send_text(json.dumps(mojo_store.aliases()), content_type="application/json")
+            if req.path == "/shadows":
+                return self.send_text(json.dumps(shadow_scorer.stats()), content_type="application/json")
+            if len(pathparts) == 3 and pathparts[1] == "shadows":
+                # GET /shadows/{mojo_id}
+                return self.handle_shadow_stats(pathparts[2])
             if req.path == "/loadmojo":
                 filename = params.get("file")
                 if isinstance(filename, list):
@@ -140,9 +680,35 @@ class MojoHandlers(BaseHTTPRequestHandler):
 
 
     def do_POST(self):
+        req = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(req.query)
+        pathparts = req.path.split("/")
         try:
+            # The body must be consumed even if it is not used, otherwise it would be
+            # mistaken for the next request on the same (kept-alive) connection.
+            body = self.read_body()
             if self.path == "/shutdown":
                 return self.handle_shutdown()
+            if len(pathparts) == 3 and pathparts[1] == "aliases":
+                # POST /aliases/{name}?id=...
+                return self.handle_set_alias(pathparts[2], params)
+            if len(pathparts) == 3 and pathparts[1] == "shadows":
+                # POST /shadows/{mojo_id}?shadow=...&tolerance=...&rate=...
+                return self.handle_set_shadow(pathparts[2], params)
+            if len(pathparts) == 3 and pathparts[1] == "mojos":
+                # POST /mojos/{mojo_id}
+                mojo_id = pathparts[2]
+                return self.handle_mojo_batch(mojo_id, body)
+            if len(pathparts) == 4 and pathparts[1] == "mojos":
+                # POST /mojos/{mojo_id}/{method}
+                mojo_id = pathparts[2]
+                method_name = pathparts[3]
+                return self.handle_mojo_method_binary(mojo_id, method_name, body)
+            if len(pathparts) == 5 and pathparts[1] == "mojos" and pathparts[4] == "shm":
+                # POST /mojos/{mojo_id}/{method}/shm?in=...&out=...&nrows=...&ncols=...&npreds=...
+                mojo_id = pathparts[2]
+                method_name = pathparts[3]
+                return self.handle_mojo_method_shm(mojo_id, method_name, params)
             self.send_error(404, "Unrecognized endpoint %s" % self.path)
         except Exception as e:
             self.send_error(500, "Exception: %s\n\n%s" % (e, traceback.format_exc()))
@@ -155,30 +721,58 @@ class MojoHandlers(BaseHTTPRequestHandler):
             if len(pathparts) == 3 and pathparts[1] == "mojos":
                 mojo_id = pathparts[2]
                 return self.handle_unload_mojo(mojo_id)
+            if len(pathparts) == 3 and pathparts[1] == "aliases":
+                return self.handle_remove_alias(pathparts[2])
+            if len(pathparts) == 3 and pathparts[1] == "shadows":
+                return self.handle_remove_shadow(pathparts[2])
             self.send_error(404, "Unrecognized endpoint %s" % self.path)
         except Exception as e:
             self.send_error(500, "Exception: %s\n\n%s" % (e, traceback.format_exc()))
 
 
     def send_error(self, errorCode, message=""):
-        self.send_response(errorCode)
-        self.send_header("Content-type", "text/plain")
+        self.send_text(message, code=errorCode)
+
+
+    def read_body(self):
+        """Read the body of the request, according to its Content-Length header."""
+        length = int(self.headers.getheader("Content-Length", 0))
+        return self.rfile.read(length) if length > 0 else ""
+
+
+    def send_text(self, text, code=200, content_type="text/plain"):
+        """Send a complete response with body ``text``."""
+        self.send_response(code)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(text)))
         self.end_headers()
-        self.wfile.write(message)
+        self.wfile.write(text)
 
 
     def handle_healthcheck(self):
         """Handler for `GET /healthcheck`"""
         self.send_response(418)
+        self.send_header("Content-Length", "0")
         self.end_headers()
 
 
+    def handle_stats(self):
+        """Handler for `GET /stats`"""
+        stats = mojo_store.stats()
+        stats.update(prediction_cache.stats())
+        self.send_text(json.dumps(stats), content_type="application/json")
+
+
     def handle_shutdown(self):
         """Handler for `POST /shutdown`"""
-        global shutdown_requested
-        shutdown_requested = True
+        self.close_connection = True
         self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.send_header("Connection", "close")
         self.end_headers()
+        # `shutdown()` waits until the serving loop exits, and in the single-threaded
+        # mode that loop is the one running this handler.
+        threading.Thread(target=self.server.shutdown).start()
 
 
     def handle_load_mojo(self, filename):
@@ -187,23 +781,99 @@ class MojoHandlers(BaseHTTPRequestHandler):
             self.send_error(404, "Parameter {file} is missing")
             return
 
-        # Load the mojo...
-        model = h2omojo.load_mojo_model(filename)
-        id = mojo_store.add_model(model)
+        # Reuse the model if this file was loaded already
+        key = mojo_file_key(filename)
+        id = mojo_store.acquire_model(key)
+        if id is None:
+            if mojo_store.frozen:
+                self.send_error(400, "Only the preloaded mojos can be used in the pre-fork mode, not %s" % filename)
+                return
+            # Load the mojo...
+            model = h2omojo.load_mojo_model(filename)
+            id = mojo_store.add_model(ModelInfo(model), key)
+        self.send_text(id)
 
+
+    def handle_unload_mojo(self, mojo_id):
+        """Handler for `DELETE /mojos/{mojo_id}`"""
+        # The models of a pre-fork server stay loaded for as long as the server runs
+        if not mojo_store.frozen:
+            mojo_store.release_model(mojo_id)
         self.send_response(200)
-        self.send_header("Content-type", "text/plain")
+        self.send_header("Content-Length", "0")
         self.end_headers()
-        self.wfile.write(id)
 
 
-    def handle_unload_mojo(self, mojo_id):
-        """Handler for `DELETE /mojos/{mojo_id}`"""
-        mojo_store.del_model(mojo_id)
+    def handle_set_alias(self, name, params):
+        """Handler for `POST /aliases/{name}?id=...`: responds with the id of the alias's previous model."""
+        mojo_id = params.get("id", [None])[0]
+        if not ALIAS_RE.match(name):
+            self.send_error(400, "Invalid alias %s: it must start with a letter" % name)
+        elif mojo_store.frozen:
+            self.send_error(400, "Aliases cannot be changed in the pre-fork mode")
+        elif mojo_store.get_model(mojo_id) is None:
+            self.send_error(404, "Model %s not found" % mojo_id)
+        else:
+            self.send_text(mojo_store.set_alias(name, mojo_id) or "")
+
+
+    def handle_remove_alias(self, name):
+        """Handler for `DELETE /aliases/{name}`"""
+        if name not in mojo_store.aliases():
+            self.send_error(404, "Alias %s not found" % name)
+            return
+        mojo_store.remove_alias(name)
         self.send_response(200)
+        self.send_header("Content-Length", "0")
         self.end_headers()
 
 
+    def handle_set_shadow(self, mojo_id, params):
+        """Handler for `POST /shadows/{mojo_id}?shadow=...&tolerance=...&rate=...`"""
+        shadow_id = params.get("shadow", [None])[0]
+        try:
+            tolerance = float(params.get("tolerance", ["1e-10"])[0])
+            rate = float(params.get("rate", ["1"])[0])
+        except ValueError as e:
+            self.send_error(400, "Invalid parameter: %s" % e)
+            return
+        mojo_id = mojo_store.resolve(mojo_id)
+        if not 0 < rate <= 1:
+            self.send_error(400, "The rate must be in (0, 1], not %s" % rate)
+        elif mojo_store.frozen:
+            # Each worker would mirror (and count) only the calls that it serves itself
+            self.send_error(400, "Shadows cannot be set in the pre-fork mode")
+        elif mojo_store.get_model(mojo_id) is None:
+            self.send_error(404, "Model %s not found" % mojo_id)
+        elif mojo_store.get_model(shadow_id) is None:
+            self.send_error(404, "Model %s not found" % shadow_id)
+        else:
+            shadow_scorer.set_shadow(mojo_id, mojo_store.resolve(shadow_id), tolerance, rate)
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+
+    def handle_shadow_stats(self, mojo_id):
+        """Handler for `GET /shadows/{mojo_id}`"""
+        try:
+            stats = shadow_scorer.stats(mojo_store.resolve(mojo_id))
+        except KeyError:
+            self.send_error(404, "Model %s has no shadow" % mojo_id)
+            return
+        self.send_text(json.dumps(stats), content_type="application/json")
+
+
+    def handle_remove_shadow(self, mojo_id):
+        """Handler for `DELETE /shadows/{mojo_id}`: responds with the final statistics of the shadow."""
+        try:
+            stats = shadow_scorer.remove_shadow(mojo_store.resolve(mojo_id))
+        except KeyError:
+            self.send_error(404, "Model %s has no shadow" % mojo_id)
+            return
+        self.send_text(json.dumps(stats), content_type="application/json")
+
+
     def handle_mojo_api(self, mojo_id):
         """
         Handler for `GET /mojos/{model_id}`
@@ -222,9 +892,7 @@ class MojoHandlers(BaseHTTPRequestHandler):
             self.send_error(404, "Model %s not found" % mojo_id)
             return
 
-        self.send_response(200)
-        self.send_header("Content-type", "text/plain")
-        self.end_headers()
+        self.send_text("")
         #
         # Detect the set of methods which the MOJO supports, and send their list
         # back to the client, eg:
@@ -246,156 +914,830 @@ class MojoHandlers(BaseHTTPRequestHandler):
         return result stringified.
         """
         args = [params["arg%d" % i][0] for i in range(1, len(params) + 1)]
-        model = mojo_store.get_model(mojo_id)
-        if model is None:
+        mojo_id = mojo_store.resolve(mojo_id)
+        info = mojo_store.get_model(mojo_id)
+        if info is None:
             self.send_error(404, "Model %s not found" % mojo_id)
+            return
 
-        response = ""
-        if False:
-            pass
-        elif method == "isSupervised":
-            assert len(args) == 0
-            response = str(model.is_supervised()).lower()
-        elif method == "nfeatures":
-            response = str(model.nfeatures())
-        elif method == "nclasses":
-            response = str(model.nclasses())
-        elif method == "getModelCategory":
-            response = str(model.get_model_category())
-        elif method == "getUUID":
-            response = str(model.get_uuid())
-        elif method == "getHeader":
-            v = model.get_header()
-            if v is None:
-                response = "null"
-            else:
-                response = v
-        elif method == "getModelCategories":
-            response = list_to_string(model.get_model_categories(), quotes=False)
-        elif method == "getNumCols":
-            response = str(model.get_num_cols())
-        elif method == "getResponseName":
-            response = str(model.get_response_name())
-        elif method == "getResponseIdx":
-            response = str(model.get_response_idx())
-        elif method == "getNumResponseClasses":
-            tmp = model.get_num_response_classes()
-            if tmp < 0:
-                response = "java.lang.UnsupportedOperationException: Cannot provide number of response classes for non-classifiers."
-            else:
-                response = str(tmp)
-        elif method == "isClassifier":
-            response = str(model.is_classifier()).lower()
-        elif method == "isAutoEncoder":
-            response = str(model.is_autoencoder()).lower()
-        elif method == "getDomainValues~":
-            response = "["
-            i = 0
-            nfeatures = model.nfeatures()
-            while i < nfeatures:
-                if i > 0:
-                    response += ", "
-                response += list_to_string(model.get_domain_values(i))
-                i += 1
-            i = model.get_response_idx()
-            if i >= 0:
-                response += ", "
-                response += list_to_string(model.get_domain_values(i))
-            response += "]"
-        elif method == "getPredsSize~":
-            response = str(model.get_preds_size())
-        elif method == "getNames":
-            response = list_to_string(model.get_names())
-        elif method == "getPredsSize~m":
-            response = str(model.get_preds_size())
-        elif method == "getNumClasses":
-            col_idx = int(args[0])
-            if (col_idx < 0) or (col_idx > model.get_num_cols()):
-                response = "java.lang.ArrayIndexOutOfBoundsException"
-            else:
-                response = str(model.get_num_classes(col_idx))
-        elif method == "getDomainValues~i":
-            col_idx = int(args[0])
-            if (col_idx < 0) or (col_idx > model.get_num_cols()):
-                response = "java.lang.ArrayIndexOutOfBoundsException"
-            else:
-                response = list_to_string(model.get_domain_values(col_idx))
-        elif method == "getDomainValues~s":
-            col_name = args[0] if len(args) == 1 else ""
-            response = list_to_string(model.get_domain_values(col_name))
-        elif method == "getColIdx":
-            col_name = args[0] if len(args) == 1 else ""
-            response = model.get_col_idx(col_name)
-        elif method == "mapEnum":
-            col_idx = int(args[0])
-            level_name = args[1] if len(args) == 2 else ""
-            response = model.map_enum(col_idx, level_name)
-        elif method == "score0~dada":
-            inputs_string = args[0]
-            inputs = json.loads(inputs_string)
-            preds_string = args[1]
-            preds = json.loads(preds_string)
-
-            handled = False
-            (handled, tmp) = maybe_hack_handle(model.get_uuid(), "score0~dada", inputs_string, preds_string)
-            if handled:
-                response = tmp
-
-            if model.get_model_category() == "Regression" and len(preds) == 1:
-                tolerate_short_preds_size = True
-            else:
-                tolerate_short_preds_size = False
-
-            if handled:
-                pass
-            elif len(preds) < model.get_preds_size() and not tolerate_short_preds_size:
-                response = "java.lang.ArrayIndexOutOfBoundsException"
-            else:
-                n = model.nfeatures()
-                if len(inputs) > n:
-                    inputs = inputs[:n]
-                try:
-                    preds = model.score0(inputs)
-                    if tolerate_short_preds_size:
-                        preds = preds[:1]
-                    response = list_to_string(preds, quotes=False)
-                except IndexError, e:
-                    response = "java.lang.IndexOutOfBoundsException: " + str(e)
-                except:
-                    response = "java.lang.ArrayIndexOutOfBoundsException"
-        elif method == "score0~dadda":
-            string_arr = args[0]
-            offset = float(args[1])
-            inputs = json.loads(string_arr)
-            preds = model.score0(inputs, offset)
-            response = list_to_string(preds, quotes=False)
+        shadow_args = shadow_scorer.sample(mojo_id, method, args)
+        response = invoke_cached(mojo_id, info, method, args)
+        shadow_scorer.mirror(mojo_id, method, shadow_args, response)
+        self.send_text(response)
+
+
+    def handle_mojo_method_binary(self, mojo_id, method, body):
+        """
+        Handler for `POST /mojos/{model_id}/{method}`
+
+        Same as `GET /mojos/{model_id}/{method}`, except that the arguments are passed
+        in the body of the request as a binary payload. If the client accepts it, a
+        ``double[]`` result is sent back in the same binary encoding; any other result
+        is returned as plain text.
+        """
+        mojo_id = mojo_store.resolve(mojo_id)
+        info = mojo_store.get_model(mojo_id)
+        if info is None:
+            # Like the Java server (a 404 would mean that the endpoint is not supported)
+            self.send_error(400, "Model %s not found" % mojo_id)
+            return
+        if not (self.headers.getheader("Content-Type") or "").startswith(BINARY_CONTENT_TYPE):
+            self.send_error(400, "Expected request body of type %s" % BINARY_CONTENT_TYPE)
+            return
+
+        args = decode_binary_values(body)
+        shadow_args = shadow_scorer.sample(mojo_id, method, args)
+        result = prediction_cache.invoke(mojo_id, info, method, args)
+        shadow_scorer.mirror(mojo_id, method, shadow_args, result)
+        if isinstance(result, list):
+            if BINARY_CONTENT_TYPE in (self.headers.getheader("Accept") or ""):
+                self.send_text(encode_binary_doubles(result), content_type=BINARY_CONTENT_TYPE)
+                return
+            result = list_to_string(result, quotes=False)
+        self.send_text(result)
+
+
+    def handle_mojo_method_shm(self, mojo_id, method, params):
+        """
+        Handler for `POST /mojos/{model_id}/{method}/shm?in=...&out=...&nrows=...&ncols=...&npreds=...`
+
+        Scores a matrix of rows exchanged through shared memory. The input segment
+        ``in`` holds ``nrows`` x ``ncols`` float64 values, and the ``method`` (such as
+        ``score0~dada``) is called for each of its rows as ``method(row, preds)``. The
+        results are written into the ``nrows`` x ``npreds`` output segment ``out``
+        (see `open_shared_matrix`).
+
+        The response is a JSON object ``{"rows": nrows, "errors": {row: message}}``,
+        where ``errors`` lists the rows for which the method did not return a
+        ``double[]``; their predictions in the output segment are NaNs.
+        """
+        mojo_id = mojo_store.resolve(mojo_id)
+        info = mojo_store.get_model(mojo_id)
+        if info is None:
+            # Like the Java server (a 404 would mean that the endpoint is not supported)
+            self.send_error(400, "Model %s not found" % mojo_id)
+            return
+        errors = {}
+        inputs = outputs = None
+        try:
+            try:
+                nrows, ncols, npreds = (int(params[key][0]) for key in ("nrows", "ncols", "npreds"))
+                if nrows > 0:
+                    inputs = open_shared_matrix(params["in"][0], nrows, ncols, writable=False)
+                    outputs = open_shared_matrix(params["out"][0], nrows, npreds, writable=True)
+            except (KeyError, ValueError, EnvironmentError) as e:
+                self.send_error(400, "Invalid shared memory request: %s" % e)
+                return
+
+            in_row = struct.Struct("<%dd" % ncols)
+            out_row = struct.Struct("<%dd" % npreds)
+            nans = [float("nan")] * npreds
+            for i in range(nrows):
+                row = list(in_row.unpack_from(inputs, i * in_row.size))
+                args = [row, [0.0] * npreds]
+                shadow_args = shadow_scorer.sample(mojo_id, method, args)
+                result = prediction_cache.invoke(mojo_id, info, method, args)
+                shadow_scorer.mirror(mojo_id, method, shadow_args, result)
+                if isinstance(result, list):
+                    preds = (result + nans)[:npreds]
+                else:
+                    errors[str(i)] = result
+                    preds = nans
+                out_row.pack_into(outputs, i * out_row.size, *preds)
+        finally:
+            if inputs is not None:
+                inputs.close()
+            if outputs is not None:
+                outputs.close()
+        self.send_text(json.dumps({"rows": nrows, "errors": errors}), content_type="application/json")
+
+
+    def handle_mojo_batch(self, mojo_id, body):
+        """
+        Handler for `POST /mojos/{model_id}`
+
+        The body of the request is a JSON list of commands ``[method, arg1, ..., argN]``,
+        which are executed on the model ``model_id`` one after another. The
+        response is a JSON list with the results of all commands, in the same
+        order. Each result is the same as would have been produced by the
+        `GET /mojos/{model_id}/{method}` endpoint.
+        """
+        mojo_id = mojo_store.resolve(mojo_id)
+        info = mojo_store.get_model(mojo_id)
+        if info is None:
+            self.send_error(404, "Model %s not found" % mojo_id)
+            return
+        commands = json.loads(body)
+        if not isinstance(commands, list):
+            self.send_error(400, "Expected a JSON list of commands")
+            return
+
+        results = []
+        for command in commands:
+            if not isinstance(command, list) or not command:
+                self.send_error(400, "Command %r is not a list [method, arg1, ..., argN]" % (command, ))
+                return
+            method = command[0].encode("utf-8")
+            args = [arg.encode("utf-8") for arg in command[1:]]
+            shadow_args = shadow_scorer.sample(mojo_id, method, args)
+            result = invoke_cached(mojo_id, info, method, args)
+            # Each result is the text that the GET endpoint would have sent, even if a method returned a number
+            results.append(result if isinstance(result, basestring) else str(result))
+            shadow_scorer.mirror(mojo_id, method, shadow_args, results[-1])
+
+        self.send_text(json.dumps(results), content_type="application/json")
+
+
+def invoke_mojo_method(info, method, args):
+    """
+    Execute ``method`` on the model ``info`` with the given list of (string) ``args``.
+
+    Returns the result of the method, stringified in the same way as it would have
+    been by the Java backend.
+    """
+    result = invoke_mojo_method_raw(info, method, args)
+    if isinstance(result, list):
+        return list_to_string(result, quotes=False)
+    return result
+
+
+def invoke_cached(mojo_id, info, method, args):
+    """Same as `invoke_mojo_method` on the model ``mojo_id`` (``info``), using the `prediction_cache`."""
+    result = prediction_cache.invoke(mojo_id, info, method, args)
+    if isinstance(result, list):
+        return list_to_string(result, quotes=False)
+    return result
+
+
+def invoke_mojo_method_raw(info, method, args):
+    """
+    Same as `invoke_mojo_method`, except that ``double[]`` results are returned as
+    lists of floats. The args may also contain lists of floats for the ``double[]``
+    parameters.
+    """
+    handler = mojo_methods.get(method)
+    if handler is None:
+        return "Unknown method " + method
+    return handler(info, args)
+
+
+def parse_doubles(arg):
+    """Convert a ``double[]`` argument, given either as a string or as a list of floats."""
+    return arg if isinstance(arg, list) else json.loads(arg)
+
+
+#----------------------------------------------------------
+# Binary payloads (content type application/x-mojo-binary):
+# a sequence of values, each one being a one-byte tag and a
+# little-endian uint32 length, followed by either `length`
+# little-endian float64s (tag "d") or `length` bytes of a
+# UTF-8 string (tag "s").
+#----------------------------------------------------------
+
+BINARY_CONTENT_TYPE = "application/x-mojo-binary"
+
+def decode_binary_values(data):
+    values = []
+    pos = 0
+    while pos < len(data):
+        tag, n = struct.unpack_from("<cI", data, pos)
+        pos += 5
+        if tag == "d":
+            values.append(list(struct.unpack_from("<%dd" % n, data, pos)))
+            pos += 8 * n
+        elif tag == "s":
+            values.append(data[pos:pos + n])
+            pos += n
         else:
-            response = "Unknown method " + method
+            raise ValueError("Unknown value tag %r in the binary payload" % tag)
+    if pos != len(data):
+        raise ValueError("Truncated binary payload")
+    return values
 
-        self.send_response(200)
-        self.send_header("Content-type", "text/plain")
-        self.end_headers()
-        self.wfile.write(response)
+def encode_binary_doubles(values):
+    return struct.pack("<cI%dd" % len(values), "d", len(values), *values)
+
+
+#----------------------------------------------------------
+# Shared memory matrices: a POSIX shared memory segment
+# (a file in /dev/shm) holding nrows x ncols little-endian
+# float64 values, row after row.
+#----------------------------------------------------------
+
+SHM_DIR = "/dev/shm"
+SHM_NAME_RE = re.compile(r"^\w[\w.-]*$")
+
+def open_shared_matrix(name, nrows, ncols, writable):
+    """
+    Map the shared memory segment ``name`` holding an ``nrows`` x ``ncols`` matrix,
+    and return the ``mmap``.
+    """
+    if not SHM_NAME_RE.match(name):
+        raise ValueError("Invalid shared memory segment name %r" % name)
+    if nrows <= 0 or ncols <= 0:
+        raise ValueError("Invalid shape %d x %d" % (nrows, ncols))
+    with open(os.path.join(SHM_DIR, name), "r+b" if writable else "rb") as f:
+        return mmap.mmap(f.fileno(), nrows * ncols * 8, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+
+#----------------------------------------------------------
+# Implementations of the mojo api methods, each taking the
+# `ModelInfo` and the list of string arguments, and returning
+# the stringified result.
+#----------------------------------------------------------
+
+mojo_methods = {}
+
+def mojo_method(name):
+    """Decorator that registers the function as the implementation of api method `name`."""
+    def register(fn):
+        mojo_methods[name] = fn
+        return fn
+    return register
+
+
+@mojo_method("isSupervised")
+def is_supervised(info, args):
+    assert len(args) == 0
+    return str(info.model.is_supervised()).lower()
+
+@mojo_method("nfeatures")
+def nfeatures(info, args):
+    return str(info.nfeatures)
+
+@mojo_method("nclasses")
+def nclasses(info, args):
+    return str(info.model.nclasses())
+
+@mojo_method("getModelCategory")
+def get_model_category(info, args):
+    return info.category
+
+@mojo_method("getUUID")
+def get_uuid(info, args):
+    return info.uuid
+
+@mojo_method("getHeader")
+def get_header(info, args):
+    v = info.model.get_header()
+    return "null" if v is None else v
+
+@mojo_method("getModelCategories")
+def get_model_categories(info, args):
+    return list_to_string(info.model.get_model_categories(), quotes=False)
+
+@mojo_method("getNumCols")
+def get_num_cols(info, args):
+    return str(info.model.get_num_cols())
+
+@mojo_method("getResponseName")
+def get_response_name(info, args):
+    return str(info.model.get_response_name())
+
+@mojo_method("getResponseIdx")
+def get_response_idx(info, args):
+    return str(info.model.get_response_idx())
+
+@mojo_method("getNumResponseClasses")
+def get_num_response_classes(info, args):
+    tmp = info.model.get_num_response_classes()
+    if tmp < 0:
+        return "java.lang.UnsupportedOperationException: Cannot provide number of response classes for non-classifiers."
+    return str(tmp)
+
+@mojo_method("isClassifier")
+def is_classifier(info, args):
+    return str(info.model.is_classifier()).lower()
+
+@mojo_method("isAutoEncoder")
+def is_autoencoder(info, args):
+    return str(info.model.is_autoencoder()).lower()
+
+@mojo_method("getDomainValues~")
+def get_all_domain_values(info, args):
+    model = info.model
+    domains = [list_to_string(model.get_domain_values(i)) for i in range(info.nfeatures)]
+    i = model.get_response_idx()
+    if i >= 0:
+        domains.append(list_to_string(model.get_domain_values(i)))
+    return "[" + ", ".join(domains) + "]"
+
+@mojo_method("getPredsSize~")
+@mojo_method("getPredsSize~m")
+def get_preds_size(info, args):
+    return str(info.preds_size)
+
+@mojo_method("getNames")
+def get_names(info, args):
+    return list_to_string(info.model.get_names())
+
+@mojo_method("getNumClasses")
+def get_num_classes(info, args):
+    col_idx = int(args[0])
+    if (col_idx < 0) or (col_idx > info.model.get_num_cols()):
+        return "java.lang.ArrayIndexOutOfBoundsException"
+    return str(info.model.get_num_classes(col_idx))
+
+@mojo_method("getDomainValues~i")
+def get_domain_values_by_index(info, args):
+    col_idx = int(args[0])
+    if (col_idx < 0) or (col_idx > info.model.get_num_cols()):
+        return "java.lang.ArrayIndexOutOfBoundsException"
+    return list_to_string(info.model.get_domain_values(col_idx))
+
+@mojo_method("getDomainValues~s")
+def get_domain_values_by_name(info, args):
+    col_name = args[0] if len(args) == 1 else ""
+    return list_to_string(info.model.get_domain_values(col_name))
+
+@mojo_method("getColIdx")
+def get_col_idx(info, args):
+    col_name = args[0] if len(args) == 1 else ""
+    return str(info.model.get_col_idx(col_name))
+
+@mojo_method("mapEnum")
+def map_enum(info, args):
+    col_idx = int(args[0])
+    level_name = args[1] if len(args) == 2 else ""
+    return str(info.model.map_enum(col_idx, level_name))
+
+@mojo_method("score0~dada")
+def score0(info, args):
+    if info.hacks is not None and isinstance(args[0], str) and isinstance(args[1], str):
+        hacked = info.hacks.get(("score0~dada", args[0], args[1]))
+        if hacked is not None:
+            return hacked
+
+    inputs = parse_doubles(args[0])
+    preds = parse_doubles(args[1])
+    tolerate_short_preds_size = info.category == "Regression" and len(preds) == 1
+    if len(preds) < info.preds_size and not tolerate_short_preds_size:
+        return "java.lang.ArrayIndexOutOfBoundsException"
+
+    n = info.nfeatures
+    if len(inputs) > n:
+        inputs = inputs[:n]
+    try:
+        preds = info.model.score0(inputs)
+        if tolerate_short_preds_size:
+            preds = preds[:1]
+        return list(preds)
+    except IndexError, e:
+        return "java.lang.IndexOutOfBoundsException: " + str(e)
+    except:
+        return "java.lang.ArrayIndexOutOfBoundsException"
+
+@mojo_method("score0~dadda")
+def score0_with_offset(info, args):
+    inputs = parse_doubles(args[0])
+    offset = float(args[1])
+    preds = info.model.score0(inputs, offset)
+    return list(preds)
+
+
+#----------------------------------------------------------
+# Daemon mode: the server advertises itself in a lockfile
+# (a JSON object with its pid, version, and "port" or
+# "socket"), so that the clients can find and reuse it; and
+# it shuts down once no requests were received for a while.
+#----------------------------------------------------------
+
+def server_version():
+    """Version of this server: the modification time of this script (in whole seconds)."""
+    return str(int(os.path.getmtime(os.path.abspath(__file__))))
+
+
+def write_lockfile(path, address):
+    info = {"pid": os.getpid(), "version": server_version(), "started": int(time.time())}
+    info.update(address)
+    # Write the file under a temporary name first, so that the clients never see it half-written
+    tmp_path = "%s.%d" % (path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(info, f)
+    os.rename(tmp_path, path)
+
+
+def remove_lockfile(path):
+    """Remove the lockfile, unless it has been taken over by another server in the meantime."""
+    try:
+        with open(path) as f:
+            if json.load(f).get("pid") == os.getpid():
+                os.unlink(path)
+    except (EnvironmentError, ValueError):
+        pass
+
+
+class IdleWatchdog(object):
+    """
+    Shuts the ``server`` down after ``timeout`` seconds without any requests.
+
+    The time of the latest request is kept in shared memory, so that the worker
+    processes forked by a `PreforkServer` report their requests to the watchdog
+    running in the parent process.
+    """
 
+    def __init__(self, server, timeout):
+        self.server = server
+        self.timeout = timeout
+        self._last_activity = mmap.mmap(-1, 8)
+        self.touch()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
 
-def start_server(port):
+    @property
+    def last_activity(self):
+        return struct.unpack("d", self._last_activity[:8])[0]
+
+    def touch(self):
+        self._last_activity[:8] = struct.pack("d", time.time())
+
+    def run(self):
+        while True:
+            idle = time.time() - self.last_activity
+            if idle >= self.timeout:
+                print("No requests in %d seconds, shutting down" % self.timeout)
+                self.server.shutdown()
+                return
+            time.sleep(min(self.timeout - idle, 1.0))
+
+
+def touch_idle_watchdog(server):
+    watchdog = getattr(server, "idle_watchdog", None)
+    if watchdog is not None:
+        watchdog.touch()
+
+
+def report_status(ready_fd, message):
+    """
+    Print the ``message`` that the server has started (or failed to), and also send
+    it to the client through the readiness pipe ``ready_fd`` (see `--ready-fd`).
+    """
+    print(message)
+    sys.stdout.flush()
+    if ready_fd is not None:
+        os.write(ready_fd, message + "\n")
+        os.close(ready_fd)
+
+
+def serve_until_shutdown(server, address, lockfile, idle_timeout, ready_fd):
+    """
+    Report that the server has started, and run its loop until it is shut down (by
+    a request, or by the idle watchdog if ``idle_timeout`` is given). If the
+    ``lockfile`` is given, the server is advertised in it while it's running.
+    """
+    if idle_timeout:
+        server.idle_watchdog = IdleWatchdog(server, idle_timeout)
+    if lockfile:
+        write_lockfile(lockfile, address)
+    if "port" in address:
+        report_status(ready_fd, "MojoBackend started on port %d" % address["port"])
+    else:
+        report_status(ready_fd, "MojoBackend started on socket %s" % address["socket"])
     try:
-        server = HTTPServer(("", port), MojoHandlers)
-        print("Started Mojo-REST server on port %d" % port)
-        print("MojoBackend started on port %d" % port)
+        server.serve_forever(poll_interval=SHUTDOWN_POLL_INTERVAL)
+    finally:
+        if lockfile:
+            remove_lockfile(lockfile)
+
+
+# How often the serving loop checks for a shutdown request (in seconds): the client
+# waits only a short while for the server to exit before killing it.
+SHUTDOWN_POLL_INTERVAL = 0.1
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server that handles each connection in a separate thread."""
+    daemon_threads = True
+
+
+class UnixSocketHandler(MojoHandlers):
+    """Handler for the connections to a Unix domain socket (see `UnixHTTPServer`)."""
+    # TCP_NODELAY is not applicable to Unix domain sockets
+    disable_nagle_algorithm = False
+
+    def setup(self):
+        MojoHandlers.setup(self)
+        # The clients of a Unix domain socket have no address, but the logging expects one
+        self.client_address = ("unix", 0)
+
+
+class UnixHTTPServer(UnixStreamServer):
+    """HTTP server listening on a Unix domain socket instead of a TCP port."""
+
+    def server_bind(self):
+        remove_stale_socket(self.server_address)
+        UnixStreamServer.server_bind(self)
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class ThreadedUnixHTTPServer(ThreadingMixIn, UnixHTTPServer):
+    """Unix domain socket HTTP server that handles each connection in a separate thread."""
+    daemon_threads = True
+
+
+def remove_stale_socket(path):
+    """Remove the socket file at ``path`` if it was left behind by a server that is no longer running."""
+    if not os.path.exists(path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        os.unlink(path)
+    finally:
+        sock.close()
+
+
+#----------------------------------------------------------
+# Pre-fork mode: the parent process loads the mojos (see
+# `--preload`) and forks the worker processes, which accept
+# the connections on the socket of the parent's server. The
+# workers share the memory of the models copy-on-write, and
+# score in parallel without contending for one GIL.
+#----------------------------------------------------------
+
+class PreforkServer(object):
+    """
+    Counterpart of the `HTTPServer` in the parent process of the pre-fork mode: it
+    keeps ``nworkers`` workers running the ``server``, replacing those that crash.
+
+    The server is shut down (together with all the workers) by a `SIGTERM`, by a
+    `POST /shutdown` received by any of the workers, or by the idle watchdog.
+    """
+
+    def __init__(self, server, nworkers):
+        self.server = server
+        self.nworkers = nworkers
+        self.workers = set()
+        self.running = True
+
+    def shutdown(self):
+        self.running = False
+
+    def serve_forever(self, poll_interval=0.5):
+        # The workers must not block in accept() when another worker has taken the connection
+        self.server.socket.setblocking(0)
+        mojo_store.frozen = True
+        # Collect the garbage now, so that it is not collected (writing to the shared pages) in every worker
+        gc.collect()
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.shutdown())
+        try:
+            while self.running:
+                while len(self.workers) < self.nworkers:
+                    self.workers.add(self.fork_worker())
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid in self.workers and self.running:
+                    print("Worker %d exited with status %d, replacing it" % (pid, status))
+                    self.workers.discard(pid)
+                elif not pid:
+                    time.sleep(poll_interval)
+        finally:
+            for pid in self.workers:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            for pid in self.workers:
+                try:
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+            self.workers.clear()
+
+    def fork_worker(self):
+        # Otherwise the buffered output would be printed by the worker as well
         sys.stdout.flush()
-        while not shutdown_requested:
-            server.handle_request()
+        pid = os.fork()
+        if pid:
+            return pid
+        try:
+            self.run_worker()
+        finally:
+            sys.stdout.flush()
+            os._exit(0)
+
+    def run_worker(self):
+        parent = os.getppid()
+        terminated = []
+
+        def terminate(signum, frame):
+            terminated.append(signum)
+            threading.Thread(target=self.server.shutdown).start()
+
+        signal.signal(signal.SIGTERM, terminate)
+        self.server.idle_watchdog = getattr(self, "idle_watchdog", None)
+        try:
+            self.server.serve_forever(poll_interval=SHUTDOWN_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            return
+        if not terminated:
+            # This worker received the shutdown request: shut down the parent and the other workers
+            os.kill(parent, signal.SIGTERM)
+
+
+#----------------------------------------------------------
+# Stdio transport: the server is driven by its parent process
+# over the stdin / stdout pipes. Each message is a frame: a
+# little-endian uint32 length followed by that many bytes.
+#
+# The request frame is the request line and headers, each
+# terminated by "\n", an empty line, and then the body:
+#
+#     POST /mojos/1/score0~dada\n
+#     Content-Type: application/x-mojo-binary\n
+#     \n
+#     <body>
+#
+# The response frame is "{status} {content-type}\n" followed
+# by the body of the response.
+#----------------------------------------------------------
+
+def read_frame(stream):
+    """Read one frame from the ``stream``, or return None if the stream was closed."""
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    length = struct.unpack("<I", header)[0]
+    frame = stream.read(length)
+    if len(frame) < length:
+        return None
+    return frame
+
+def write_frame(stream, frame):
+    stream.write(struct.pack("<I", len(frame)))
+    stream.write(frame)
+    stream.flush()
+
+
+class StdioHandler(MojoHandlers):
+    """
+    Handler for a single request received as a frame in the stdio mode.
+
+    The request is dispatched to the same ``do_*`` methods as in the HTTP mode,
+    however instead of being written out as an HTTP response, the response is
+    collected and returned by `handle_frame` as the response frame.
+    """
+
+    def __init__(self, server, frame):
+        head, _, body = frame.partition("\n\n")
+        lines = head.split("\n")
+        self.server = server
+        self.client_address = ("stdio", 0)
+        self.request_version = self.protocol_version
+        self.command, self.path = lines[0].split(" ", 1)
+        self.requestline = lines[0]
+        self.headers = mimetools.Message(StringIO("\n".join(lines[1:]) + "\n\n"))
+        self.body = body
+        self.wfile = StringIO()
+        self.status = 500
+        self.content_type = ""
+
+    def handle_frame(self):
+        method = getattr(self, "do_" + self.command, None)
+        if method is None:
+            self.send_error(501, "Unsupported method %s" % self.command)
+        else:
+            method()
+        return "%d %s\n" % (self.status, self.content_type) + self.wfile.getvalue()
+
+    def read_body(self):
+        return self.body
+
+    def send_response(self, code, message=None):
+        self.log_request(code)
+        self.status = code
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "content-type":
+            self.content_type = value
+
+    def end_headers(self):
+        pass
+
+
+class StdioServer(object):
+    """Counterpart of the `HTTPServer`, for the requests received over stdin."""
+
+    def __init__(self):
+        self.running = True
+
+    def shutdown(self):
+        self.running = False
+
+    def serve_forever(self, stdin, stdout):
+        while self.running:
+            frame = read_frame(stdin)
+            if frame is None:
+                break
+            write_frame(stdout, StdioHandler(self, frame).handle_frame())
+
+
+def start_stdio_server():
+    # The stdout carries the response frames, so everything else goes to stderr: not only the prints,
+    # but also whatever the native code of h2omojo writes to the file descriptor 1 (see set_verbosity)
+    sys.stdout.flush()
+    frames_out = os.fdopen(os.dup(1), "wb", 0)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    print("MojoBackend started on stdio")
+    StdioServer().serve_forever(sys.stdin, frames_out)
+    print("Server shut down at user's request.")
+
+
+def start_server(port, threaded=False, lockfile=None, idle_timeout=None, ready_fd=None, prefork=0):
+    try:
+        server_class = ThreadedHTTPServer if threaded else HTTPServer
+        server = server_class(("", port), MojoHandlers)
+    except socket.error as e:
+        report_status(ready_fd, "MojoBackend failed to start on port %d: %s" % (port, e))
+        sys.exit(1)
+    # With port 0 the OS assigns a free port, which is then reported to the client
+    port = server.server_address[1]
+    try:
+        print("Started Mojo-REST server on port %d%s%s" % (port, " (threaded)" if threaded else "",
+                                                           " with %d workers" % prefork if prefork else ""))
+        serve_until_shutdown(PreforkServer(server, prefork) if prefork else server, {"port": port},
+                             lockfile, idle_timeout, ready_fd)
+        server.server_close()
         print("Server shut down at user's request.")
     except KeyboardInterrupt:
         print("Ctrl+C pressed, shutting down")
         server.socket.close()
 
 
+def start_unix_server(path, threaded=False, lockfile=None, idle_timeout=None, ready_fd=None, prefork=0):
+    try:
+        server_class = ThreadedUnixHTTPServer if threaded else UnixHTTPServer
+        server = server_class(path, UnixSocketHandler)
+    except socket.error as e:
+        report_status(ready_fd, "MojoBackend failed to start on socket %s: %s" % (path, e))
+        sys.exit(1)
+    try:
+        print("Started Mojo-REST server on socket %s%s%s" % (path, " (threaded)" if threaded else "",
+                                                             " with %d workers" % prefork if prefork else ""))
+        serve_until_shutdown(PreforkServer(server, prefork) if prefork else server, {"socket": path},
+                             lockfile, idle_timeout, ready_fd)
+        print("Server shut down at user's request.")
+    except KeyboardInterrupt:
+        print("Ctrl+C pressed, shutting down")
+    finally:
+        server.server_close()
+
+
 if __name__ == "__main__":
     # h2omojo.set_verbosity(1)
     parser = argparse.ArgumentParser(description="Server for providing REST API access to Python MOJOs")
-    parser.add_argument("--port", help="Port on which to run the server", default=54299)
+    parser.add_argument("--port", help="Port on which to run the server (0 to let the OS choose a free port)",
+                        default=54299)
+    parser.add_argument("--threaded", help="Handle each connection in a separate thread", action="store_true")
+    parser.add_argument("--stdio", help="Serve requests received over stdin instead of a network port",
+                        action="store_true")
+    parser.add_argument("--socket", help="Path of a Unix domain socket on which to run the server "
+                                         "(instead of a network port)")
+    parser.add_argument("--lockfile", help="File in which to advertise the running server (as a daemon), not "
+                                           "used with --stdio")
+    parser.add_argument("--idle-timeout", help="Shut down after this many seconds without requests, not used "
+                                               "with --stdio", type=int)
+    parser.add_argument("--ready-fd", help="File descriptor (inherited from the parent process) on which to report "
+                                           "that the server has started, not used with --stdio", type=int)
+    parser.add_argument("--prefork", help="Serve the requests by this many worker processes, forked after the "
+                                          "mojos are preloaded (only the preloaded mojos can be used then), "
+                                          "not used with --stdio", type=int, default=0)
+    parser.add_argument("--max-models", help="Maximum number of models kept in memory: the least recently used "
+                                             "models are evicted, and loaded again when needed", type=int, default=0)
+    parser.add_argument("--max-model-mb", help="Maximum total size (in MB) of the files of the models kept in "
+                                               "memory, see --max-models", type=int, default=0)
+    parser.add_argument("--cache-size", help="Number of predictions to cache, so that repeated rows are not scored "
+                                             "again (0 disables the cache)", type=int, default=0)
+    parser.add_argument("--snapshot", help="File in which to record the loaded models, so that they are restored "
+                                           "(with the same ids) when the server is started again with this file")
+    parser.add_argument("--preload", help="Load this mojo at startup (can be repeated)", action="append",
+                        default=[])
     args = parser.parse_args()
+    if args.snapshot and args.prefork:
+        # The models of a pre-fork server are only those given with --preload
+        print("The snapshot is not used in the pre-fork mode")
+        args.snapshot = None
 
-    start_server(int(args.port))
+    mojo_store.max_models = args.max_models
+    mojo_store.max_bytes = args.max_model_mb * 1024 * 1024
+    prediction_cache.max_size = args.cache_size
+    if args.snapshot:
+        restored = mojo_store.restore_snapshot(args.snapshot)
+    for mojofile in args.preload:
+        mojo_store.preload(mojofile)
+    if args.snapshot:
+        mojo_store.warm_up(restored)
+    if args.stdio:
+        start_stdio_server()
+    elif args.socket:
+        start_unix_server(args.socket, threaded=args.threaded, lockfile=args.lockfile,
+                          idle_timeout=args.idle_timeout, ready_fd=args.ready_fd, prefork=args.prefork)
+    else:
+        start_server(int(args.port), threaded=args.threaded, lockfile=args.lockfile,
+                     idle_timeout=args.idle_timeout, ready_fd=args.ready_fd, prefork=args.prefork)